@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare pygazebo.arrays decoders against protobuf FromString.
+
+Run from the top of the source tree with::
+
+  PYTHONPATH=. python benchmarks/bench_arrays.py
+"""
+
+import argparse
+import timeit
+
+import numpy
+
+from pygazebo import arrays
+from pygazebo.msg import laserscan_pb2
+from pygazebo.msg import pointcloud_pb2
+from pygazebo.msg import pose_v_pb2
+
+
+def make_pointcloud(count):
+    cloud = pointcloud_pb2.PointCloud()
+    for i in range(count):
+        point = cloud.points.add()
+        point.x = i
+        point.y = i * 0.5
+        point.z = -i
+    return cloud.SerializeToString()
+
+
+def make_laserscan(count):
+    scan = laserscan_pb2.LaserScan()
+    scan.frame = 'lidar'
+    for name in ['position', 'orientation']:
+        field = getattr(scan.world_pose, name)
+        for axis in field.DESCRIPTOR.fields_by_name:
+            setattr(field, axis, 0.0)
+    scan.angle_min = -1.0
+    scan.angle_max = 1.0
+    scan.angle_step = 2.0 / count
+    scan.range_min = 0.1
+    scan.range_max = 30.0
+    scan.count = count
+    scan.ranges.extend(numpy.linspace(1, 10, count).tolist())
+    return scan.SerializeToString()
+
+
+def make_pose_v(count):
+    poses = pose_v_pb2.Pose_V()
+    for i in range(count):
+        pose = poses.pose.add()
+        pose.name = 'model%d' % i
+        pose.id = i
+        pose.position.x = pose.position.y = pose.position.z = i
+        pose.orientation.x = pose.orientation.y = pose.orientation.z = 0.0
+        pose.orientation.w = 1.0
+    return poses.SerializeToString()
+
+
+def from_string_pose_v(data):
+    poses = pose_v_pb2.Pose_V.FromString(data)
+    index = dict((x.name, i) for i, x in enumerate(poses.pose))
+    position = numpy.array(
+        [(x.position.x, x.position.y, x.position.z) for x in poses.pose])
+    orientation = numpy.array(
+        [(x.orientation.x, x.orientation.y, x.orientation.z,
+          x.orientation.w) for x in poses.pose])
+    return index, position, orientation
+
+
+def from_string_pointcloud(data):
+    cloud = pointcloud_pb2.PointCloud.FromString(data)
+    return numpy.array([(p.x, p.y, p.z) for p in cloud.points])
+
+
+def from_string_laserscan(data):
+    scan = laserscan_pb2.LaserScan.FromString(data)
+    return numpy.array(scan.ranges)
+
+
+def compare(name, data, baseline, fast, repeat):
+    baseline_time = min(timeit.repeat(
+        lambda: baseline(data), number=1, repeat=repeat))
+    fast_time = min(timeit.repeat(
+        lambda: fast(data), number=1, repeat=repeat))
+    print('%-20s FromString %9.3f ms   arrays %9.3f ms   %6.1fx' % (
+        name, baseline_time * 1e3, fast_time * 1e3,
+        baseline_time / fast_time))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-n', '--count', type=int, default=100000,
+                        help='number of points or rays')
+    parser.add_argument('-p', '--poses', type=int, default=500,
+                        help='number of poses in each Pose_V')
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    compare('PointCloud', make_pointcloud(args.count),
+            from_string_pointcloud, arrays.decode_pointcloud, args.repeat)
+    compare('LaserScan', make_laserscan(args.count),
+            from_string_laserscan, arrays.decode_laserscan, args.repeat)
+    compare('Pose_V', make_pose_v(args.poses),
+            from_string_pose_v, arrays.PoseVDecoder().decode, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
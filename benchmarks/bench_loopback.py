@@ -0,0 +1,437 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Throughput and latency benchmarks over loopback sockets.
+
+Each scenario starts a :class:`tests.fake_master.FakeMaster`, connects one or more
+publishing and subscribing :class:`pygazebo.Manager` instances to it,
+and publishes a fixed number of messages from every publisher as fast
+as the connections accept them.  Everything runs in one process on a
+fresh event loop, so the figures measure pygazebo itself rather than
+Gazebo.
+
+Messages carry a sequence number in a field which is read without
+decoding the rest of the message, from which the latency of each
+delivery is found.  Up to ``window`` messages per publisher may be in
+flight, so latency includes time spent waiting in the send queues.
+
+With ``--topics N``, one node instead publishes N topics to one
+subscriber, comparing the sockets and CPU time used with and without
+multiplexing.
+
+Run from the top of the source tree with::
+
+  PYTHONPATH=. python benchmarks/bench_loopback.py --json > results.jsonl
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import argparse
+import json
+import os
+import platform
+import time
+
+from pygazebo import __version__
+from pygazebo import pygazebo
+from pygazebo import wire
+from pygazebo.msg import image_stamped_pb2
+from pygazebo.msg import laserscan_stamped_pb2
+from pygazebo.msg import pose_pb2
+from tests.fake_master import FakeMaster
+from tests.fake_master import wait_until
+
+TOPIC = '/pygazebo/bench'
+
+
+def _varint_field(number, value):
+    return (wire.encode_varint((number << 3) | wire.WIRE_VARINT) +
+            wire.encode_varint(value))
+
+
+def _length_field(number, data):
+    return (wire.encode_varint((number << 3) | wire.WIRE_LENGTH) +
+            wire.encode_varint(len(data)) + data)
+
+
+def _stamp_id(seq):
+    # Pose.id
+    return _varint_field(2, seq)
+
+
+def _stamp_time(seq):
+    # time.sec of the *Stamped messages.  nsec is required as well.
+    return _length_field(1, _varint_field(1, seq) + _varint_field(2, 0))
+
+
+def _pose():
+    result = pose_pb2.Pose()
+    result.name = 'robot'
+    result.position.x = 1.0
+    result.position.y = 2.0
+    result.position.z = 3.0
+    result.orientation.w = 1.0
+    result.orientation.x = 0.0
+    result.orientation.y = 0.0
+    result.orientation.z = 0.0
+    return result
+
+
+def _laserscan():
+    result = laserscan_stamped_pb2.LaserScanStamped()
+    scan = result.scan
+    scan.frame = 'laser'
+    scan.world_pose.CopyFrom(_pose())
+    scan.angle_min = -1.5
+    scan.angle_max = 1.5
+    scan.angle_step = 3.0 / 639
+    scan.range_min = 0.1
+    scan.range_max = 30.0
+    scan.count = 640
+    scan.ranges.extend([5.0] * 640)
+    scan.intensities.extend([1.0] * 640)
+    return result
+
+
+def _image():
+    result = image_stamped_pb2.ImageStamped()
+    image = result.image
+    image.width = 640
+    image.height = 480
+    image.pixel_format = 3  # RGB_INT8
+    image.step = 640 * 3
+    image.data = b'\x80' * (640 * 480 * 3)
+    return result
+
+
+class Kind(object):
+    """A message used in the benchmarks.
+
+    :ivar msg_type: (string) the Gazebo message type
+    :ivar body: (bytes) the serialized message without its sequence
+      field
+    :ivar stamp: (function) returns the serialized sequence field
+    :ivar depth: (int) how many fields deep the sequence number is
+    :ivar count: (int) the default number of messages per publisher
+    """
+    def __init__(self, msg_type, message, stamp, depth, count):
+        self.msg_type = msg_type
+        # The required time field is only added by stamp.
+        self.body = message.SerializePartialToString()
+        self.stamp = stamp
+        self.depth = depth
+        self.count = count
+
+
+def _kinds():
+    return {
+        'pose': Kind('gazebo.msgs.Pose', _pose(), _stamp_id, 1, 20000),
+        'laserscan': Kind('gazebo.msgs.LaserScanStamped', _laserscan(),
+                          _stamp_time, 2, 5000),
+        'image': Kind('gazebo.msgs.ImageStamped', _image(),
+                      _stamp_time, 2, 200),
+        }
+
+
+KIND_NAMES = ['pose', 'laserscan', 'image']
+
+
+def _read_stamp(data, depth):
+    # The sequence field is always serialized first.
+    pos, end = 0, len(data)
+    for i in range(depth - 1):
+        _, _, pos, end, _ = wire.read_field(data, pos, end)
+    return wire.read_field(data, pos, end)[2]
+
+
+def _percentile(values, fraction):
+    if not values:
+        return None
+    return values[int(round(fraction * (len(values) - 1)))]
+
+
+def _pump(publisher, kind, first, count, window, sent):
+    state = {'next': 0, 'outstanding': 0}
+
+    def handle_done(future):
+        future.result()
+        state['outstanding'] -= 1
+        send_more()
+
+    def send_more():
+        while state['outstanding'] < window and state['next'] < count:
+            seq = first + state['next']
+            state['next'] += 1
+            state['outstanding'] += 1
+            data = kind.stamp(seq) + kind.body
+            sent[seq] = time.time()
+            publisher.publish_raw(data).add_done_callback(handle_done)
+
+    send_more()
+
+
+def run(kind_name, publishers=1, subscribers=1, count=None, window=64,
+        use_protocol=False, shared_memory=False):
+    """Run one scenario.
+
+    :param kind_name: one of 'pose', 'laserscan' or 'image'
+    :param publishers: the number of publishing managers
+    :param subscribers: the number of subscribing managers
+    :param count: the number of messages sent by each publisher, by
+      default depending on the message kind
+    :param window: the number of messages each publisher may have
+      waiting to be written
+    :param use_protocol: passed to :func:`pygazebo.connect`
+    :param shared_memory: passed to :func:`pygazebo.Manager.subscribe`
+    :returns: the results
+    :rtype: dict
+    """
+    kind = _kinds()[kind_name]
+    if count is None:
+        count = kind.count
+
+    old_loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    master = FakeMaster()
+    managers = []
+    try:
+        address = master.start()
+
+        def connect():
+            manager = loop.run_until_complete(
+                pygazebo.connect(address, use_protocol=use_protocol))
+            managers.append(manager)
+            return manager
+
+        expected = publishers * count * subscribers
+        sent = [None] * (publishers * count)
+        latencies = []
+        totals = {'received': 0, 'bytes': 0}
+        done = asyncio.Future()
+
+        def callback(data):
+            now = time.time()
+            latencies.append(now - sent[_read_stamp(data, kind.depth)])
+            totals['received'] += 1
+            totals['bytes'] += len(data)
+            if totals['received'] == expected:
+                done.set_result(None)
+
+        subscriber_list = []
+        for i in range(subscribers):
+            subscriber_list.append(connect().subscribe(
+                TOPIC, kind.msg_type, callback,
+                shared_memory=shared_memory))
+
+        # Nothing is published before the rings are created, so size
+        # them for the message up front.
+        ring_size = pygazebo._Connection.SHM_RING_MESSAGES * (
+            len(kind.stamp(0)) + len(kind.body))
+
+        publisher_list = []
+        for i in range(publishers):
+            publisher_list.append(loop.run_until_complete(
+                connect().advertise(TOPIC, kind.msg_type,
+                                    shm_ring_size=ring_size)))
+
+        def connected():
+            if not all(len(x._connections) == publishers
+                       for x in subscriber_list):
+                return False
+            listeners = [y for x in publisher_list for y in x._listeners]
+            if len(listeners) != publishers * subscribers:
+                return False
+            return (not shared_memory or
+                    all(x._shm_writer is not None for x in listeners))
+        wait_until(connected, loop=loop)
+
+        start = time.time()
+        for i, publisher in enumerate(publisher_list):
+            _pump(publisher, kind, i * count, count, window, sent)
+        loop.run_until_complete(done)
+        elapsed = time.time() - start
+
+        latencies.sort()
+        return {
+            'kind': kind_name,
+            'msg_type': kind.msg_type,
+            'size': len(kind.body),
+            'publishers': publishers,
+            'subscribers': subscribers,
+            'count': count,
+            'window': window,
+            'transport': 'protocol' if use_protocol else 'socket',
+            'shared_memory': shared_memory,
+            'messages': totals['received'],
+            'seconds': elapsed,
+            'msgs_per_sec': totals['received'] / elapsed,
+            'mb_per_sec': totals['bytes'] / elapsed / 1e6,
+            'latency_p50_ms': _percentile(latencies, 0.5) * 1e3,
+            'latency_p99_ms': _percentile(latencies, 0.99) * 1e3,
+            'pygazebo_version': __version__,
+            'python_version': platform.python_version(),
+            }
+    finally:
+        for manager in managers:
+            manager.close()
+        master.close()
+        # Let the cancelled reads and accepts finish first.
+        loop.run_until_complete(asyncio.sleep(0.01))
+        loop.close()
+        asyncio.set_event_loop(old_loop)
+
+
+def _cpu_time():
+    times = os.times()
+    return times[0] + times[1]
+
+
+def run_topics(topics=100, count=100, multiplex=True):
+    """Run the scenario with many topics from one node.
+
+    :param topics: the number of topics
+    :param count: the number of Pose messages sent on each topic
+    :param multiplex: passed to :func:`pygazebo.connect` for the
+      subscriber
+    :returns: the results
+    :rtype: dict
+    """
+    kind = _kinds()['pose']
+
+    old_loop = asyncio.get_event_loop()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    master = FakeMaster()
+    managers = []
+    try:
+        address = master.start()
+        subscriber_manager = loop.run_until_complete(
+            pygazebo.connect(address, multiplex=multiplex))
+        managers.append(subscriber_manager)
+        publisher_manager = loop.run_until_complete(
+            pygazebo.connect(address))
+        managers.append(publisher_manager)
+
+        expected = topics * count
+        received = [0]
+        done = asyncio.Future()
+
+        def callback(data):
+            received[0] += 1
+            if received[0] == expected:
+                done.set_result(None)
+
+        names = ['%s/%d' % (TOPIC, x) for x in range(topics)]
+        start = time.time()
+        subscribers = [subscriber_manager.subscribe(
+            x, kind.msg_type, callback) for x in names]
+        publishers = [loop.run_until_complete(
+            publisher_manager.advertise(x, kind.msg_type)) for x in names]
+        wait_until(lambda: all(
+            x.wait_for_connection().done() for x in subscribers), loop=loop)
+        setup = time.time() - start
+
+        data = kind.stamp(0) + kind.body
+        cpu_start = _cpu_time()
+        start = time.time()
+        for i in range(count):
+            for publisher in publishers:
+                publisher.publish_raw(data)
+        loop.run_until_complete(done)
+        elapsed = time.time() - start
+        cpu = _cpu_time() - cpu_start
+
+        return {
+            'topics': topics,
+            'count': count,
+            'multiplex': multiplex,
+            'sockets': len(set(
+                y for x in subscribers for y in x._connections)),
+            'setup_seconds': setup,
+            'seconds': elapsed,
+            'cpu_seconds': cpu,
+            'msgs_per_sec': expected / elapsed,
+            'pygazebo_version': __version__,
+            'python_version': platform.python_version(),
+            }
+    finally:
+        for manager in managers:
+            manager.close()
+        master.close()
+        # Let the cancelled reads and accepts finish first.
+        loop.run_until_complete(asyncio.sleep(0.01))
+        loop.close()
+        asyncio.set_event_loop(old_loop)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Measure pygazebo throughput and latency.')
+    parser.add_argument('-k', '--kind', action='append',
+                        choices=KIND_NAMES,
+                        help='message kinds to run, by default all')
+    parser.add_argument('-n', type=int, default=4,
+                        help='the number of publishers and subscribers '
+                        'in the many-to-many scenarios')
+    parser.add_argument('-c', '--count', type=int,
+                        help='messages sent by each publisher')
+    parser.add_argument('-w', '--window', type=int, default=64,
+                        help='messages each publisher may have in flight')
+    parser.add_argument('--protocol', action='store_true',
+                        help='use the asyncio protocol transport')
+    parser.add_argument('--shared-memory', action='store_true',
+                        help='subscribe with shared memory')
+    parser.add_argument('--topics', type=int,
+                        help='instead compare many topics from one node '
+                        'with and without multiplexing')
+    parser.add_argument('--json', action='store_true',
+                        help='print one JSON object per scenario')
+    args = parser.parse_args()
+
+    if args.topics:
+        if not args.json:
+            print('%-10s %8s %8s %10s %10s %12s' % (
+                'multiplex', 'topics', 'sockets', 'setup s', 'cpu s',
+                'msgs/s'))
+        for multiplex in [False, True]:
+            result = run_topics(args.topics, count=args.count or 100,
+                                multiplex=multiplex)
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print('%-10s %8d %8d %10.3f %10.3f %12.0f' % (
+                    multiplex, result['topics'], result['sockets'],
+                    result['setup_seconds'], result['cpu_seconds'],
+                    result['msgs_per_sec']))
+        return
+
+    shapes = [(1, 1), (1, args.n), (args.n, 1), (args.n, args.n)]
+    if args.n == 1:
+        shapes = shapes[:1]
+
+    if not args.json:
+        print('%-10s %4s %4s %12s %10s %10s %10s' % (
+            'kind', 'pubs', 'subs', 'msgs/s', 'MB/s', 'p50 ms', 'p99 ms'))
+    for kind_name in args.kind or KIND_NAMES:
+        for publishers, subscribers in shapes:
+            result = run(kind_name, publishers, subscribers,
+                         count=args.count, window=args.window,
+                         use_protocol=args.protocol,
+                         shared_memory=args.shared_memory)
+            if args.json:
+                print(json.dumps(result, sort_keys=True))
+            else:
+                print('%-10s %4d %4d %12.0f %10.1f %10.3f %10.3f' % (
+                    kind_name, publishers, subscribers,
+                    result['msgs_per_sec'], result['mb_per_sec'],
+                    result['latency_p50_ms'], result['latency_p99_ms']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,92 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Compare the receive rate of the two connection transports.
+
+A thread writes frames into one end of a socket pair as fast as it
+can, and the other end is read with either :class:`_Connection`
+(the event loop's sock_* methods) or :class:`_ProtocolConnection`
+(an asyncio transport and protocol).
+
+Run from the top of the source tree with::
+
+  PYTHONPATH=. python benchmarks/bench_transport.py
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import argparse
+import socket
+import threading
+import time
+
+from pygazebo import pygazebo
+
+
+def _writer(sock, count, size):
+    frame = b''.join(pygazebo._make_frame(b'x' * size))
+    chunk = frame * max(1, 65536 // len(frame))
+    per_chunk = len(chunk) // len(frame)
+    sent = 0
+    while sent < count:
+        this_count = min(per_chunk, count - sent)
+        sock.sendall(chunk[:this_count * len(frame)])
+        sent += this_count
+    sock.close()
+
+
+def run(connection_class, count, size):
+    loop = asyncio.get_event_loop()
+    local, remote = socket.socketpair()
+    local.setblocking(False)
+
+    connection = connection_class()
+    attached = connection.attach(local)
+    if attached is not None:
+        loop.run_until_complete(attached)
+
+    done = asyncio.Future()
+    received = [0]
+
+    def handle_read(future):
+        if future.exception() is not None:
+            done.set_result(None)
+            return
+        received[0] += 1
+        if received[0] == count:
+            done.set_result(None)
+            return
+        connection.read_raw().add_done_callback(handle_read)
+
+    thread = threading.Thread(target=_writer, args=(remote, count, size))
+    start = time.time()
+    thread.start()
+    connection.read_raw().add_done_callback(handle_read)
+    loop.run_until_complete(done)
+    elapsed = time.time() - start
+    thread.join()
+    connection.close()
+
+    return received[0] / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-c', '--count', type=int, default=100000,
+                        help='number of frames to send')
+    parser.add_argument('-s', '--size', type=int, default=100,
+                        help='payload size of each frame in bytes')
+    args = parser.parse_args()
+
+    for name, connection_class in [
+            ('socket', pygazebo._Connection),
+            ('protocol', pygazebo._ProtocolConnection)]:
+        rate = run(connection_class, args.count, args.size)
+        print('%-10s %12.0f msgs/s' % (name, rate))
+
+
+if __name__ == '__main__':
+    main()
@@ -20,11 +20,18 @@ pygazebo is based on eventlet for asynchronous network operations.
 """
 
 from .pygazebo import connect
+from .pygazebo import message_class
+from .pygazebo import LazyMessage
 from .pygazebo import Manager
 from .pygazebo import Publisher
 from .pygazebo import Subscriber
+from .pygazebo import QUEUE_BLOCK
+from .pygazebo import QUEUE_DROP_OLDEST
+from .pygazebo import QUEUE_LATEST
 
-__all__ = ["connect", "Manager", "Publisher", "Subscriber"]
+__all__ = ["connect", "message_class", "LazyMessage",
+           "Manager", "Publisher", "Subscriber",
+           "QUEUE_BLOCK", "QUEUE_DROP_OLDEST", "QUEUE_LATEST"]
 
 __author__ = 'Josh Pieper'
 __email__ = 'jjp@pobox.com'
@@ -0,0 +1,697 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Decode bulky Gazebo sensor messages directly into NumPy arrays.
+
+The python protobuf implementation creates one python object for every
+element of a repeated field, which is very slow for range and point
+data.  The functions here instead scan the serialized message and
+build NumPy arrays from the wire bytes with vectorized operations.
+
+Each function accepts either the raw bytes handed to a subscriber
+callback, or a :class:`pygazebo.LazyMessage`.  This module requires
+NumPy, which is not otherwise a dependency of pygazebo.
+"""
+
+import struct
+
+import numpy
+
+from .pygazebo import LazyMessage
+from .pygazebo import ParseError
+from .wire import WIRE_FIXED64
+from .wire import WIRE_LENGTH
+from .wire import byte_value
+from .wire import encode_varint
+from .wire import read_field
+
+_DOUBLE = struct.Struct('<d')
+
+
+def _serialized(data):
+    if isinstance(data, LazyMessage):
+        return data.serialized_data
+    return data
+
+
+def _read_double(data, pos):
+    return _DOUBLE.unpack_from(data, pos)[0]
+
+
+def _double_run(data, number, pos, end):
+    """Decode a run of consecutive unpacked doubles with field number
+    number, where pos points to the first value (just after its tag).
+
+    :returns: (array, next_pos)
+    """
+    tag = encode_varint((number << 3) | WIRE_FIXED64)
+    stride = 8 + len(tag)
+
+    # Element k is followed by tag bytes at pos + 8 + k * stride when
+    # element k + 1 is part of the same run.
+    available = (end - pos - 8) // stride
+    count = 1
+    if available > 0:
+        raw = numpy.frombuffer(data, numpy.uint8, count=end, offset=0)
+        matches = numpy.ones(available, dtype=bool)
+        for i, value in enumerate(bytearray(tag)):
+            start = pos + 8 + i
+            matches &= raw[start:start + available * stride:stride] == value
+        mismatch = numpy.flatnonzero(~matches)
+        count += mismatch[0] if len(mismatch) else available
+
+    values = numpy.ndarray(shape=(count,), dtype='<f8', buffer=data,
+                           offset=pos, strides=(stride,))
+    return values.astype(numpy.float64), pos + (count - 1) * stride + 8
+
+
+def _read_doubles(data, number, wire_type, start, stop, end, chunks):
+    """Append the values of one occurrence of a repeated double field
+    to chunks, returning the position of the next field."""
+    if wire_type == WIRE_LENGTH:
+        # Packed encoding.
+        chunks.append(numpy.frombuffer(
+            data, '<f8', count=(stop - start) // 8, offset=start).astype(
+                numpy.float64))
+        return stop
+    elif wire_type == WIRE_FIXED64:
+        values, next_pos = _double_run(data, number, start, end)
+        chunks.append(values)
+        return next_pos
+    raise ParseError('unexpected wire type %d for field %d' % (
+        wire_type, number))
+
+
+def _concatenate(chunks):
+    if not chunks:
+        return numpy.zeros(0)
+    if len(chunks) == 1:
+        return chunks[0]
+    return numpy.concatenate(chunks)
+
+
+def _reshape(values, shape, name):
+    if len(values) != shape[0] * shape[1]:
+        raise ParseError('expected %d %s, got %d' % (
+            shape[0] * shape[1], name, len(values)))
+    return values.reshape(shape)
+
+
+def _decode_time(data, pos, end):
+    sec = 0
+    nsec = 0
+    while pos < end:
+        number, wire_type, value, _, pos = read_field(data, pos, end)
+        if number == 1:
+            sec = value
+        elif number == 2:
+            nsec = value
+    return sec, nsec
+
+
+_angle_cache = {}
+_ANGLE_CACHE_SIZE = 64
+
+
+def _linspace(start, step, count):
+    key = (start, step, count)
+    result = _angle_cache.get(key)
+    if result is None:
+        if len(_angle_cache) >= _ANGLE_CACHE_SIZE:
+            _angle_cache.clear()
+        result = start + step * numpy.arange(count)
+        result.flags.writeable = False
+        _angle_cache[key] = result
+    return result
+
+
+class LaserScanArrays(object):
+    """The contents of a LaserScan message as NumPy arrays.
+
+    Scalar fields have the same names as in
+    :class:`pygazebo.msg.laserscan_pb2.LaserScan`.  The world_pose
+    field is not decoded.
+
+    :ivar ranges: (numpy.ndarray) the range of every ray, with shape
+      (vertical_count, count)
+    :ivar intensities: (numpy.ndarray) the intensity of every ray,
+      with the same shape as ranges, or None if none were sent
+    :ivar time: (tuple) the (sec, nsec) stamp for a LaserScanStamped,
+      otherwise None
+    """
+    def __init__(self):
+        self.frame = None
+        self.angle_min = 0.0
+        self.angle_max = 0.0
+        self.angle_step = 0.0
+        self.range_min = 0.0
+        self.range_max = 0.0
+        self.count = 0
+        self.vertical_angle_min = 0.0
+        self.vertical_angle_max = 0.0
+        self.vertical_angle_step = 0.0
+        self.vertical_count = 1
+        self.ranges = None
+        self.intensities = None
+        self.time = None
+
+    def angles(self):
+        """Return the horizontal angle of each column of ranges.
+
+        The array is shared between all scans with the same geometry
+        and must not be modified."""
+        return _linspace(self.angle_min, self.angle_step, self.count)
+
+    def vertical_angles(self):
+        """Return the vertical angle of each row of ranges."""
+        return _linspace(self.vertical_angle_min, self.vertical_angle_step,
+                         self.vertical_count)
+
+    def points(self):
+        """Project the ranges into the sensor frame.
+
+        :returns: an array of shape (vertical_count * count, 3) holding
+          the x, y, z position of each ray's return
+        """
+        yaw = self.angles()[numpy.newaxis, :]
+        pitch = self.vertical_angles()[:, numpy.newaxis]
+        horizontal = self.ranges * numpy.cos(pitch)
+
+        result = numpy.empty(self.ranges.shape + (3,))
+        result[..., 0] = horizontal * numpy.cos(yaw)
+        result[..., 1] = horizontal * numpy.sin(yaw)
+        result[..., 2] = self.ranges * numpy.sin(pitch)
+        return result.reshape(-1, 3)
+
+
+_LASERSCAN_DOUBLES = {
+    3: 'angle_min',
+    4: 'angle_max',
+    5: 'angle_step',
+    6: 'range_min',
+    7: 'range_max',
+    9: 'vertical_angle_min',
+    10: 'vertical_angle_max',
+    11: 'vertical_angle_step',
+    }
+
+
+def _decode_laserscan(data, pos, end, result):
+    ranges = []
+    intensities = []
+    while pos < end:
+        number, wire_type, start, stop, pos = read_field(data, pos, end)
+        if number == 13:
+            pos = _read_doubles(data, number, wire_type, start, stop, end,
+                                ranges)
+        elif number == 14:
+            pos = _read_doubles(data, number, wire_type, start, stop, end,
+                                intensities)
+        elif number in _LASERSCAN_DOUBLES:
+            setattr(result, _LASERSCAN_DOUBLES[number],
+                    _read_double(data, start))
+        elif number == 1:
+            result.frame = data[start:stop].decode('utf-8')
+        elif number == 8:
+            result.count = start
+        elif number == 12:
+            result.vertical_count = start
+
+    result.vertical_count = max(result.vertical_count, 1)
+    shape = (result.vertical_count, result.count)
+    result.ranges = _reshape(_concatenate(ranges), shape, 'ranges')
+    if intensities:
+        result.intensities = _reshape(
+            _concatenate(intensities), shape, 'intensities')
+    return result
+
+
+def decode_laserscan(data):
+    """Decode a serialized gazebo.msgs.LaserScan.
+
+    :rtype: :class:`LaserScanArrays`
+    """
+    data = _serialized(data)
+    return _decode_laserscan(data, 0, len(data), LaserScanArrays())
+
+
+def decode_laserscan_stamped(data):
+    """Decode a serialized gazebo.msgs.LaserScanStamped.
+
+    :rtype: :class:`LaserScanArrays`
+    """
+    data = _serialized(data)
+    result = LaserScanArrays()
+    pos = 0
+    end = len(data)
+    while pos < end:
+        number, _, start, stop, pos = read_field(data, pos, end)
+        if number == 1:
+            result.time = _decode_time(data, start, stop)
+        elif number == 2:
+            _decode_laserscan(data, start, stop, result)
+    return result
+
+
+# Gazebo's common::Image::PixelFormat values, mapped to the NumPy
+# dtype and number of channels of each pixel.
+PIXEL_FORMATS = {
+    1: ('u1', 1),   # L_INT8
+    2: ('<u2', 1),  # L_INT16
+    3: ('u1', 3),   # RGB_INT8
+    4: ('u1', 4),   # RGBA_INT8
+    5: ('u1', 4),   # BGRA_INT8
+    6: ('<u2', 3),  # RGB_INT16
+    7: ('<u4', 3),  # RGB_INT32
+    8: ('u1', 3),   # BGR_INT8
+    9: ('<u2', 3),  # BGR_INT16
+    10: ('<u4', 3),  # BGR_INT32
+    11: ('<f2', 1),  # R_FLOAT16
+    12: ('<f2', 3),  # RGB_FLOAT16
+    13: ('<f4', 1),  # R_FLOAT32
+    14: ('<f4', 3),  # RGB_FLOAT32
+    15: ('u1', 1),  # BAYER_RGGB8
+    16: ('u1', 1),  # BAYER_RGGR8
+    17: ('u1', 1),  # BAYER_GBRG8
+    18: ('u1', 1),  # BAYER_GRBG8
+    }
+
+
+def _decode_image(data, pos, end):
+    width = 0
+    height = 0
+    pixel_format = 0
+    step = 0
+    start = stop = pos
+    while pos < end:
+        number, _, value, field_stop, pos = read_field(data, pos, end)
+        if number == 1:
+            width = value
+        elif number == 2:
+            height = value
+        elif number == 3:
+            pixel_format = value
+        elif number == 4:
+            step = value
+        elif number == 5:
+            start, stop = value, field_stop
+
+    if pixel_format not in PIXEL_FORMATS:
+        raise ParseError('unsupported pixel format: %d' % pixel_format)
+    dtype, channels = PIXEL_FORMATS[pixel_format]
+    dtype = numpy.dtype(dtype)
+
+    row_size = width * channels * dtype.itemsize
+    if step < row_size or (height and
+                           stop - start < (height - 1) * step + row_size):
+        raise ParseError('image data too short for %dx%d' % (
+            width, height))
+
+    if channels == 1:
+        shape = (height, width)
+        strides = (step, dtype.itemsize)
+    else:
+        shape = (height, width, channels)
+        strides = (step, channels * dtype.itemsize, dtype.itemsize)
+    result = numpy.ndarray(shape=shape, dtype=dtype, buffer=data,
+                           offset=start, strides=strides)
+    # The data may be a bytearray, which would make it writable.
+    result.flags.writeable = False
+    return result
+
+
+def decode_image(data):
+    """Decode a serialized gazebo.msgs.Image.
+
+    The result is a read-only view of the pixel data inside data, so
+    no pixels are copied.  Its shape is (height, width, channels), or
+    (height, width) for single channel and Bayer formats, and its
+    dtype is given by :data:`PIXEL_FORMATS`.
+
+    :rtype: numpy.ndarray
+    """
+    data = _serialized(data)
+    return _decode_image(data, 0, len(data))
+
+
+def decode_image_stamped(data):
+    """Decode a serialized gazebo.msgs.ImageStamped.
+
+    :returns: ((sec, nsec), image) where image is as for
+      :func:`decode_image`
+    """
+    data = _serialized(data)
+    time = None
+    image = None
+    pos = 0
+    end = len(data)
+    while pos < end:
+        number, _, start, stop, pos = read_field(data, pos, end)
+        if number == 1:
+            time = _decode_time(data, start, stop)
+        elif number == 2:
+            image = _decode_image(data, start, stop)
+    return time, image
+
+
+def decode_images_stamped(data):
+    """Decode a serialized gazebo.msgs.ImagesStamped, as sent by
+    multi-camera sensors.
+
+    :returns: ((sec, nsec), images) where images is a list of arrays
+      as for :func:`decode_image`, all viewing the same buffer
+    """
+    data = _serialized(data)
+    time = None
+    images = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        number, _, start, stop, pos = read_field(data, pos, end)
+        if number == 1:
+            time = _decode_time(data, start, stop)
+        elif number == 2:
+            images.append(_decode_image(data, start, stop))
+    return time, images
+
+
+def _decode_vector3d(data, pos, end):
+    result = numpy.zeros(3)
+    while pos < end:
+        number, wire_type, start, _, pos = read_field(data, pos, end)
+        if 2 <= number <= 4 and wire_type == WIRE_FIXED64:
+            result[number - 2] = _read_double(data, start)
+    return result
+
+
+def _vector3d_template(number):
+    """Return the bytes which precede each of x, y and z when a
+    Vector3d is encoded in the usual way as field number."""
+    tag = encode_varint((number << 3) | WIRE_LENGTH)
+    return [tag + b'\x1b\x11', b'\x19', b'\x21']
+
+
+def _vector3d_run(data, template, pos, end):
+    """Decode as many consecutive Vector3d fields starting at pos as
+    are encoded exactly like template.
+
+    :returns: an array of shape (N, 3), where N may be 0
+    """
+    stride = sum(len(x) for x in template) + 24
+    count = (end - pos) // stride
+    if count == 0:
+        return numpy.zeros((0, 3))
+
+    block = numpy.frombuffer(data, numpy.uint8, count=count * stride,
+                             offset=pos).reshape(count, stride)
+    matches = numpy.ones(count, dtype=bool)
+    offsets = []
+    column = 0
+    for prefix in template:
+        for value in bytearray(prefix):
+            matches &= block[:, column] == value
+            column += 1
+        offsets.append(column)
+        column += 8
+
+    mismatch = numpy.flatnonzero(~matches)
+    if len(mismatch):
+        count = mismatch[0]
+
+    # The three values are evenly spaced by the one byte tag between
+    # them.
+    return numpy.ndarray(
+        shape=(count, 3), dtype='<f8', buffer=data,
+        offset=pos + offsets[0],
+        strides=(stride, offsets[1] - offsets[0])).astype(numpy.float64)
+
+
+def _decode_vector3d_list(data, number, pos, end):
+    template = _vector3d_template(number)
+    stride = sum(len(x) for x in template) + 24
+    chunks = []
+    while pos < end:
+        run = _vector3d_run(data, template, pos, end)
+        if len(run):
+            chunks.append(run)
+            pos += len(run) * stride
+            continue
+
+        # Something other than a normally encoded element, decode it
+        # the slow way.
+        this_number, wire_type, start, stop, pos = read_field(
+            data, pos, end)
+        if this_number == number and wire_type == WIRE_LENGTH:
+            chunks.append(_decode_vector3d(data, start, stop)[None, :])
+
+    if not chunks:
+        return numpy.zeros((0, 3))
+    if len(chunks) == 1:
+        return chunks[0]
+    return numpy.concatenate(chunks)
+
+
+def decode_vector3d_list(data, number):
+    """Decode the repeated gazebo.msgs.Vector3d field with the given
+    field number from a serialized message.
+
+    :returns: a float64 array of shape (N, 3)
+    """
+    data = _serialized(data)
+    return _decode_vector3d_list(data, number, 0, len(data))
+
+
+def decode_pointcloud(data):
+    """Decode a serialized gazebo.msgs.PointCloud.
+
+    :returns: a float64 array of shape (N, 3)
+    """
+    return decode_vector3d_list(data, 1)
+
+
+# Byte offsets of the values within a normally encoded Vector3d or
+# Quaternion, where each value is preceded by its one byte tag.
+_VECTOR3D_TAGS = bytearray(b'\x11\x19\x21')
+_QUATERNION_TAGS = bytearray(b'\x11\x19\x21\x29')
+_VECTOR3D_OFFSETS = numpy.concatenate(
+    [numpy.arange(8) + 9 * i + 1 for i in range(3)])
+_QUATERNION_OFFSETS = numpy.concatenate(
+    [numpy.arange(8) + 9 * i + 1 for i in range(4)])
+
+
+def _is_canonical(data, start, stop, tags):
+    if stop - start != 9 * len(tags):
+        return False
+    for i, tag in enumerate(tags):
+        if byte_value(data[start + 9 * i]) != tag:
+            return False
+    return True
+
+
+def _decode_quaternion(data, pos, end):
+    result = numpy.array([0.0, 0.0, 0.0, 1.0])
+    while pos < end:
+        number, wire_type, start, _, pos = read_field(data, pos, end)
+        if 2 <= number <= 5 and wire_type == WIRE_FIXED64:
+            result[number - 2] = _read_double(data, start)
+    return result
+
+
+class PoseArrays(object):
+    """The contents of a Pose_V message as NumPy arrays.
+
+    :ivar names: (list) the name of each pose
+    :ivar index: (dict) maps each name to its row in the arrays
+    :ivar position: (numpy.ndarray) (N, 3) array of x, y, z
+    :ivar orientation: (numpy.ndarray) (N, 4) array of quaternions in
+      x, y, z, w order
+
+    names and index are shared between consecutive results of a
+    :class:`PoseVDecoder` for as long as the set of poses does not
+    change, and must not be modified.
+    """
+    def __init__(self, names, index, position, orientation):
+        self.names = names
+        self.index = index
+        self.position = position
+        self.orientation = orientation
+
+
+class _PoseVLayout(object):
+    """Where everything is inside one serialized Pose_V.
+
+    Messages from the same publisher usually differ only in the
+    values of the doubles, so a layout built from one message can
+    extract the next with a few vectorized gathers once
+    :func:`matches` has confirmed every other byte is unchanged.
+    """
+    def __init__(self, size, names, position_starts, orientation_starts,
+                 check_ranges, check_points):
+        self.size = size
+        self.names = names
+        self.index = None
+        position_starts = numpy.array(position_starts, dtype=numpy.intp)
+        orientation_starts = numpy.array(orientation_starts,
+                                         dtype=numpy.intp)
+        self.position_idx = (position_starts[:, None] +
+                             _VECTOR3D_OFFSETS).reshape(-1, 24)
+        self.orientation_idx = (orientation_starts[:, None] +
+                                _QUATERNION_OFFSETS).reshape(-1, 32)
+        self.check_idx = numpy.concatenate(
+            [numpy.arange(start, stop) for start, stop in check_ranges] +
+            [numpy.array(check_points, dtype=numpy.intp)])
+        self.check_values = None
+
+    def matches(self, raw):
+        if len(raw) != self.size:
+            return False
+        return bool((raw[self.check_idx] == self.check_values).all())
+
+    def extract(self, raw):
+        if self.check_values is None:
+            self.check_values = raw[self.check_idx]
+        position = raw[self.position_idx].view('<f8').astype(
+            numpy.float64, copy=False)
+        orientation = raw[self.orientation_idx].view('<f8').astype(
+            numpy.float64, copy=False)
+        return PoseArrays(self.names, self.index, position, orientation)
+
+
+def _scan_pose_v(data):
+    """Build a :class:`_PoseVLayout` for data, or return None if any
+    pose is encoded in an unusual way."""
+    names = []
+    position_starts = []
+    orientation_starts = []
+    check_ranges = []
+    check_points = []
+
+    pos = 0
+    end = len(data)
+    while pos < end:
+        field_pos = pos
+        number, wire_type, pose_start, pose_stop, pos = read_field(
+            data, pos, end)
+        if number != 1 or wire_type != WIRE_LENGTH:
+            return None
+        check_ranges.append((field_pos, pose_start))
+
+        name = None
+        position = None
+        orientation = None
+        pose_pos = pose_start
+        while pose_pos < pose_stop:
+            field_pos = pose_pos
+            number, _, start, stop, pose_pos = read_field(
+                data, pose_pos, pose_stop)
+            if number == 1:
+                name = data[start:stop].decode('utf-8')
+                check_ranges.append((field_pos, stop))
+            elif number == 3:
+                if not _is_canonical(data, start, stop, _VECTOR3D_TAGS):
+                    return None
+                position = start
+                check_ranges.append((field_pos, start))
+                check_points.extend(start + 9 * i for i in range(3))
+            elif number == 4:
+                if not _is_canonical(data, start, stop, _QUATERNION_TAGS):
+                    return None
+                orientation = start
+                check_ranges.append((field_pos, start))
+                check_points.extend(start + 9 * i for i in range(4))
+
+        if position is None or orientation is None:
+            return None
+        names.append(name)
+        position_starts.append(position)
+        orientation_starts.append(orientation)
+
+    return _PoseVLayout(end, names, position_starts, orientation_starts,
+                        check_ranges, check_points)
+
+
+def _decode_pose_v_slow(data):
+    names = []
+    positions = []
+    orientations = []
+    pos = 0
+    end = len(data)
+    while pos < end:
+        number, wire_type, pose_start, pose_stop, pos = read_field(
+            data, pos, end)
+        if number != 1 or wire_type != WIRE_LENGTH:
+            continue
+        name = None
+        position = numpy.zeros(3)
+        orientation = numpy.array([0.0, 0.0, 0.0, 1.0])
+        pose_pos = pose_start
+        while pose_pos < pose_stop:
+            number, _, start, stop, pose_pos = read_field(
+                data, pose_pos, pose_stop)
+            if number == 1:
+                name = data[start:stop].decode('utf-8')
+            elif number == 3:
+                position = _decode_vector3d(data, start, stop)
+            elif number == 4:
+                orientation = _decode_quaternion(data, start, stop)
+        names.append(name)
+        positions.append(position)
+        orientations.append(orientation)
+
+    return (names,
+            numpy.array(positions).reshape(-1, 3),
+            numpy.array(orientations).reshape(-1, 4))
+
+
+class PoseVDecoder(object):
+    """Decodes a stream of serialized gazebo.msgs.Pose_V messages, such
+    as those published on ~/pose/info.
+
+    The layout of the last message is remembered.  While poses keep
+    the same names and encoding, each new message is decoded with a
+    handful of vectorized copies and no per-pose python work, and the
+    names and index of the result are reused.
+    """
+    def __init__(self):
+        self._layout = None
+        self._names = None
+        self._index = None
+
+    def decode(self, data):
+        """Decode one message.
+
+        :rtype: :class:`PoseArrays`
+        """
+        data = _serialized(data)
+        raw = numpy.frombuffer(data, numpy.uint8)
+
+        if self._layout is not None and self._layout.matches(raw):
+            return self._layout.extract(raw)
+
+        layout = _scan_pose_v(data)
+        if layout is not None:
+            self._intern(layout.names)
+            layout.names = self._names
+            layout.index = self._index
+            self._layout = layout
+            return layout.extract(raw)
+
+        self._layout = None
+        names, position, orientation = _decode_pose_v_slow(data)
+        self._intern(names)
+        return PoseArrays(self._names, self._index, position, orientation)
+
+    def _intern(self, names):
+        if names != self._names:
+            self._names = names
+            self._index = dict((name, i) for i, name in enumerate(names))
+
+
+def decode_pose_v(data):
+    """Decode a single serialized gazebo.msgs.Pose_V.
+
+    Use a :class:`PoseVDecoder` when decoding a stream of messages.
+
+    :rtype: :class:`PoseArrays`
+    """
+    return PoseVDecoder().decode(data)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Topic discovery events and wildcard subscriptions.
+
+The Gazebo master announces every publisher and namespace as it
+appears.  :func:`pygazebo.Manager.watch` exposes these announcements
+as a stream of :class:`DiscoveryEvent`, and
+:func:`pygazebo.Manager.subscribe_pattern` uses them to subscribe to
+every topic matching a pattern such as
+``/gazebo/default/*/laser/scan`` as soon as it is published.
+
+In a pattern, ``*`` matches any part of a single path component,
+``**`` matches any number of whole components, and ``?`` matches one
+character other than ``/``.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import collections
+import re
+
+PUBLISHER_ADD = 'publisher_add'
+PUBLISHER_DEL = 'publisher_del'
+NAMESPACE_ADD = 'namespace_add'
+
+
+class DiscoveryEvent(object):
+    """A change in the set of known publishers or namespaces.
+
+    :ivar kind: (str) one of PUBLISHER_ADD, PUBLISHER_DEL or
+      NAMESPACE_ADD
+    :ivar record: (:class:`pygazebo.registry.PublisherRecord`) the
+      publisher which was added or removed, or None
+    :ivar namespace: (str) the namespace which was added, or None
+    """
+    __slots__ = ('kind', 'record', 'namespace')
+
+    def __init__(self, kind, record=None, namespace=None):
+        self.kind = kind
+        self.record = record
+        self.namespace = namespace
+
+    def __repr__(self):
+        return 'DiscoveryEvent(%r, %r, %r)' % (
+            self.kind, self.record, self.namespace)
+
+
+class EventStream(object):
+    """Delivers discovery events, either to a callback or, when there
+    is none, through :func:`next_event` and ``async for``."""
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.closed = False
+        self._events = collections.deque()
+        self._waiters = collections.deque()
+
+    def next_event(self):
+        """Return a Future which completes with the next event."""
+        result = asyncio.Future()
+        if self._events:
+            result.set_result(self._events.popleft())
+        else:
+            self._waiters.append(result)
+        return result
+
+    def close(self):
+        """Stop receiving events."""
+        self.closed = True
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next_event()
+
+    def _emit(self, event):
+        if self.callback is not None:
+            self.callback(event)
+            return
+
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.cancelled():
+                waiter.set_result(event)
+                return
+        self._events.append(event)
+
+
+def compile_pattern(pattern):
+    """Return a compiled regular expression for a topic pattern."""
+    result = []
+    pos = 0
+    while pos < len(pattern):
+        if pattern.startswith('**', pos):
+            result.append('.*')
+            pos += 2
+        elif pattern[pos] == '*':
+            result.append('[^/]*')
+            pos += 1
+        elif pattern[pos] == '?':
+            result.append('[^/]')
+            pos += 1
+        else:
+            result.append(re.escape(pattern[pos]))
+            pos += 1
+    return re.compile(''.join(result) + r'\Z')
+
+
+def literal_prefix(pattern):
+    """Return the leading path components of pattern which contain no
+    wildcards."""
+    wildcard = min([x for x in (pattern.find('*'), pattern.find('?'))
+                    if x >= 0] + [len(pattern)])
+    if wildcard == len(pattern):
+        return pattern
+    return pattern[:pattern.rfind('/', 0, wildcard) + 1]
+
+
+class PatternSubscription(object):
+    """Subscribes to every topic matching a pattern.
+
+    :ivar pattern: (str) the topic pattern
+    :ivar msg_type: (str) only topics of this type are subscribed to,
+      or any type if None
+    :ivar callback: (function) invoked with the topic name and data of
+      each message
+    :ivar subscribers: (dict) the :class:`pygazebo.Subscriber` for each
+      matching topic
+    """
+    def __init__(self, manager, pattern, msg_type, callback, kwargs):
+        self.pattern = pattern
+        self.msg_type = msg_type
+        self.callback = callback
+        self.subscribers = {}
+        self._manager = manager
+        self._regex = compile_pattern(pattern)
+        self._kwargs = kwargs
+
+    def matches(self, record):
+        return ((self.msg_type is None or
+                 record.msg_type == self.msg_type) and
+                self._regex.match(record.topic) is not None)
+
+    def _attach(self, record):
+        if record.topic in self.subscribers or not self.matches(record):
+            return
+
+        topic = record.topic
+        self.subscribers[topic] = self._manager.subscribe(
+            topic, record.msg_type,
+            lambda data: self.callback(topic, data), **self._kwargs)
@@ -0,0 +1,265 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Runtime statistics for connections, publishers and subscribers.
+
+Statistics are only collected by a :class:`pygazebo.Manager` created
+with ``stats=True``.  Otherwise every instrumented object holds None in
+place of its statistics, and each measurement point costs a single
+comparison.
+
+:func:`pygazebo.Manager.stats` gathers everything into nested dicts,
+which can be rendered in the Prometheus text format with
+:func:`format_prometheus`, or logged periodically with
+:class:`StatsLogger`.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import bisect
+import collections
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds of the histogram buckets, in seconds.
+BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+           0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """Counts observations in fixed buckets.
+
+    :ivar count: (int) the number of observations
+    :ivar sum: (float) the sum of all observations
+    """
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.count = 0
+        self.sum = 0.0
+        # The last entry counts everything above the largest bound.
+        self._counts = [0] * (len(buckets) + 1)
+
+    def observe(self, value):
+        self._counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other):
+        """Add the observations of other, which must have the same
+        buckets."""
+        for i, value in enumerate(other._counts):
+            self._counts[i] += value
+        self.count += other.count
+        self.sum += other.sum
+
+    def as_dict(self):
+        """Return the cumulative count at or below each bound, along
+        with the total count and sum."""
+        cumulative = []
+        total = 0
+        for bound, value in zip(self.buckets, self._counts):
+            total += value
+            cumulative.append([bound, total])
+        return {'buckets': cumulative, 'count': self.count, 'sum': self.sum}
+
+
+class ConnectionStats(object):
+    """Statistics for one :class:`pygazebo._Connection`.
+
+    :ivar bytes_in: (int) bytes read from the socket
+    :ivar frames_in: (int) complete frames read
+    :ivar bytes_out: (int) bytes of frames written, including headers
+    :ivar frames_out: (int) frames written
+    :ivar write_latency: (Histogram) seconds from a frame being handed
+      to the connection until it was written
+    """
+    def __init__(self):
+        self.bytes_in = 0
+        self.frames_in = 0
+        self.bytes_out = 0
+        self.frames_out = 0
+        self.write_latency = Histogram()
+
+    def as_dict(self):
+        return {'bytes_in': self.bytes_in,
+                'frames_in': self.frames_in,
+                'bytes_out': self.bytes_out,
+                'frames_out': self.frames_out,
+                'write_latency': self.write_latency.as_dict()}
+
+
+class PublisherStats(object):
+    """Statistics for one :class:`pygazebo.Publisher`.
+
+    :ivar messages: (int) messages published
+    :ivar bytes: (int) bytes of serialized messages published
+    """
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+
+    def as_dict(self):
+        return {'messages': self.messages, 'bytes': self.bytes}
+
+
+class SubscriberStats(object):
+    """Statistics for one :class:`pygazebo.Subscriber`.
+
+    Messages, bytes and connection events are counted once per topic,
+    by the subscriber which owns the connections.
+
+    :ivar messages: (int) messages received
+    :ivar bytes: (int) bytes of serialized messages received
+    :ivar connects: (int) connections opened to publishers
+    :ivar disconnects: (int) connections to publishers which were lost
+    :ivar reconnects: (int) connections opened after one was lost
+    :ivar decode_time: (Histogram) seconds spent selecting entities
+      and running the decoder, including any wait for the executor
+    :ivar callback_time: (Histogram) seconds spent in the callback
+    """
+    def __init__(self):
+        self.messages = 0
+        self.bytes = 0
+        self.connects = 0
+        self.disconnects = 0
+        self.reconnects = 0
+        self.decode_time = Histogram()
+        self.callback_time = Histogram()
+
+    def merge(self, other):
+        self.messages += other.messages
+        self.bytes += other.bytes
+        self.connects += other.connects
+        self.disconnects += other.disconnects
+        self.reconnects += other.reconnects
+        self.decode_time.merge(other.decode_time)
+        self.callback_time.merge(other.callback_time)
+
+    def as_dict(self):
+        return {'messages': self.messages,
+                'bytes': self.bytes,
+                'connects': self.connects,
+                'disconnects': self.disconnects,
+                'reconnects': self.reconnects,
+                'decode_time': self.decode_time.as_dict(),
+                'callback_time': self.callback_time.as_dict()}
+
+
+# Everything else numeric is a counter.
+GAUGES = frozenset(['listeners', 'connections', 'queue_depth', 'queued'])
+
+# Keys which identify a row rather than measure something.
+LABELS = ('topic', 'msg_type', 'role', 'peer')
+
+
+def _escape(value):
+    return (str(value).replace('\\', '\\\\').replace('"', '\\"')
+            .replace('\n', '\\n'))
+
+
+def _labels(row, extra=None):
+    items = [(x, row[x]) for x in LABELS if row.get(x) is not None]
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (x, _escape(y)) for x, y in items)
+
+
+def format_prometheus(stats, prefix='pygazebo'):
+    """Render the result of :func:`pygazebo.Manager.stats` in the
+    Prometheus text exposition format.
+
+    :rtype: str
+    """
+    families = collections.OrderedDict()
+
+    def add(name, kind, line):
+        families.setdefault(name, (kind, []))[1].append(line)
+
+    rows = []
+    for section in ['publishers', 'subscribers']:
+        for topic, values in sorted(stats.get(section, {}).items()):
+            row = dict(values)
+            row['topic'] = topic
+            rows.append((section[:-1], row))
+    for values in stats.get('connections', []):
+        rows.append(('connection', values))
+
+    for section, row in rows:
+        for key, value in sorted(row.items()):
+            if key in LABELS or value is None:
+                continue
+            name = '%s_%s_%s' % (prefix, section, key)
+            if isinstance(value, dict):
+                for bound, count in value['buckets']:
+                    add(name, 'histogram', '%s_bucket%s %d' % (
+                        name, _labels(row, ('le', repr(float(bound)))),
+                        count))
+                add(name, 'histogram', '%s_bucket%s %d' % (
+                    name, _labels(row, ('le', '+Inf')), value['count']))
+                add(name, 'histogram', '%s_sum%s %r' % (
+                    name, _labels(row), float(value['sum'])))
+                add(name, 'histogram', '%s_count%s %d' % (
+                    name, _labels(row), value['count']))
+            elif key in GAUGES:
+                add(name, 'gauge', '%s%s %d' % (name, _labels(row), value))
+            else:
+                add(name + '_total', 'counter', '%s_total%s %d' % (
+                    name, _labels(row), value))
+
+    lines = []
+    for name, (kind, samples) in families.items():
+        lines.append('# TYPE %s %s' % (name, kind))
+        lines.extend(samples)
+    return '\n'.join(lines) + '\n'
+
+
+def summarize(stats):
+    """Return a one line summary of the result of
+    :func:`pygazebo.Manager.stats`."""
+    parts = []
+    for topic, values in sorted(stats.get('publishers', {}).items()):
+        parts.append('pub %s msgs=%s depth=%d dropped=%d' % (
+            topic, values.get('messages', '-'), values['queue_depth'],
+            values['dropped']))
+    for topic, values in sorted(stats.get('subscribers', {}).items()):
+        callback_time = values.get('callback_time')
+        mean = '-'
+        if callback_time is not None and callback_time['count']:
+            mean = '%.3fms' % (
+                callback_time['sum'] / callback_time['count'] * 1e3)
+        parts.append('sub %s msgs=%s skipped=%d queued=%d cb=%s' % (
+            topic, values.get('messages', '-'), values['skipped'],
+            values['queued'], mean))
+    return '; '.join(parts)
+
+
+class StatsLogger(object):
+    """Periodically logs a summary of a manager's statistics."""
+    def __init__(self, manager, interval=10.0, log=None):
+        """:param manager: the :class:`pygazebo.Manager` to report on
+        :param interval: seconds between log lines
+        :param log: the logger to write to, by default this module's
+        """
+        self.manager = manager
+        self.interval = interval
+        self.log = log or logger
+        self._handle = None
+
+    def start(self):
+        self._handle = asyncio.get_event_loop().call_later(
+            self.interval, self._emit)
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _emit(self):
+        self.log.info('pygazebo stats: %s', summarize(self.manager.stats()))
+        self.start()
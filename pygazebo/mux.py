@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Carrying several topics on one connection between pygazebo peers.
+
+In the Gazebo protocol every subscription opens its own connection to
+the publishing node, and the frames on it carry no topic.  A pygazebo
+subscriber additionally sends a ``mux_request`` after its first
+subscription on a connection.  A pygazebo publisher answers with an
+ACCEPT control frame, after which the subscriber may send further
+``sub`` packets for other topics of that node on the same connection.
+
+The first topic keeps using plain frames.  For each later topic the
+publisher first sends a CHANNEL frame assigning it a number, and then
+wraps each of its messages in a DATA frame carrying that number.
+Publishers which are not pygazebo never accept, so every topic keeps
+its own connection.
+"""
+
+import struct
+
+ACCEPT = b'\x00X'
+CHANNEL_PREFIX = b'\x00C'
+DATA_PREFIX = b'\x00D'
+
+_CHANNEL = struct.Struct('<I')
+
+
+def channel_frame(channel, topic):
+    """Return the control frame assigning channel to topic."""
+    return CHANNEL_PREFIX + _CHANNEL.pack(channel) + topic.encode('utf-8')
+
+
+def parse_channel(frame):
+    """:returns: (channel, topic) from a channel frame"""
+    start = len(CHANNEL_PREFIX)
+    channel = _CHANNEL.unpack_from(frame, start)[0]
+    return channel, frame[start + _CHANNEL.size:].decode('utf-8')
+
+
+def data_prefix(channel):
+    """Return the bytes which precede a message sent on channel."""
+    return DATA_PREFIX + _CHANNEL.pack(channel)
+
+
+def parse_data(frame):
+    """:returns: (channel, payload) from a data frame"""
+    start = len(DATA_PREFIX)
+    channel = _CHANNEL.unpack_from(frame, start)[0]
+    return channel, frame[start + _CHANNEL.size:]
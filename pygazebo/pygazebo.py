@@ -6,13 +6,24 @@ try:
 except ImportError:
     import trollius as asyncio
 
+import collections
+import importlib
 import logging
 import math
+import pkgutil
+import re
 import socket
 import sys
 import time
 
+from google.protobuf import symbol_database
+
+from . import discovery
+from . import metrics
 from . import msg
+from . import mux
+from . import registry
+from . import shm
 from .msg import gz_string_pb2
 from .msg import gz_string_v_pb2
 from .msg import packet_pb2
@@ -21,8 +32,37 @@ from .msg import subscribe_pb2
 
 logger = logging.getLogger(__name__)
 
+# asyncio.async was renamed to ensure_future, and is a syntax error
+# on newer pythons.
+try:
+    _ensure_future = asyncio.ensure_future
+except AttributeError:
+    _ensure_future = getattr(asyncio, 'async')
+
 tobytes = str if sys.version_info[0] < 3 else lambda x: bytes(x, 'utf-8')
 
+# Policies for a full outgoing queue.  QUEUE_BLOCK holds new messages
+# until there is room, QUEUE_DROP_OLDEST discards the oldest waiting
+# message, and QUEUE_LATEST discards every waiting message so that
+# only the newest is sent.
+QUEUE_BLOCK = 'block'
+QUEUE_DROP_OLDEST = 'drop_oldest'
+QUEUE_LATEST = 'latest'
+
+# Lost connections to the master and to publishers which are still
+# advertised are retried, first after RECONNECT_MIN_DELAY seconds, and
+# then doubling up to RECONNECT_MAX_DELAY.
+RECONNECT_MIN_DELAY = 0.05
+RECONNECT_MAX_DELAY = 5.0
+
+# The write queue lane of frames which are never limited or dropped,
+# such as the control frames of pygazebo.mux and pygazebo.shm.
+_CONTROL = 'control'
+
+# How long further topics of a node wait to learn whether the first
+# connection to it can carry them too, before opening their own.
+MULTIPLEX_WAIT = 0.1
+
 
 class ParseError(RuntimeError):
     pass
@@ -34,6 +74,95 @@ class DisconnectError(RuntimeError):
     pass
 
 
+_message_modules_loaded = False
+
+
+def _message_module_names(msg_type):
+    # Each message is defined in the module named after its .proto
+    # file, which is the type name either in snake case or just in
+    # lower case, like gz_string_pb2 for GzString and laserscan_pb2
+    # for LaserScan.
+    name = msg_type.rsplit('.', 1)[-1]
+    result = [re.sub(r'(?<=[a-z0-9])([A-Z])', r'_\1', name).lower() + '_pb2']
+    if name.lower() + '_pb2' not in result:
+        result.append(name.lower() + '_pb2')
+    return result
+
+
+def _import_message_module(name):
+    try:
+        importlib.import_module(msg.__name__ + '.' + name)
+    except ImportError as e:
+        # Some generated modules cannot be imported everywhere, for
+        # instance those using implicit relative imports on python 3.
+        logger.debug('cannot import message module %s: %s', name, e)
+
+
+def message_class(msg_type):
+    """Look up the generated protobuf class for a Gazebo message type.
+
+    :param msg_type: the Gazebo message type string, for instance
+          'gazebo.msgs.Pose_V'
+    :type msg_type: string
+    :rtype: :class:`google.protobuf.Message` subclass
+    """
+    global _message_modules_loaded
+
+    # Message classes are only registered with the symbol database
+    # once their module has been imported.
+    database = symbol_database.Default()
+    try:
+        return database.GetSymbol(msg_type)
+    except KeyError:
+        pass
+
+    for name in _message_module_names(msg_type):
+        _import_message_module(name)
+        try:
+            return database.GetSymbol(msg_type)
+        except KeyError:
+            pass
+
+    if not _message_modules_loaded:
+        # The type is not in the module named after it, so look
+        # through all of them.
+        for _, name, _ in pkgutil.iter_modules(msg.__path__):
+            _import_message_module(name)
+        _message_modules_loaded = True
+
+    try:
+        return database.GetSymbol(msg_type)
+    except KeyError:
+        raise RuntimeError('unknown message type: ' + msg_type)
+
+
+class LazyMessage(object):
+    """A received message which is only decoded when first used.
+
+    Attributes which are not found on the :class:`LazyMessage` itself
+    are looked up on the decoded message.
+
+    :ivar serialized_data: (bytes) the serialized message
+    """
+    def __init__(self, serialized_data, message_class):
+        self.serialized_data = serialized_data
+        self._message_class = message_class
+        self._message = None
+
+    @property
+    def message(self):
+        """The decoded protobuf message."""
+        if self._message is None:
+            self._message = self._message_class.FromString(
+                self.serialized_data)
+        return self._message
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.message, name)
+
+
 class Event(object):
     """This class provides nearly identical functionality to
     asyncio.Event, but does not require coroutines."""
@@ -67,14 +196,33 @@ class Publisher(object):
 
     :ivar topic: (string) the topic name this publisher is using
     :ivar msg_type: (string) the Gazebo message type
+    :ivar queue_limit: (int) the number of messages which may wait to
+      be sent to each listener, or None for no limit
+    :ivar queue_policy: (string) what to do with a new message when a
+      listener's queue is full, one of QUEUE_BLOCK, QUEUE_DROP_OLDEST
+      or QUEUE_LATEST
+    :ivar shm_ring_size: (int) the size in bytes of the shared-memory
+      ring offered to subscribers on the same host, or None to size
+      it from the largest message published so far
+    :ivar stats: (:class:`pygazebo.metrics.PublisherStats`) or None if
+      statistics are not being collected
     """
     def __init__(self):
         """:class:`Publisher` should not be directly created"""
         self.topic = None
         self.msg_type = None
+        self.queue_limit = None
+        self.queue_policy = QUEUE_BLOCK
+        self.shm_ring_size = None
+        self.stats = None
         self._listeners = []
+        self._largest_message = 0
         self._first_listener_ready = Event()
 
+        # The channel number of each listener which carries this topic
+        # alongside others, see pygazebo.mux.
+        self._channels = {}
+
     def publish(self, msg):
         """Publish a new instance of this data.
 
@@ -82,7 +230,28 @@ class Publisher(object):
         :type msg: :class:`google.protobuf.Message` instance
         :returns: a future which completes when the data has been written
         """
-        return self._publish_impl(msg)
+        return self._publish_impl(msg.SerializeToString())
+
+    def publish_raw(self, data):
+        """Publish data which has already been serialized.
+
+        :param data: the serialized message
+        :type data: bytes
+        :returns: a future which completes when the data has been written
+        """
+        return self._publish_impl(data)
+
+    def queue_depth(self):
+        """Return the number of messages waiting to be sent to the
+        slowest listener."""
+        return max([x.lane_depth(self._channels.get(x))
+                    for x in self._listeners] + [0])
+
+    def dropped_count(self):
+        """Return the number of messages the current listeners have
+        dropped because their queue was full."""
+        return sum(x.lane_dropped(self._channels.get(x))
+                   for x in self._listeners)
 
     def wait_for_listener(self):
         """Return a Future which is complete when at least one listener is
@@ -115,24 +284,66 @@ class Publisher(object):
                 logger.debug('write error, closing connection:' + str(e))
                 if connection in self.publisher._listeners:
                     self.publisher._listeners.remove(connection)
+                    self.publisher._channels.pop(connection, None)
+                    connection.close_shared_memory()
 
             if len(self.connections) == 0:
                 self.set_result(None)
 
-    def _publish_impl(self, message):
+    def _shm_ring_size(self):
+        if self.shm_ring_size is not None:
+            return self.shm_ring_size
+        return min(_Connection.SHM_MAX_RING_SIZE,
+                   max(_Connection.SHM_MIN_RING_SIZE,
+                       _Connection.SHM_RING_MESSAGES * self._largest_message))
+
+    def _publish_impl(self, data):
+        if self.stats is not None:
+            self.stats.messages += 1
+            self.stats.bytes += len(data)
+        if len(data) > self._largest_message:
+            self._largest_message = len(data)
+
         result = Publisher.WriteFuture(self, self._listeners[:])
 
+        # The frame is built once and shared by every listener.
+        pieces = None
+
         # Try writing to each of our listeners.  If any give an error,
         # disconnect them.
         for connection in self._listeners:
-            future = connection.write(message)
+            channel = self._channels.get(connection)
+            if channel is not None:
+                prefix = mux.data_prefix(channel)
+                frame = _make_frame(data, prefix)
+            else:
+                prefix = b''
+                if pieces is None:
+                    pieces = _make_frame(data)
+                frame = pieces
+
+            ring = None
+            if connection._shm_writer is not None:
+                ring = (data, prefix)
+            future = connection.write_frame(frame, channel, ring)
             future.add_done_callback(
                 lambda future, connection=connection: result.handle_done(
                     future, connection))
 
         return result
 
-    def _connect(self, connection):
+    def _connect(self, connection, channel=None):
+        if channel is None:
+            connection.queue_limit = self.queue_limit
+            connection.queue_policy = self.queue_policy
+        else:
+            # Frames of this topic are limited separately from those
+            # of the other topics sharing the connection.
+            connection.set_channel_queue(
+                channel, self.queue_limit, self.queue_policy)
+            self._channels[connection] = channel
+        if self.stats is not None and connection.stats is None:
+            connection.stats = metrics.ConnectionStats()
         self._listeners.append(connection)
         self._first_listener_ready.set()
 
@@ -142,14 +353,82 @@ class Subscriber(object):
 
     :ivar topic: (str) The topic name this subscriber is listening for.
     :ivar msg_type: (str) The Gazebo message type.
-    :ivar callback: (function) The current function to invoke.
+    :ivar callback: (function) The current function to invoke, or None
+      if messages are retrieved with :func:`next_message`.
+    :ivar conflate: (bool) If True, only the newest message received
+      while the callback is busy is delivered, see
+      :func:`Manager.subscribe`.
+
+    If the subscription is typed, received messages are
+    :class:`LazyMessage` instances rather than raw bytes.
+
+    When no callback is given, a :class:`Subscriber` is also an
+    asynchronous iterator, so that on python 3.5 and later messages
+    can be consumed with ``async for data in subscriber``.
+    :ivar skipped: (int) The number of messages which were never
+      delivered because a newer one replaced them.
+    :ivar decoder: (function) If set, every message is passed through
+      this function in :attr:`executor` before being delivered.
+    :ivar executor: (concurrent.futures.Executor) Where
+      :attr:`decoder` is run, or None for the event loop's default
+      executor.
+    :ivar shared_memory: (bool) If True, ask publishers on the same
+      host to deliver messages through shared memory.
+    :ivar stats: (:class:`pygazebo.metrics.SubscriberStats`) or None if
+      statistics are not being collected
     """
+
+    # The most messages decoded at once in the executor, and the most
+    # waiting for their turn before reading from publishers pauses.
+    DECODE_LIMIT = 4
+
     def __init__(self, local_host, local_port):
         """:class:`Subscriber` should not be directly created"""
         logger.debug('Subscriber.__init__ %s %d', local_host, local_port)
         self.topic = None
         self.msg_type = None
         self.callback = None
+        self.conflate = False
+        self.skipped = 0
+        self.decoder = None
+        self.executor = None
+        self.shared_memory = False
+        self.stats = None
+
+        self._busy = False
+        self._latest = None
+        self._connection_class = _Connection
+        self._message_class = None
+        self._entity_filter = None
+        self._decoding = collections.deque()
+        self._decode_backlog = collections.deque()
+        self._resume_read = []
+        self._remote_connect = None
+
+        # If set, called with the address and current backoff delay of
+        # a lost publisher instead of reconnecting here.
+        self._report_lost = None
+
+        # The manager's registry, used to check whether a publisher
+        # whose connection was lost is still advertised.
+        self._registry = None
+
+        # The (host, port) of every publisher connected or being
+        # connected to.
+        self._addresses = set()
+
+        # The manager's connections which can carry more topics, by
+        # (host, port), or None if topics are not to share them.  A
+        # value of None marks a node which does not multiplex.
+        self._peers = None
+
+        # Every subscriber to the same topic shares one group, and all
+        # network connections are owned by the first of them.
+        self._primary = self
+        self._group = [self]
+
+        self._received = collections.deque()
+        self._waiters = collections.deque()
 
         self._local_host = local_host
         self._local_port = local_port
@@ -165,40 +444,146 @@ class Subscriber(object):
         raise NotImplementedError()
 
     def wait_for_connection(self):
-        return self._connection_future
+        return self._primary._connection_future
+
+    def next_message(self):
+        """Return a Future which completes with the raw data of the
+        next message received.  This may only be used when the
+        subscriber was created without a callback."""
+        result = asyncio.Future()
+        if self._received:
+            result.set_result(self._received.popleft())
+        else:
+            self._waiters.append(result)
+        return result
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return self.next_message()
 
     def _start_connect(self, pub):
+        if self._remote_connect is not None:
+            # Another process reads from this publisher for us.
+            self._remote_connect(pub)
+            return
+
         # Do the actual work in a new callback.
         asyncio.get_event_loop().call_soon(self._connect, pub)
 
-    def _connect(self, pub):
-        connection = _Connection()
+    def _connect(self, pub, delay=None):
+        address = (pub.host, pub.port)
+        if address in self._addresses:
+            # The master may announce a publisher again, for instance
+            # after we reconnected to it.
+            return
+        self._addresses.add(address)
+
+        multiplex = self._peers is not None
+        if multiplex and address in self._peers:
+            peer = self._peers[address]
+            multiplex = False
+            if peer is not None and peer._multiplex_accepted:
+                self._connect_channel(peer, pub)
+                return
+            elif peer is not None:
+                # Wait to find out if the publisher multiplexes.
+                peer._peer_waiters.append((self, pub))
+                return
+
+        connection = self._connection_class()
+        if self.stats is not None:
+            connection.stats = metrics.ConnectionStats()
+        if multiplex:
+            self._peers[address] = connection
 
         # Connect to the remote provider.
-        future = connection.connect((pub.host, pub.port))
+        future = connection.connect(address)
         future.add_done_callback(
-            lambda future: self._connect2(future, connection, pub))
+            lambda future: self._connect2(future, connection, pub, delay))
 
-    def _connect2(self, future, connection, pub):
-        future.result()  # Check for error
+    def _connect2(self, future, connection, pub, delay=None):
+        try:
+            future.result()  # Check for error
+        except Exception as e:
+            logger.debug('cannot connect to %s:%d for %s: %s',
+                         pub.host, pub.port, self.topic, e)
+            connection.close()
+            self._release_peer(connection)
+            self._reconnect_later(connection.address, delay)
+            return
 
         self._connections.append(connection)
+        if self.stats is not None:
+            self.stats.connects += 1
+            if self.stats.disconnects:
+                self.stats.reconnects += 1
 
         # Send the initial message, which is encapsulated inside of a
         # Packet structure.
-        to_send = msg.subscribe_pb2.Subscribe()
-        to_send.topic = pub.topic
-        to_send.host = self._local_host
-        to_send.port = self._local_port
-        to_send.msg_type = pub.msg_type
-        to_send.latching = False
-
-        future = connection.write_packet('sub', to_send)
+        future = connection.write_packet('sub', self._subscription(pub))
         future.add_done_callback(
             lambda future: self._connect3(future, connection))
 
+        # Publishers which are not pygazebo ignore anything sent after
+        # the subscription.
+        if self.shared_memory and _is_local_host(pub.host):
+            connection._shm_requested = True
+            connection.write_packet(
+                'shm_request', msg.gz_string_pb2.GzString(data=pub.topic))
+        if self._peers is not None and (
+                self._peers.get(connection.address) is connection):
+            connection.write_packet(
+                'mux_request', msg.gz_string_pb2.GzString(data=pub.topic))
+            asyncio.get_event_loop().call_later(
+                MULTIPLEX_WAIT, self._handle_multiplex_wait, connection)
+
+    def _handle_multiplex_wait(self, connection):
+        if connection._multiplex_accepted:
+            return
+        if self._peers.get(connection.address) is connection:
+            self._peers[connection.address] = None
+
+        # Everyone waiting gets a connection of their own.
+        waiters, connection._peer_waiters = connection._peer_waiters, []
+        for subscriber, pub in waiters:
+            subscriber._addresses.discard(connection.address)
+            subscriber._connect(pub)
+
+    def _release_peer(self, connection):
+        if self._peers is None:
+            return
+        if self._peers.get(connection.address) is connection:
+            del self._peers[connection.address]
+        waiters, connection._peer_waiters = connection._peer_waiters, []
+        for subscriber, pub in waiters:
+            subscriber._reconnect_later(connection.address, None)
+
+    def _subscription(self, pub):
+        result = msg.subscribe_pb2.Subscribe()
+        result.topic = pub.topic
+        result.host = self._local_host
+        result.port = self._local_port
+        result.msg_type = pub.msg_type
+        result.latching = False
+        return result
+
+    def _connect_channel(self, connection, pub):
+        # Subscribe on a connection another topic already opened.
+        # Messages arrive once the publisher has assigned a channel.
+        connection._channel_waiters[pub.topic] = self
+        self._connections.append(connection)
+        if self.stats is not None:
+            self.stats.connects += 1
+            if self.stats.disconnects:
+                self.stats.reconnects += 1
+        connection.write_packet('sub', self._subscription(pub))
+
     def _connect3(self, future, connection):
-        future.result()  # check for error
+        if future.exception() is not None:
+            self._handle_lost(connection)
+            return
 
         if not self._connection_future.done():
             self._connection_future.set_result(None)
@@ -207,16 +592,469 @@ class Subscriber(object):
             lambda future: self._handle_read(future, connection))
 
     def _handle_read(self, future, connection):
-        data = future.result()
+        try:
+            data = future.result()
+        except Exception as e:
+            logger.debug('read error for %s: %s', self.topic, e)
+            data = None
         if data is None:
-            self._connections.remove(connection)
-            if len(self._connections) == 0:
-                self._connection_future = asyncio.Future()
+            self._handle_lost(connection)
             return
 
-        self.callback(data)
+        # Take every frame which has already arrived, so that
+        # conflating subscribers only get the newest of them.
+        frames = [data]
+        while True:
+            try:
+                data = connection.read_buffered()
+            except Exception:
+                # The next read reports the error.
+                break
+            if data is None:
+                break
+            frames.append(data)
+
+        received = collections.OrderedDict()
+        for data in frames:
+            if data[:1] == shm.CONTROL_PREFIX:
+                try:
+                    data = self._handle_control(data, connection, received)
+                except Exception as e:
+                    # Drop the frame, but keep reading the connection.
+                    logger.warn('bad control frame for %s: %s',
+                                self.topic, e)
+                    data = None
+            if data is not None:
+                received.setdefault(self, []).append(data)
+
+        for subscriber, datas in received.items():
+            subscriber._receive_frames(datas)
+
+        # Stop reading while any decoder is too far behind, so that
+        # the publisher's queue limit applies instead.
+        for subscriber in received:
+            for member in subscriber._group:
+                if member._decode_full():
+                    member._resume_read.append(
+                        lambda: self._connect3(future, connection))
+                    return
         self._connect3(future, connection)
 
+    def _receive_frames(self, datas):
+        if self.stats is not None:
+            self.stats.messages += len(datas)
+            self.stats.bytes += sum(len(x) for x in datas)
+
+        conflating = [x for x in self._group if x.conflate]
+        if conflating and len(datas) > 1:
+            others = [x for x in self._group if not x.conflate]
+            if others:
+                for data in datas[:-1]:
+                    self._receive(data, others)
+            for subscriber in conflating:
+                subscriber.skipped += len(datas) - 1
+            datas = datas[-1:]
+
+        for data in datas:
+            self._receive(data)
+
+    def _handle_lost(self, connection):
+        if connection not in self._connections:
+            return
+
+        if self.stats is not None:
+            self.stats.disconnects += 1
+        connection.close_shared_memory()
+        connection.close()
+        self._connections.remove(connection)
+        if len(self._connections) == 0:
+            self._connection_future = asyncio.Future()
+
+        self._release_peer(connection)
+        others = (list(connection._channels.values()) +
+                  list(connection._channel_waiters.values()))
+        connection._channels = {}
+        connection._channel_waiters = {}
+        for subscriber in others:
+            subscriber._handle_lost(connection)
+
+        self._reconnect_later(connection.address, None)
+
+    def _reconnect_later(self, address, delay):
+        self._addresses.discard(address)
+        if self._report_lost is not None:
+            # Whoever asked for the connection decides when to retry.
+            self._report_lost(address, delay)
+            return
+        if self._registry is None:
+            return
+
+        if delay is None:
+            delay = RECONNECT_MIN_DELAY
+        else:
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        asyncio.get_event_loop().call_later(
+            delay, self._reconnect, address, delay)
+
+    def _reconnect(self, address, delay):
+        if self._registry is None:
+            # The manager was closed meanwhile.
+            return
+        record = self._registry.get(self.topic, address[0], address[1])
+        if record is None:
+            # The publisher has gone away.  The master will announce
+            # it again if it comes back.
+            return
+        self._connect(record, delay)
+
+    def _handle_control(self, data, connection, received=None):
+        # Data for other topics on the connection is added to
+        # received, or delivered at once if it is None.
+        if data.startswith(mux.DATA_PREFIX):
+            channel, data = mux.parse_data(data)
+            subscriber = connection._channels.get(channel)
+            if subscriber is None:
+                logger.warn('data for unknown channel %d', channel)
+                return None
+            if data.startswith(shm.HANDLE_PREFIX):
+                data = connection._shm_reader.read(data)
+            if received is None:
+                subscriber._receive_frames([data])
+            else:
+                received.setdefault(subscriber, []).append(data)
+            return None
+
+        if data.startswith(shm.HANDLE_PREFIX):
+            return connection._shm_reader.read(data)
+
+        if data.startswith(mux.CHANNEL_PREFIX):
+            channel, topic = mux.parse_channel(data)
+            subscriber = connection._channel_waiters.pop(topic, None)
+            if subscriber is None:
+                logger.warn('channel for unknown topic ' + topic)
+                return None
+            connection._channels[channel] = subscriber
+            if not subscriber._connection_future.done():
+                subscriber._connection_future.set_result(None)
+            return None
+
+        if data == mux.ACCEPT:
+            if self._peers is not None:
+                connection._multiplex_accepted = True
+                self._peers[connection.address] = connection
+                waiters, connection._peer_waiters = (
+                    connection._peer_waiters, [])
+                for subscriber, pub in waiters:
+                    subscriber._connect_channel(connection, pub)
+            return None
+
+        if data.startswith(shm.OFFER_PREFIX):
+            if not connection._shm_requested or (
+                    connection._shm_reader is not None):
+                logger.warn('unrequested shared memory offer for ' +
+                            str(self.topic))
+                return None
+            try:
+                connection._shm_reader = shm.RingReader(data)
+            except (EnvironmentError, ValueError) as e:
+                logger.debug('cannot map shared memory for %s: %s',
+                             self.topic, e)
+                return None
+            connection.write_packet(
+                'shm_accept', msg.gz_string_pb2.GzString(data=self.topic))
+            return None
+
+        logger.warn('unknown control frame for ' + str(self.topic))
+        return None
+
+    def _join(self, primary):
+        self._primary = primary
+        self._group = primary._group
+        self._group.append(self)
+
+    def _receive(self, data, group=None):
+        # Typed subscribers all share one LazyMessage, so that the
+        # message is decoded at most once.
+        lazy = None
+        for subscriber in (self._group if group is None else group):
+            this_data = data
+            if subscriber._entity_filter is not None:
+                this_data = subscriber._filter(data)
+                if this_data is None:
+                    continue
+            if subscriber.decoder is not None:
+                subscriber._start_decode(this_data)
+            elif subscriber._entity_filter is not None:
+                subscriber._dispatch_own(this_data)
+            elif subscriber._message_class is None:
+                subscriber._dispatch(data)
+            else:
+                if lazy is None:
+                    lazy = LazyMessage(data, subscriber._message_class)
+                subscriber._dispatch(lazy)
+
+    def _filter(self, data):
+        # A malformed message is dropped, rather than stopping the
+        # connection from being read.
+        start = time.time()
+        try:
+            result = self._entity_filter(data)
+        except (ParseError, ValueError) as e:
+            logger.warn('cannot select entities for %s: %s', self.topic, e)
+            return None
+        if self.stats is not None:
+            self.stats.decode_time.observe(time.time() - start)
+        return result
+
+    def _start_decode(self, data):
+        # A conflating subscriber decodes one message at a time, and
+        # of those arriving meanwhile only decodes the newest.
+        if len(self._decoding) >= self._decode_limit():
+            if self.conflate and self._decode_backlog:
+                self.skipped += len(self._decode_backlog)
+                self._decode_backlog.clear()
+            self._decode_backlog.append(data)
+            return
+        self._submit_decode(data)
+
+    def _decode_limit(self):
+        return 1 if self.conflate else self.DECODE_LIMIT
+
+    def _decode_full(self):
+        return (not self.conflate and
+                len(self._decode_backlog) >= self.DECODE_LIMIT)
+
+    def _submit_decode(self, data):
+        loop = asyncio.get_event_loop()
+        future = loop.run_in_executor(self.executor, self.decoder, data)
+        self._decoding.append(future)
+        if self.stats is not None:
+            start = time.time()
+            future.add_done_callback(
+                lambda future: self.stats.decode_time.observe(
+                    time.time() - start))
+        future.add_done_callback(self._handle_decoded)
+
+    def _handle_decoded(self, future):
+        # Deliver results in the order the messages were received,
+        # no matter which decode finishes first.
+        while self._decoding and self._decoding[0].done():
+            future = self._decoding.popleft()
+            try:
+                data = future.result()
+            except Exception as e:
+                logger.error('decode failed for %s: %s', self.topic, e)
+                continue
+            self._dispatch(data)
+
+        while (self._decode_backlog and
+               len(self._decoding) < self._decode_limit()):
+            self._submit_decode(self._decode_backlog.popleft())
+        if not self._decode_full():
+            resume, self._resume_read = self._resume_read, []
+            for callback in resume:
+                callback()
+
+    def _dispatch_own(self, data):
+        if self._message_class is not None:
+            data = LazyMessage(data, self._message_class)
+        self._dispatch(data)
+
+    def _dispatch(self, data):
+        if self.callback is None:
+            self._queue_message(data)
+        elif self.conflate:
+            self._deliver_latest(data)
+        else:
+            self._invoke(data)
+
+    def _invoke(self, data):
+        if self.stats is None:
+            result = self.callback(data)
+        else:
+            start = time.time()
+            try:
+                result = self.callback(data)
+            finally:
+                self.stats.callback_time.observe(time.time() - start)
+
+        if asyncio.iscoroutine(result):
+            # A coroutine callback only runs once it is scheduled.
+            result = _ensure_future(result)
+        return result
+
+    def _queue_message(self, data):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.cancelled():
+                waiter.set_result(data)
+                return
+
+        if self.conflate and self._received:
+            self.skipped += len(self._received)
+            self._received.clear()
+        self._received.append(data)
+
+    def _deliver_latest(self, data):
+        if self._busy:
+            if self._latest is not None:
+                self.skipped += 1
+            self._latest = data
+            return
+
+        result = self._invoke(data)
+        if isinstance(result, asyncio.Future):
+            # The callback is still working on this message, hold on
+            # to only the newest one which arrives in the meantime.
+            self._busy = True
+            result.add_done_callback(self._handle_callback_done)
+
+    def _handle_callback_done(self, future):
+        self._busy = False
+        data, self._latest = self._latest, None
+        if data is not None:
+            self._deliver_latest(data)
+
+
+class _FrameBuffer(object):
+    """Splits a stream of received bytes into Gazebo frames.
+
+    Each frame on the wire is an 8 character hexadecimal length
+    followed by that many bytes of payload.  Data is accumulated with
+    :func:`feed` and complete payloads are retrieved one at a time with
+    :func:`next_frame`.
+
+    Once the header of a large frame which is not yet complete has
+    been seen, a buffer of exactly the advertised size is allocated
+    and all further data is copied directly into it, so that large
+    frames are reassembled in linear time.
+    """
+
+    HEADER_SIZE = 8
+
+    # Frames from this size on are reassembled in their own buffer.
+    PREALLOCATE_SIZE = 65536
+
+    # Larger frames are rejected, rather than trusting a corrupt
+    # header to allocate them.
+    MAX_SIZE = 256 * 1024 * 1024
+
+    def __init__(self):
+        self._data = bytearray()
+        self._pos = 0
+        self._frame = None
+        self._frame_pos = 0
+
+    def feed(self, data):
+        """Append newly received bytes."""
+        data = memoryview(data)
+        if self._frame is not None:
+            count = min(len(data), len(self._frame) - self._frame_pos)
+            end = self._frame_pos + count
+            memoryview(self._frame)[self._frame_pos:end] = data[:count]
+            self._frame_pos = end
+            data = data[count:]
+            if len(data) == 0:
+                return
+
+        if self._pos:
+            # Discard everything which has already been handed out,
+            # so that only a partial frame ever gets moved.
+            del self._data[:self._pos]
+            self._pos = 0
+        self._data += data
+
+    def pending(self):
+        """Return the number of buffered bytes not yet handed out."""
+        result = len(self._data) - self._pos
+        if self._frame is not None:
+            result += self.HEADER_SIZE + self._frame_pos
+        return result
+
+    def peek(self):
+        return bytes(self._data[self._pos:])
+
+    def next_frame(self):
+        """Return the next complete frame payload, or None if more data
+        is required.
+
+        :rtype: bytes (str on python 2), which is never modified
+          afterwards and so may be shared by every subscriber
+        :raises: ParseError if the header is invalid or announces more
+          than :attr:`MAX_SIZE` bytes
+        """
+        if self._frame is not None:
+            if self._frame_pos < len(self._frame):
+                return None
+            result = bytes(self._frame)
+            self._frame = None
+            self._frame_pos = 0
+            return result
+
+        if len(self._data) - self._pos < self.HEADER_SIZE:
+            return None
+
+        start = self._pos + self.HEADER_SIZE
+        header = bytes(self._data[self._pos:start])
+        try:
+            size = int(header, 16)
+        except ValueError:
+            raise ParseError('invalid header: ' + str(header))
+        if size > self.MAX_SIZE:
+            raise ParseError('frame too large: %d bytes' % size)
+
+        end = start + size
+        if len(self._data) < end:
+            if size < self.PREALLOCATE_SIZE:
+                return None
+            # Move the partial payload into a buffer of the final
+            # size, which subsequent calls to feed will fill in place.
+            partial = len(self._data) - start
+            self._frame = bytearray(size)
+            self._frame[:partial] = memoryview(self._data)[start:]
+            self._frame_pos = partial
+            del self._data[:]
+            self._pos = 0
+            return None
+
+        result = memoryview(self._data)[start:end].tobytes()
+        if end == len(self._data):
+            del self._data[:]
+            self._pos = 0
+        else:
+            self._pos = end
+        return result
+
+
+# The names and address of this host, resolved on first use.
+_local_hosts = None
+
+
+def _is_local_host(host):
+    global _local_hosts
+    if host == 'localhost' or host.startswith('127.'):
+        return True
+    if _local_hosts is None:
+        # Resolving blocks the event loop, so only do it once.
+        hosts = [socket.gethostname()]
+        try:
+            hosts.append(socket.gethostbyname(hosts[0]))
+        except socket.error:
+            pass
+        _local_hosts = frozenset(hosts)
+    return host in _local_hosts
+
+
+def _make_frame(data, prefix=b''):
+    """Return the list of buffers which make up one frame on the wire
+    for the serialized payload data, preceded by prefix."""
+    header = tobytes('%08X' % (len(prefix) + len(data))) + prefix
+    if len(data) < _Connection.BUF_SIZE:
+        # Small messages are cheaper to copy once than to send with an
+        # extra system call.
+        return [header + data]
+    return [header, data]
+
 
 class _Connection(object):
     """Manages a Gazebo protocol connection.
@@ -227,10 +1065,22 @@ class _Connection(object):
     structured data on the socket.
     """
 
-    # Do all raw socket reads and writes in amounts no larger than
-    # this.
+    # Do all raw socket writes in amounts no larger than this.
     BUF_SIZE = 16384
 
+    # Unless a publisher says otherwise, the shared-memory ring offered
+    # to subscribers on the same host holds this many of its largest
+    # messages, within these bounds.  Every page of a ring is reserved
+    # as soon as it is created.
+    SHM_RING_MESSAGES = 16
+    SHM_MIN_RING_SIZE = 1024 * 1024
+    SHM_MAX_RING_SIZE = 32 * 1024 * 1024
+
+    # Request this much from the socket on every read.  Whatever
+    # arrives is buffered, and as many complete frames as possible
+    # are handed out before the socket is read again.
+    READ_SIZE = 65536
+
     def __init__(self):
         self.address = None
         self.socket = None
@@ -238,6 +1088,53 @@ class _Connection(object):
         self._local_port = None
         self._socket_ready = Event()
         self._local_ready = Event()
+        self._read_buffer = _FrameBuffer()
+
+        # Frames are queued here while waiting to be sent.  Once
+        # queue_limit frames are waiting, queue_policy decides what
+        # happens to new ones.
+        self.queue_limit = None
+        self.queue_policy = QUEUE_BLOCK
+        self.dropped = 0
+        self._write_queue = collections.deque()
+        self._blocked = collections.deque()
+
+        # Frames of other channels are limited by their own entry
+        # here, see set_channel_queue, and are counted separately.
+        self._channel_queues = {}
+        self._queued = collections.Counter()
+        self._dropped = collections.Counter()
+        self._sending = []
+
+        self._shm_pending = None
+        self._shm_writer = None
+        self._shm_reader = None
+
+        # Whether a subscriber asked for shared memory on this
+        # connection, without which no offer is accepted.
+        self._shm_requested = False
+
+        # A metrics.ConnectionStats when statistics are collected.
+        self.stats = None
+
+        # For a subscriber, whether the publisher accepted more topics
+        # on this connection, the (subscriber, pub) pairs waiting to
+        # find out, the subscribers of topics carried on it by
+        # channel, and of those still waiting for their channel by
+        # topic.  For a publisher, whether the subscriber asked to
+        # send more topics on it, and the next channel to assign.
+        self._multiplex_accepted = False
+        self._peer_waiters = []
+        self._channels = {}
+        self._channel_waiters = {}
+        self._multiplex = False
+        self._next_channel = 0
+
+        # Whether this is listening for connections, and its pending
+        # accept and receive, which are cancelled on close.
+        self._serving = False
+        self._accept_future = None
+        self._recv_future = None
 
     def connect(self, address):
         logger.debug('Connection.connect')
@@ -248,7 +1145,7 @@ class _Connection(object):
 
         # TODO jpieper: Either assert that this is numeric, or have a
         # separate DNS resolution stage.
-        future = asyncio.async(loop.sock_connect(self.socket, address))
+        future = _ensure_future(loop.sock_connect(self.socket, address))
 
         def callback_impl(future):
             try:
@@ -262,6 +1159,11 @@ class _Connection(object):
         future.add_done_callback(callback_impl)
         return future
 
+    def attach(self, sock):
+        """Use sock, which must already be connected."""
+        self.socket = sock
+        self._socket_ready.set()
+
     def serve(self, callback):
         """Start listening for new connections.  Invoke callback every
         time a new connection is available."""
@@ -273,15 +1175,22 @@ class _Connection(object):
         self.socket.setblocking(False)
         self._local_ready.set()
 
+        self._serving = True
         self.start_accept(callback)
 
     def start_accept(self, callback):
+        if not self._serving:
+            # Closed meanwhile.
+            return
         loop = asyncio.get_event_loop()
-        future = asyncio.async(loop.sock_accept(self.socket))
+        future = _ensure_future(loop.sock_accept(self.socket))
+        self._accept_future = future
         future.add_done_callback(
             lambda future: self.handle_accept(callback, future))
 
     def handle_accept(self, callback, future):
+        if not self._serving or future.cancelled():
+            return
         loop = asyncio.get_event_loop()
         loop.call_soon(lambda: self.start_accept(callback))
 
@@ -290,64 +1199,87 @@ class _Connection(object):
 
     def read_raw(self):
         result = asyncio.Future()
-
-        loop = asyncio.get_event_loop()
-        future = asyncio.async(loop.sock_recv(self.socket, 8))
-        future.add_done_callback(
-            lambda future: self.handle_read_raw_header(future, result))
+        self._read_frame(result)
         return result
 
-    def handle_read_raw_header(self, future, result):
-        try:
-            header = future.result()
-            if len(header) < 8:
-                if not header:
-                    self.socket.close()
-                    raise DisconnectError()
+    def read_buffered(self):
+        """Return the next frame which has already been received in
+        full, or None, without waiting for more data."""
+        frame = self._read_buffer.next_frame()
+        if frame is not None and self.stats is not None:
+            self.stats.frames_in += 1
+        return frame
 
-                raise ParseError('malformed header: ' + str(header))
-
-            try:
-                size = int(header, 16)
-            except ValueError:
-                raise ParseError('invalid header: ' + str(header))
-
-            self.start_read_data(bytes(), size, result)
-        except Exception as e:
-            result.set_exception(e)
-            return
-
-    def start_read_data(self, starting_data, total_size, result):
+    def _read_frame(self, result):
         try:
-            if len(starting_data) == total_size:
-                result.set_result(starting_data)
+            frame = self._read_buffer.next_frame()
+            if frame is not None:
+                if self.stats is not None:
+                    self.stats.frames_in += 1
+                result.set_result(frame)
                 return
 
             loop = asyncio.get_event_loop()
-            future = asyncio.async(
-                loop.sock_recv(self.socket,
-                               min(total_size - len(starting_data),
-                                   self.BUF_SIZE)))
+            future = _ensure_future(
+                loop.sock_recv(self.socket, self.READ_SIZE))
+            self._recv_future = future
             future.add_done_callback(
-                lambda future: self.handle_read_data(
-                    future, starting_data, total_size, result))
+                lambda future: self.handle_read_data(future, result))
         except Exception as e:
             result.set_exception(e)
             return
 
-    def handle_read_data(self, future, starting_data, total_size, result):
+    def handle_read_data(self, future, result):
+        self._recv_future = None
+        if future.cancelled():
+            result.set_exception(DisconnectError())
+            return
         try:
             data = future.result()
             if len(data) == 0:
-                result.set_result(None)
+                self._handle_eof(result)
                 return
 
-            data = starting_data + data
-            self.start_read_data(data, total_size, result)
+            if self.stats is not None:
+                self.stats.bytes_in += len(data)
+            self._read_buffer.feed(data)
+            self._read_frame(result)
         except Exception as e:
             result.set_exception(e)
             return
 
+    def _handle_eof(self, result):
+        pending = self._read_buffer.pending()
+        if pending == 0:
+            self.close()
+            result.set_exception(DisconnectError())
+        elif pending < _FrameBuffer.HEADER_SIZE:
+            result.set_exception(ParseError(
+                'malformed header: ' + str(self._read_buffer.peek())))
+        else:
+            result.set_result(None)
+
+    def close(self):
+        if self.socket is None:
+            return
+
+        self._serving = False
+        for future in [self._accept_future, self._recv_future]:
+            if future is not None:
+                future.cancel()
+
+        # Stop watching the socket first, as its descriptor may be
+        # reused as soon as it is closed.
+        try:
+            fd = self.socket.fileno()
+        except socket.error:
+            fd = -1
+        if fd >= 0:
+            loop = asyncio.get_event_loop()
+            loop.remove_reader(fd)
+            loop.remove_writer(fd)
+        self.socket.close()
+
     def read(self):
         result = asyncio.Future()
 
@@ -370,66 +1302,287 @@ class _Connection(object):
             result.set_exception(e)
             return
 
-    def send_pieces(self, data, result=None):
+    def send_pieces(self, pieces, result=None):
+        """Write each buffer of pieces to the socket, in order.
+
+        The buffers are sent through memoryview slices of no more than
+        BUF_SIZE bytes, so no part of the data is ever copied."""
         if result is None:
             result = asyncio.Future()
 
+        views = [memoryview(x) for x in pieces]
+        self._send_next(views, 0, 0, result)
+        return result
+
+    def _send_next(self, views, index, offset, result):
         try:
-            if len(data) == 0:
+            while index < len(views) and offset >= len(views[index]):
+                index += 1
+                offset = 0
+
+            if index == len(views):
                 result.set_result(None)
                 return
 
-            to_send = min(len(data), self.BUF_SIZE)
-            this_send = data[:to_send]
-            next_send = data[to_send:]
+            end = min(len(views[index]), offset + self.BUF_SIZE)
+            this_send = views[index][offset:end]
 
             loop = asyncio.get_event_loop()
-            future = asyncio.async(loop.sock_sendall(self.socket, this_send))
+            future = _ensure_future(loop.sock_sendall(self.socket, this_send))
             future.add_done_callback(
-                lambda future: self.send_pieces(next_send, result))
+                lambda future: self._handle_sent(
+                    future, views, index, end, result))
         except Exception as e:
             result.set_exception(e)
 
-        return result
+    def _handle_sent(self, future, views, index, offset, result):
+        try:
+            future.result()  # check for error
+        except Exception as e:
+            result.set_exception(e)
+            return
+
+        self._send_next(views, index, offset, result)
 
     def write(self, message):
+        return self.write_raw(message.SerializeToString())
+
+    def write_raw(self, data):
+        return self.write_frame(_make_frame(data))
+
+    def write_frame(self, pieces, lane=None, ring=None):
+        """Write a frame previously built with :func:`_make_frame`.
+
+        The buffers in pieces are never modified, so the same frame
+        may be handed to any number of connections.
+
+        :param lane: the channel the frame belongs to, whose limit and
+          policy are set with :func:`set_channel_queue`, or None for
+          queue_limit and queue_policy
+        :param ring: (payload, prefix) to write the payload into the
+          shared-memory ring instead, once the frame is next to be
+          sent, and send a handle frame with that prefix in its place.
+          pieces are sent if there is no ring or it has no room.
+        """
         result = asyncio.Future()
 
         future = self._socket_ready.wait()
         future.add_done_callback(
-            lambda future: self.ready_write(future, message, result))
+            lambda future: self.ready_write(
+                future, pieces, result, lane, ring))
 
         return result
 
-    def ready_write(self, future, message, result):
+    def write_control(self, data):
+        """Write a control frame, which is never held back or dropped
+        by a full queue."""
+        return self.write_frame(_make_frame(data), _CONTROL)
+
+    def set_channel_queue(self, channel, limit, policy):
+        """Limit the frames of one channel which may wait to be sent,
+        independently of every other channel."""
+        self._channel_queues[channel] = (limit, policy)
+
+    def ready_write(self, future, pieces, result, lane=None, ring=None):
         try:
             future.result()  # check for error
-            data = message.SerializeToString()
 
-            header = tobytes('%08X' % len(data))
-            future = self.send_pieces(header + data)
-            future.add_done_callback(
-                lambda future: self.finish_write(future, result))
+            start = None
+            if self.stats is not None:
+                start = time.time()
+            self._enqueue((pieces, result, start, lane, ring))
+            if not self._sending:
+                self._start_write()
         except Exception as e:
             result.set_exception(e)
             return
 
-    def finish_write(self, future, result):
-        try:
-            future.result()
-            result.set_result(None)
-        except Exception as e:
-            result.set_exception(e)
+    def _lane_queue(self, lane):
+        if lane is None:
+            return self.queue_limit, self.queue_policy
+        if lane == _CONTROL:
+            return None, QUEUE_BLOCK
+        return self._channel_queues.get(lane, (None, QUEUE_BLOCK))
+
+    def _enqueue(self, entry):
+        # Each entry is (pieces, result future, time queued or None,
+        # lane, ring payload or None).  Every lane is limited
+        # separately.
+        lane = entry[3]
+        limit, policy = self._lane_queue(lane)
+        if limit is None or self._queued[lane] < limit:
+            self._append(entry)
             return
 
+        if policy == QUEUE_BLOCK:
+            self._blocked.append(entry)
+            return
+        elif policy == QUEUE_DROP_OLDEST:
+            count = 1
+        elif policy == QUEUE_LATEST:
+            count = self._queued[lane]
+        else:
+            raise RuntimeError('unknown queue policy: ' + str(policy))
+
+        self._drop(lane, count)
+        self._append(entry)
+
+    def _append(self, entry):
+        self._write_queue.append(entry)
+        self._queued[entry[3]] += 1
+
+    def _drop(self, lane, count):
+        # Remove the oldest count frames of lane, keeping the others
+        # in order.
+        kept = collections.deque()
+        dropped = 0
+        while dropped < count:
+            entry = self._write_queue.popleft()
+            if entry[3] != lane:
+                kept.append(entry)
+                continue
+            entry[1].set_result(None)
+            dropped += 1
+        if kept:
+            kept.extend(self._write_queue)
+            self._write_queue = kept
+
+        self._queued[lane] -= count
+        self._dropped[lane] += count
+        self.dropped += count
+
+    def _admit_blocked(self):
+        if not self._blocked:
+            return
+
+        still_blocked = collections.deque()
+        for entry in self._blocked:
+            limit = self._lane_queue(entry[3])[0]
+            if limit is None or self._queued[entry[3]] < limit:
+                self._append(entry)
+            else:
+                still_blocked.append(entry)
+        self._blocked = still_blocked
+
+    def _start_write(self):
+        # Only one send is in flight at a time, the rest wait their
+        # turn in order.
+        if not self._write_queue:
+            return
+
+        batch = [self._take()]
+        pieces = batch[0][0]
+        if len(pieces) == 1:
+            # Merge as many following small frames as will fit into a
+            # single send.
+            size = len(pieces[0])
+            while self._write_queue:
+                entry = self._take()
+                next_pieces = entry[0]
+                if (len(next_pieces) != 1 or
+                        size + len(next_pieces[0]) > self.BUF_SIZE):
+                    # It is still the next to be sent.
+                    self._write_queue.appendleft(entry)
+                    self._queued[entry[3]] += 1
+                    break
+                batch.append(entry)
+                size += len(next_pieces[0])
+            if len(batch) > 1:
+                pieces = [b''.join(x[0][0] for x in batch)]
+
+        self._admit_blocked()
+
+        self._sending = batch
+        future = self.send_pieces(pieces)
+        future.add_done_callback(
+            lambda future: self.finish_write(future, batch))
+
+    def _take(self):
+        # Payloads are only written into the shared-memory ring as they
+        # leave the queue, so that the ring is filled in the same order
+        # as the handles are sent, whatever the lanes did meanwhile.
+        pieces, result, start, lane, ring = self._write_queue.popleft()
+        self._queued[lane] -= 1
+        if ring is not None and self._shm_writer is not None:
+            handle = self._shm_writer.write(ring[0])
+            if handle is not None:
+                pieces = _make_frame(handle, ring[1])
+        return pieces, result, start, lane, None
+
+    def finish_write(self, future, batch):
+        self._sending = []
+        self._start_write()
+
+        if self.stats is not None and future.exception() is None:
+            now = time.time()
+            for pieces, _, start, _, _ in batch:
+                self.stats.frames_out += 1
+                self.stats.bytes_out += sum(len(x) for x in pieces)
+                if start is not None:
+                    self.stats.write_latency.observe(now - start)
+
+        for _, result, _, _, _ in batch:
+            try:
+                future.result()
+                result.set_result(None)
+            except Exception as e:
+                result.set_exception(e)
+
+    @property
+    def queue_depth(self):
+        """The number of frames waiting to be written, including any
+        currently being sent."""
+        return (len(self._sending) + len(self._write_queue) +
+                len(self._blocked))
+
+    def lane_depth(self, lane=None):
+        """Return the number of frames of one channel waiting to be
+        written, including any currently being sent."""
+        return (self._queued[lane] +
+                sum(1 for x in self._sending if x[3] == lane) +
+                sum(1 for x in self._blocked if x[3] == lane))
+
+    def lane_dropped(self, lane=None):
+        """Return the number of frames of one channel dropped because
+        its queue was full."""
+        return self._dropped[lane]
+
+    def offer_shared_memory(self, size):
+        self._shm_pending = shm.RingWriter(size)
+        return self.write_control(self._shm_pending.offer())
+
+    def accept_shared_memory(self):
+        if self._shm_pending is not None:
+            self._shm_writer, self._shm_pending = self._shm_pending, None
+
+    def close_shared_memory(self):
+        for ring in [self._shm_pending, self._shm_writer, self._shm_reader]:
+            if ring is not None:
+                ring.close()
+        self._shm_pending = self._shm_writer = self._shm_reader = None
+
     def write_packet(self, name, message):
+        return self.write(self._make_packet(name, message))
+
+    def write_packets(self, items):
+        """Write a packet for each (name, message) in items, all as a
+        single buffer.
+
+        :returns: a Future which completes once every packet is written
+        """
+        return self.write_frame([b''.join(
+            b''.join(_make_frame(
+                self._make_packet(name, message).SerializeToString()))
+            for name, message in items)])
+
+    def _make_packet(self, name, message):
         packet = msg.packet_pb2.Packet()
         cur_time = time.time()
         packet.stamp.sec = int(cur_time)
         packet.stamp.nsec = int(math.fmod(cur_time, 1) * 1e9)
         packet.type = name
         packet.serialized_data = message.SerializeToString()
-        return self.write(packet)
+        return packet
 
     @property
     def local_host(self):
@@ -442,67 +1595,320 @@ class _Connection(object):
         return self._local_port
 
 
-class _PublisherRecord(object):
-    """Information about a remote topic.
+class _FrameProtocol(asyncio.Protocol):
+    """Forwards transport events to a :class:`_ProtocolConnection`."""
+    def __init__(self, connection):
+        self.connection = connection
+
+    def connection_made(self, transport):
+        self.connection._handle_connection_made(transport)
+
+    def data_received(self, data):
+        self.connection._handle_data_received(data)
+
+    def eof_received(self):
+        self.connection._handle_connection_lost(None)
 
-    :ivar topic: (str) the string description of the topic
-    :ivar msg_type: (str) the Gazebo message type string
-    :ivar host: (str) the remote host of the topic publisher
-    :ivar port: (int) the remote port of the topic publisher
+    def connection_lost(self, exc):
+        self.connection._handle_connection_lost(exc)
+
+    def pause_writing(self):
+        self.connection._write_paused = True
+
+    def resume_writing(self):
+        self.connection._handle_resume_writing()
+
+
+class _ProtocolConnection(_Connection):
+    """A :class:`_Connection` which is driven by an asyncio transport.
+
+    The socket stays registered with the event loop for the life of
+    the connection, and everything the transport delivers is fed
+    straight into the frame buffer.  Reading is paused when more than
+    MAX_BUFFERED bytes are waiting with no one to read them.
     """
-    def __init__(self, msg):
-        self.topic = msg.topic
-        self.msg_type = msg.msg_type
-        self.host = msg.host
-        self.port = msg.port
+
+    MAX_BUFFERED = 4 * _Connection.READ_SIZE
+
+    def __init__(self):
+        super(_ProtocolConnection, self).__init__()
+        self.transport = None
+        self._reader = None
+        self._closed = False
+        self._read_paused = False
+        self._write_paused = False
+        self._drain_waiters = []
+
+    def connect(self, address):
+        logger.debug('ProtocolConnection.connect')
+        self.address = address
+        loop = asyncio.get_event_loop()
+        return _ensure_future(loop.create_connection(
+            lambda: _FrameProtocol(self), address[0], address[1]))
+
+    def attach(self, sock):
+        loop = asyncio.get_event_loop()
+        return _ensure_future(loop.create_connection(
+            lambda: _FrameProtocol(self), sock=sock))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+
+    def _handle_connection_made(self, transport):
+        self.transport = transport
+        self.socket = transport.get_extra_info('socket')
+        self._socket_ready.set()
+
+    def _handle_data_received(self, data):
+        if self.stats is not None:
+            self.stats.bytes_in += len(data)
+        self._read_buffer.feed(data)
+        self._dispatch_read()
+
+    def _handle_connection_lost(self, exc):
+        self._closed = True
+        for waiter in self._drain_waiters:
+            waiter.set_exception(exc or DisconnectError())
+        self._drain_waiters = []
+        self._dispatch_read()
+
+    def _handle_resume_writing(self):
+        self._write_paused = False
+        for waiter in self._drain_waiters:
+            waiter.set_result(None)
+        self._drain_waiters = []
+
+    def read_raw(self):
+        result = asyncio.Future()
+        self._reader = result
+        if self._read_paused:
+            self._read_paused = False
+            self.transport.resume_reading()
+        self._dispatch_read()
+        return result
+
+    def _dispatch_read(self):
+        result = self._reader
+        if result is None:
+            if (not self._read_paused and not self._closed and
+                    self._read_buffer.pending() > self.MAX_BUFFERED):
+                self._read_paused = True
+                self.transport.pause_reading()
+            return
+
+        try:
+            frame = self._read_buffer.next_frame()
+        except Exception as e:
+            self._reader = None
+            result.set_exception(e)
+            return
+
+        if frame is not None:
+            self._reader = None
+            if self.stats is not None:
+                self.stats.frames_in += 1
+            result.set_result(frame)
+        elif self._closed:
+            self._reader = None
+            self._handle_eof(result)
+
+    def send_pieces(self, pieces, result=None):
+        if result is None:
+            result = asyncio.Future()
+
+        try:
+            if self._closed:
+                raise DisconnectError()
+            for piece in pieces:
+                self.transport.write(piece)
+
+            # The transport has taken the data.  If its buffer is
+            # full, report completion only once it drains, so that
+            # the write queue applies backpressure.
+            if self._write_paused:
+                self._drain_waiters.append(result)
+            else:
+                result.set_result(None)
+        except Exception as e:
+            result.set_exception(e)
+
+        return result
 
 
 class Manager(object):
-    def __init__(self, address):
+    def __init__(self, address, use_protocol=False, stats=False,
+                 reconnect=True, multiplex=False):
         self._address = address
-        self._master = _Connection()
+        if use_protocol:
+            self._connection_class = _ProtocolConnection
+        else:
+            self._connection_class = _Connection
+        self._stats = stats
+        self._reconnect = reconnect
+        self._reconnects = 0
+        self._connected = False
+
+        # Whether the master was lost for good, as reconnect is off or
+        # the manager was closed.
+        self._master_lost = False
+        self._closed = False
+        self._master = self._new_master()
         self._server = _Connection()
+        # The connections subscribers made to our server.
+        self._server_connections = set()
         self._namespaces = []
-        self._publisher_records = set()
+        self._registry = registry.TopicRegistry()
+        self._watchers = []
+        self._patterns = []
+
+        # While registering several topics at once, the packets for the
+        # master as (name, message, future), see _batch_master.
+        self._batch = None
+
+        # Connections to other pygazebo nodes which can carry more
+        # topics, by (host, port), or None if multiplexing is off.
+        self._peers = {} if multiplex else None
         self._publishers = {}
         self._subscribers = {}
 
     def start(self):
         return self._run()
 
-    def advertise(self, topic_name, msg_type):
+    def close(self):
+        """Close every connection, to the master as well as to
+        publishers and subscribers, and stop reconnecting.
+
+        Note: Once :func:`close` is called, no further methods should
+        be called.
+        """
+        self._closed = True
+        self._master_lost = True
+        self._connected = False
+        self._master.close()
+        self._server.close()
+        for subscriber in list(self._subscribers.values()):
+            subscriber._registry = None
+            for connection in list(subscriber._connections):
+                subscriber._handle_lost(connection)
+        for connection in self._server_connections:
+            connection.close_shared_memory()
+            connection.close()
+        self._server_connections.clear()
+
+    def _new_master(self):
+        result = self._connection_class()
+        if self._stats:
+            result.stats = metrics.ConnectionStats()
+        return result
+
+    def _write_master(self, name, message):
+        if self._master_lost:
+            # Nothing will ever send it.
+            result = asyncio.Future()
+            result.set_exception(DisconnectError())
+            return result
+        if not self._connected:
+            # Everything is sent again once the master is back, see
+            # _replay.
+            result = asyncio.Future()
+            result.set_result(None)
+            return result
+        if self._batch is not None:
+            result = asyncio.Future()
+            self._batch.append((name, message, result))
+            return result
+        return self._master.write_packet(name, message)
+
+    def _batch_master(self, function, items):
+        # Call function for each item, collecting every packet it would
+        # send to the master into one write.
+        self._batch = []
+        try:
+            return [_call(function, x) for x in items]
+        finally:
+            batch, self._batch = self._batch, None
+            if batch:
+                write_future = self._master.write_packets(
+                    [(name, message) for name, message, _ in batch])
+                write_future.add_done_callback(
+                    lambda future: _complete_batch(future, batch))
+
+    def advertise(self, topic_name, msg_type,
+                  queue_limit=None, queue_policy=QUEUE_BLOCK,
+                  shm_ring_size=None):
         """Inform the Gazebo server of a topic we will publish.
 
         :param topic_name: the topic to send data on
         :type topic_name: string
         :param msg_type: the Gazebo message type string
         :type msg_type: string
+        :param queue_limit: the number of messages which may wait to be
+              sent to each listener, or None for no limit
+        :type queue_limit: int
+        :param queue_policy: what to do when a listener's queue is
+              full, one of QUEUE_BLOCK, QUEUE_DROP_OLDEST or
+              QUEUE_LATEST
+        :type queue_policy: string
+        :param shm_ring_size: the size in bytes of the shared-memory
+              ring offered to each subscriber on the same host, by
+              default enough for several of the largest message
+              published so far
+        :type shm_ring_size: int
         :rtype: :class:`Publisher`
         """
         if topic_name in self._publishers:
             raise RuntimeError('multiple publishers for: ' + topic_name)
 
-        to_send = msg.publish_pb2.Publish()
-        to_send.topic = topic_name
-        to_send.msg_type = msg_type
-        to_send.host = self._server.local_host
-        to_send.port = self._server.local_port
+        write_future = self._write_master(
+            'advertise', self._advertisement(topic_name, msg_type))
+        if self._master_lost:
+            return write_future
 
-        write_future = self._master.write_packet('advertise', to_send)
         publisher = Publisher()
         publisher.topic = topic_name
         publisher.msg_type = msg_type
+        publisher.queue_limit = queue_limit
+        publisher.queue_policy = queue_policy
+        publisher.shm_ring_size = shm_ring_size
+        if self._stats:
+            publisher.stats = metrics.PublisherStats()
         self._publishers[topic_name] = publisher
 
         result = asyncio.Future()
-        write_future.add_done_callback(
-            lambda future: result.set_result(publisher))
+
+        def handle_write(future):
+            if future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                result.set_result(publisher)
+        write_future.add_done_callback(handle_write)
 
         return result
 
-    def subscribe(self, topic_name, msg_type, callback):
+    def advertise_many(self, advertisements):
+        """Advertise several topics, sending all of them to the Gazebo
+        server in a single write.
+
+        :param advertisements: for each topic, either a tuple of the
+              positional arguments to :func:`advertise`, such as
+              (topic_name, msg_type), or a dict of its keyword arguments
+        :returns: a Future which completes with the list of
+              :class:`Publisher`, in the same order
+        """
+        return asyncio.gather(
+            *self._batch_master(self.advertise, advertisements))
+
+    def subscribe(self, topic_name, msg_type, callback=None, conflate=False,
+                  typed=False, names=None, decoder=None, executor=None,
+                  shared_memory=False):
         """Request the Gazebo server send messages on a specific topic.
 
+        A topic may be subscribed to any number of times.  All
+        subscribers to one topic share the same network connections,
+        and typed subscribers share each decoded message, which must
+        therefore be treated as read-only.
+
         :param topic_name: the topic for which data will be sent
         :type topic_name: string
         :param msg_type: the Gazebo message type string
@@ -510,37 +1916,178 @@ class Manager(object):
         :param callback: A callback to invoke when new data on
               this topic is received.  The callback will be invoked
               with raw binary data.  It is expected to deserialize the
-              message using the appropriate protobuf definition.
+              message using the appropriate protobuf definition.  If
+              None, messages are instead retrieved with
+              :func:`Subscriber.next_message` or ``async for``.  A
+              coroutine function is run as a task for each message.
+        :param conflate: If True, the callback may return a Future,
+              or be a coroutine function, to indicate it is still
+              busy.  Until that Future
+              completes, only the newest message received is kept, and
+              it is delivered once the callback is ready again.
+              Without a callback, only the newest message is kept
+              until it is retrieved.
+        :type conflate: bool
+        :param typed: If True, messages are delivered as
+              :class:`LazyMessage` instances of the class registered
+              for msg_type, which decode themselves on first use.
+        :type typed: bool
+        :param names: If given, only the entities with these names
+              are delivered, and all others are skipped without being
+              decoded.  A scoped name such as 'robot::link' also
+              matches when 'robot' is given.  Only supported for
+              gazebo.msgs.Pose_V and gazebo.msgs.Contacts.
+        :type names: iterable of strings
+        :param decoder: If given, a function which is called with the
+              raw data of each message in executor, so that heavy
+              decoding does not block the event loop.  Its results are
+              delivered in the order the messages arrived.  At most
+              Subscriber.DECODE_LIMIT messages are decoded at once and
+              as many wait, after which reading pauses until the
+              decoder catches up.  Overrides typed.
+        :type decoder: function
+        :param executor: The executor to run decoder in.  If None, the
+              event loop's default thread pool is used.  A process pool
+              may be used if decoder can be pickled, such as a module
+              level function.
+        :type executor: :class:`concurrent.futures.Executor`
+        :param shared_memory: If True, publishers on the same host
+              which are also using pygazebo send messages through a
+              shared-memory ring, with only a small handle crossing
+              the socket.  Other publishers keep using TCP.
+        :type shared_memory: bool
         :rtype: :class:`Subscriber`
         """
 
-        if topic_name in self._subscribers:
-            raise RuntimeError('multiple subscribers for: ' + topic_name)
+        primary = self._subscribers.get(topic_name)
+        if primary is not None and primary.msg_type != msg_type:
+            raise RuntimeError('type mismatch for %s: %s != %s' % (
+                topic_name, msg_type, primary.msg_type))
+
+        if typed:
+            this_message_class = message_class(msg_type)
+
+        entity_filter = None
+        if names is not None:
+            # wire depends on this module, so is only imported here.
+            from . import wire
+            if msg_type not in wire.ENTITY_FIELDS:
+                raise RuntimeError('cannot select entities of: ' + msg_type)
+            names = frozenset(names)
+            entity_filter = lambda data: wire.filter_entities(
+                data, msg_type, names)
+
+        result = Subscriber(local_host=self._server.local_host,
+                            local_port=self._server.local_port)
+        result.topic = topic_name
+        result.msg_type = msg_type
+        result.callback = callback
+        result.conflate = conflate
+        result._connection_class = self._connection_class
+        if typed:
+            result._message_class = this_message_class
+        result._entity_filter = entity_filter
+        result.decoder = decoder
+        result.executor = executor
+        result.shared_memory = shared_memory
+        if self._stats:
+            result.stats = metrics.SubscriberStats()
+
+        if primary is not None:
+            # Share the existing connections for this topic.
+            result._join(primary)
+            return result
+
+        if self._master_lost:
+            raise DisconnectError()
+
+        result._registry = self._registry
+        result._peers = self._peers
+        self._write_master('subscribe',
+                           self._subscription(topic_name, msg_type))
+
+        self._subscribers[topic_name] = result
+        return result
 
-        to_send = msg.subscribe_pb2.Subscribe()
-        to_send.topic = topic_name
-        to_send.msg_type = msg_type
-        to_send.host = self._server.local_host
-        to_send.port = self._server.local_port
-        to_send.latching = False
+    def subscribe_many(self, subscriptions):
+        """Subscribe to several topics, sending all of the requests to
+        the Gazebo server in a single write.
 
-        self._master.write_packet('subscribe', to_send)
+        :param subscriptions: for each topic, either a tuple of the
+              positional arguments to :func:`subscribe`, such as
+              (topic_name, msg_type, callback), or a dict of its
+              keyword arguments
+        :returns: the list of :class:`Subscriber`, in the same order
+        """
+        return self._batch_master(self.subscribe, subscriptions)
 
-        result = Subscriber(local_host=to_send.host,
-                            local_port=to_send.port)
+    def _advertisement(self, topic_name, msg_type):
+        result = msg.publish_pb2.Publish()
         result.topic = topic_name
         result.msg_type = msg_type
-        result.callback = callback
-        self._subscribers[topic_name] = result
+        result.host = self._server.local_host
+        result.port = self._server.local_port
+        return result
+
+    def _subscription(self, topic_name, msg_type):
+        result = msg.subscribe_pb2.Subscribe()
+        result.topic = topic_name
+        result.msg_type = msg_type
+        result.host = self._server.local_host
+        result.port = self._server.local_port
+        result.latching = False
         return result
 
-    def publications(self):
+    def subscribe_pattern(self, pattern, callback, msg_type=None,
+                          **kwargs):
+        """Subscribe to every topic matching a pattern, both those
+        already published and any which appear later.
+
+        :param pattern: the topics to subscribe to, such as
+              '/gazebo/default/*/laser/scan', see
+              :mod:`pygazebo.discovery`
+        :type pattern: string
+        :param callback: invoked with the topic name and the data of
+              each message
+        :param msg_type: If given, only topics of this Gazebo message
+              type are subscribed to.
+        :type msg_type: string
+        :param kwargs: passed to :func:`subscribe` for each topic
+        :rtype: :class:`pygazebo.discovery.PatternSubscription`
+        """
+        result = discovery.PatternSubscription(
+            self, pattern, msg_type, callback, kwargs)
+        self._patterns.append(result)
+        for record in self._registry.records(
+                discovery.literal_prefix(pattern)):
+            self._attach_pattern(result, record)
+        return result
+
+    def watch(self, callback=None):
+        """Follow changes to the known publishers and namespaces.
+
+        :param callback: If given, invoked with each
+              :class:`pygazebo.discovery.DiscoveryEvent`.  Otherwise
+              events are retrieved with
+              :func:`pygazebo.discovery.EventStream.next_event` or
+              ``async for``.
+        :rtype: :class:`pygazebo.discovery.EventStream`
+        """
+        result = discovery.EventStream(callback)
+        self._watchers.append(result)
+        return result
+
+    def publications(self, prefix=None):
         """Enumerate the current list of publications.
 
+        :param prefix: If given, only publications of topics at or
+              below this path, such as '/gazebo/default', are listed.
+        :type prefix: string
         :returns: the currently known publications
         :rtype: list of (topic_name, msg_type)
         """
-        return [(x.topic, x.msg_type) for x in self._publisher_records]
+        return [(x.topic, x.msg_type)
+                for x in self._registry.records(prefix)]
 
     def namespaces(self):
         """Enumerate the currently known namespaces.
@@ -550,6 +2097,56 @@ class Manager(object):
         """
         return self._namespaces
 
+    def stats(self):
+        """Return a snapshot of the runtime statistics.
+
+        Queue depths, drop counts and skipped messages are always
+        reported.  Counters and histograms are only included if the
+        manager was created with stats=True.  See
+        :mod:`pygazebo.metrics` for ways to export the result.
+
+        :returns: a dict with 'publishers' and 'subscribers', each
+          mapping topic names to a dict of values, and 'connections',
+          a list with a dict of values for every connection
+        :rtype: dict
+        """
+        publishers = {}
+        subscribers = {}
+        connections = [_connection_stats(self._master, 'master', None)]
+        connections[0]['reconnects'] = self._reconnects
+
+        for topic, publisher in self._publishers.items():
+            values = {'msg_type': publisher.msg_type,
+                      'listeners': len(publisher._listeners),
+                      'queue_depth': publisher.queue_depth(),
+                      'dropped': publisher.dropped_count()}
+            if publisher.stats is not None:
+                values.update(publisher.stats.as_dict())
+            publishers[topic] = values
+            connections.extend(
+                _connection_stats(x, 'publisher', topic)
+                for x in publisher._listeners)
+
+        for topic, primary in self._subscribers.items():
+            values = {'msg_type': primary.msg_type,
+                      'connections': len(primary._connections),
+                      'skipped': sum(x.skipped for x in primary._group),
+                      'queued': sum(len(x._received)
+                                    for x in primary._group)}
+            if primary.stats is not None:
+                total = metrics.SubscriberStats()
+                for subscriber in primary._group:
+                    total.merge(subscriber.stats)
+                values.update(total.as_dict())
+            subscribers[topic] = values
+            connections.extend(
+                _connection_stats(x, 'subscriber', topic)
+                for x in primary._connections)
+
+        return {'publishers': publishers,
+                'subscribers': subscribers,
+                'connections': connections}
+
     def _run(self):
         """Starts the connection and processes events."""
         logger.debug('Manager.run')
@@ -564,7 +2161,8 @@ class Manager(object):
         try:
             future.result()
             logger.debug('Manager.handle_connect')
-            self._server.serve(self._handle_server_connection)
+            if self._server.socket is None:
+                self._server.serve(self._handle_server_connection)
 
             # Read and process the required three initialization packets.
             future = self._master.read()
@@ -625,6 +2223,8 @@ class Manager(object):
 
             logger.debug('Connection: initialized!')
             self._initialized = True
+            self._connected = True
+            self._replay()
 
             self.start_normal_read()
 
@@ -639,17 +2239,74 @@ class Manager(object):
         future.add_done_callback(self.handle_normal_read)
 
     def handle_normal_read(self, future):
-        data = future.result()
+        try:
+            data = future.result()
+        except Exception as e:
+            logger.debug('master read error: ' + str(e))
+            data = None
         if data is None:
+            self._handle_master_lost()
             return
 
         self.start_normal_read()
         self._process_message(data)
 
+    def _replay(self):
+        # The master only knows what has been sent on the current
+        # connection, so tell it everything again.
+        items = [('advertise', self._advertisement(x, y.msg_type))
+                 for x, y in self._publishers.items()]
+        items.extend(('subscribe', self._subscription(x, y.msg_type))
+                     for x, y in self._subscribers.items())
+        if items:
+            self._master.write_packets(items)
+
+    def _handle_master_lost(self):
+        logger.debug('Manager: lost connection to master')
+        self._connected = False
+        self._master.close()
+        if self._closed:
+            return
+        if self._reconnect:
+            self._reconnect_master_later(None)
+        else:
+            self._master_lost = True
+
+    def _reconnect_master_later(self, delay):
+        if delay is None:
+            delay = RECONNECT_MIN_DELAY
+        else:
+            delay = min(delay * 2, RECONNECT_MAX_DELAY)
+        asyncio.get_event_loop().call_later(
+            delay, self._reconnect_master, delay)
+
+    def _reconnect_master(self, delay):
+        if self._closed:
+            return
+        self._master = self._new_master()
+        result = self._run()
+        result.add_done_callback(
+            lambda result: self._handle_master_reconnect(result, delay))
+
+    def _handle_master_reconnect(self, result, delay):
+        if self._closed:
+            self._master.close()
+            return
+        if result.exception() is not None:
+            logger.debug('cannot reconnect to master: ' +
+                         str(result.exception()))
+            self._master.close()
+            self._reconnect_master_later(delay)
+            return
+
+        logger.debug('Manager: reconnected to master')
+        self._reconnects += 1
+
     def _handle_server_connection(self, socket, remote_address):
-        this_connection = _Connection()
-        this_connection.socket = socket
-        this_connection._socket_ready.set()
+        this_connection = self._connection_class()
+        this_connection.address = remote_address
+        this_connection.attach(socket)
+        self._server_connections.add(this_connection)
 
         self._read_server_data(this_connection)
 
@@ -659,14 +2316,28 @@ class Manager(object):
             lambda future: self._handle_server_data(future, connection))
 
     def _handle_server_data(self, future, connection):
-        message = future.result()
+        try:
+            message = future.result()
+        except Exception as e:
+            # Usually just the subscriber going away.
+            logger.debug('server connection read error: ' + str(e))
+            message = None
         if message is None:
+            self._server_connections.discard(connection)
+            connection.close_shared_memory()
+            connection.close()
             return
         if message.type == 'sub':
             self._handle_server_sub(
                 connection,
                 msg.subscribe_pb2.Subscribe.FromString(
                     message.serialized_data))
+        elif message.type == 'shm_request':
+            self._handle_server_shm_request(connection)
+        elif message.type == 'shm_accept':
+            connection.accept_shared_memory()
+        elif message.type == 'mux_request':
+            self._handle_server_mux_request(connection)
         else:
             logger.warn('Manager.handle_server_connection unknown msg:' +
                         str(message.type))
@@ -685,8 +2356,44 @@ class Manager(object):
                 publisher.msg_type, msg.msg_type))
             return
 
+        if this_connection._multiplex:
+            # Another topic already uses this connection, so this one
+            # is carried in a channel of its own.
+            channel = this_connection._next_channel
+            this_connection._next_channel += 1
+            this_connection.write_control(
+                mux.channel_frame(channel, msg.topic))
+            publisher._connect(this_connection, channel)
+            return
+
         publisher._connect(this_connection)
 
+    def _handle_server_mux_request(self, connection):
+        if not any(connection in x._listeners
+                   for x in self._publishers.values()):
+            logger.warn('Manager.handle_server_mux_request before sub')
+            return
+
+        connection._multiplex = True
+        connection.write_control(mux.ACCEPT)
+
+    def _handle_server_shm_request(self, connection):
+        publishers = [x for x in self._publishers.values()
+                      if connection in x._listeners]
+        if not publishers:
+            logger.warn('Manager.handle_server_shm_request before sub')
+            return
+        if (connection._shm_pending is not None or
+                connection._shm_writer is not None):
+            logger.warn('Manager.handle_server_shm_request repeated')
+            return
+
+        try:
+            connection.offer_shared_memory(
+                max(x._shm_ring_size() for x in publishers))
+        except EnvironmentError as e:
+            logger.debug('cannot create shared memory: ' + str(e))
+
     def _process_message(self, packet):
         logger.debug('Manager.process_message: ' + str(packet))
         if packet.type in Manager._MSG_HANDLERS:
@@ -708,27 +2415,63 @@ class Manager(object):
 
     def _handle_publishers_init(self, msg):
         logger.debug('Manager.handle_publishers_init')
+        current = set()
         for publisher in msg.publisher:
-            self._publisher_records.add(_PublisherRecord(publisher))
+            record = registry.PublisherRecord.from_msg(publisher)
+            current.add(record.key)
+            self._add_record(record)
             logger.debug('  %s - %s %s:%d' % (
                 publisher.topic, publisher.msg_type,
                 publisher.host, publisher.port))
 
+        # After reconnecting, anything the master no longer knows
+        # about has gone away.
+        for record in self._registry:
+            if record.key not in current:
+                self._registry.remove(*record.key)
+                self._emit(discovery.DiscoveryEvent(
+                    discovery.PUBLISHER_DEL, record=record))
+
     def _handle_publisher_add(self, msg):
         logger.debug('Manager.handle_publisher_add: %s - %s %s:%d' % (
             msg.topic, msg.msg_type, msg.host, msg.port))
-        self._publisher_records.add(_PublisherRecord(msg))
+        self._add_record(registry.PublisherRecord.from_msg(msg))
 
     def _handle_publisher_del(self, msg):
         logger.debug('Manager.handle_publisher_del:' + msg.topic)
-        try:
-            self._publisher_records.remove(_PublisherRecord(msg))
-        except KeyError:
+        record = self._registry.remove(msg.topic, msg.host, msg.port)
+        if record is None:
             logger.debug('got publisher_del for unknown: ' + msg.topic)
+            return
+        self._emit(discovery.DiscoveryEvent(
+            discovery.PUBLISHER_DEL, record=record))
 
     def _handle_namespace_add(self, msg):
         logger.debug('Manager.handle_namespace_add:' + msg.data)
         self._namespaces.append(msg.data)
+        self._emit(discovery.DiscoveryEvent(
+            discovery.NAMESPACE_ADD, namespace=msg.data))
+
+    def _add_record(self, record):
+        if not self._registry.add(record):
+            return
+        for pattern in self._patterns:
+            self._attach_pattern(pattern, record)
+        self._emit(discovery.DiscoveryEvent(
+            discovery.PUBLISHER_ADD, record=record))
+
+    def _attach_pattern(self, pattern, record):
+        try:
+            pattern._attach(record)
+        except RuntimeError as e:
+            logger.warn('cannot subscribe %s for %s: %s',
+                        record.topic, pattern.pattern, e)
+
+    def _emit(self, event):
+        if any(x.closed for x in self._watchers):
+            self._watchers = [x for x in self._watchers if not x.closed]
+        for watcher in self._watchers:
+            watcher._emit(event)
 
     def _handle_publisher_subscribe(self, msg):
         logger.debug('Manager.handle_publisher_subscribe:' + msg.topic)
@@ -770,7 +2513,36 @@ class Manager(object):
         }
 
 
-def connect(address=('127.0.0.1', 11345)):
+def _call(function, args):
+    if isinstance(args, dict):
+        return function(**args)
+    return function(*args)
+
+
+def _complete_batch(future, batch):
+    for _, _, result in batch:
+        try:
+            future.result()
+            result.set_result(None)
+        except Exception as e:
+            result.set_exception(e)
+
+
+def _connection_stats(connection, role, topic):
+    result = {'role': role,
+              'topic': topic,
+              'peer': None,
+              'queue_depth': connection.queue_depth,
+              'dropped': connection.dropped}
+    if connection.address is not None:
+        result['peer'] = '%s:%d' % tuple(connection.address[:2])
+    if connection.stats is not None:
+        result.update(connection.stats.as_dict())
+    return result
+
+
+def connect(address=('127.0.0.1', 11345), use_protocol=False, stats=False,
+            reconnect=True, multiplex=False):
     """Create a connection to the Gazebo server.
 
     The Manager instance creates a connection to the Gazebo server,
@@ -779,7 +2551,28 @@ def connect(address=('127.0.0.1', 11345)):
 
     :param address: destination TCP server
     :type address: a tuple of ('host', port)
+    :param use_protocol: If True, all connections are driven by
+          asyncio transports and protocols rather than the event
+          loop's sock_* methods.
+    :type use_protocol: bool
+    :param stats: If True, collect the counters and histograms reported
+          by :func:`Manager.stats`.
+    :type stats: bool
+    :param reconnect: If True, a lost connection to the master is
+          retried with exponential backoff, and all advertisements and
+          subscriptions are sent again once it is back.  If False,
+          advertising and subscribing fail with DisconnectError once
+          the master is lost.
+    :type reconnect: bool
+    :param multiplex: If True, topics subscribed to from the same
+          pygazebo node share one connection, see :mod:`pygazebo.mux`.
+          Publishers which are not pygazebo still get one connection
+          per topic, but each topic after the first waits
+          MULTIPLEX_WAIT seconds to find that out, so only enable this
+          when most publishers are pygazebo nodes.
+    :type multiplex: bool
     :returns: a Future indicating when the connection is ready
     """
-    manager = Manager(address)
+    manager = Manager(address, use_protocol=use_protocol, stats=stats,
+                      reconnect=reconnect, multiplex=multiplex)
     return manager.start()
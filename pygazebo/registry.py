@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""An index of the publishers announced by the Gazebo master.
+
+Each publisher is identified by its topic and the address of the node
+publishing it.  Records are indexed by topic, message type and
+address, and every topic is also indexed under each of its path
+prefixes, so that all topics in a namespace are found without
+scanning the rest.
+"""
+
+
+class PublisherRecord(object):
+    """Information about a remote topic.
+
+    :ivar topic: (str) the string description of the topic
+    :ivar msg_type: (str) the Gazebo message type string
+    :ivar host: (str) the remote host of the topic publisher
+    :ivar port: (int) the remote port of the topic publisher
+    """
+    __slots__ = ('topic', 'msg_type', 'host', 'port')
+
+    def __init__(self, topic, msg_type, host, port):
+        self.topic = topic
+        self.msg_type = msg_type
+        self.host = host
+        self.port = port
+
+    @classmethod
+    def from_msg(cls, msg):
+        """Create a record from a gazebo.msgs.Publish message."""
+        return cls(msg.topic, msg.msg_type, msg.host, msg.port)
+
+    @property
+    def address(self):
+        return (self.host, self.port)
+
+    @property
+    def key(self):
+        """What identifies this publisher, (topic, host, port)."""
+        return (self.topic, self.host, self.port)
+
+    def _tuple(self):
+        return (self.topic, self.msg_type, self.host, self.port)
+
+    def __eq__(self, other):
+        if not isinstance(other, PublisherRecord):
+            return NotImplemented
+        return self._tuple() == other._tuple()
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __hash__(self):
+        return hash(self._tuple())
+
+    def __repr__(self):
+        return 'PublisherRecord(%r, %r, %r, %r)' % self._tuple()
+
+
+def _prefixes(topic):
+    # '/gazebo/default/box' is filed under '/gazebo' and
+    # '/gazebo/default', and the topic itself.
+    pos = topic.find('/', 1)
+    while pos > 0:
+        yield topic[:pos]
+        pos = topic.find('/', pos + 1)
+    yield topic
+
+
+def _discard(index, key, value):
+    values = index.get(key)
+    if values is None:
+        return
+    values.discard(value)
+    if not values:
+        del index[key]
+
+
+class TopicRegistry(object):
+    """The set of known publishers, with constant time insertion,
+    removal and lookup."""
+    def __init__(self):
+        self._records = {}
+        self._by_topic = {}
+        self._by_type = {}
+        self._by_address = {}
+        self._by_prefix = {}
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        return iter(list(self._records.values()))
+
+    def __contains__(self, record):
+        return self._records.get(record.key) == record
+
+    def add(self, record):
+        """Add a publisher, replacing any with the same topic and
+        address.
+
+        :returns: True if the registry changed
+        """
+        old = self._records.get(record.key)
+        if old == record:
+            return False
+        if old is not None:
+            self._remove(old)
+
+        key = record.key
+        self._records[key] = record
+        if record.topic not in self._by_topic:
+            for prefix in _prefixes(record.topic):
+                self._by_prefix.setdefault(prefix, set()).add(record.topic)
+        self._by_topic.setdefault(record.topic, set()).add(key)
+        self._by_type.setdefault(record.msg_type, set()).add(key)
+        self._by_address.setdefault(record.address, set()).add(key)
+        return True
+
+    def remove(self, topic, host, port):
+        """Remove a publisher.
+
+        :returns: the removed record, or None if it was unknown
+        """
+        record = self._records.get((topic, host, port))
+        if record is not None:
+            self._remove(record)
+        return record
+
+    def remove_address(self, host, port):
+        """Remove every publisher at one address.
+
+        :returns: the removed records
+        """
+        result = [self._records[x]
+                  for x in self._by_address.get((host, port), ())]
+        for record in result:
+            self._remove(record)
+        return result
+
+    def _remove(self, record):
+        key = record.key
+        del self._records[key]
+        _discard(self._by_topic, record.topic, key)
+        _discard(self._by_type, record.msg_type, key)
+        _discard(self._by_address, record.address, key)
+        if record.topic not in self._by_topic:
+            for prefix in _prefixes(record.topic):
+                _discard(self._by_prefix, prefix, record.topic)
+
+    def get(self, topic, host, port):
+        """Return the publisher of topic at an address, or None."""
+        return self._records.get((topic, host, port))
+
+    def by_topic(self, topic):
+        """Return the publishers of one topic."""
+        return [self._records[x] for x in self._by_topic.get(topic, ())]
+
+    def by_type(self, msg_type):
+        """Return the publishers of one message type."""
+        return [self._records[x] for x in self._by_type.get(msg_type, ())]
+
+    def by_address(self, host, port):
+        """Return the publishers at one address."""
+        return [self._records[x]
+                for x in self._by_address.get((host, port), ())]
+
+    def topics(self, prefix=None):
+        """Return the names of the topics with at least one publisher.
+
+        :param prefix: if given, only topics at or below this path,
+          such as '/gazebo/default', are returned
+        :rtype: list of strings
+        """
+        if prefix is None:
+            return list(self._by_topic.keys())
+        prefix = prefix.rstrip('/')
+        if not prefix:
+            return list(self._by_topic.keys())
+        return list(self._by_prefix.get(prefix, ()))
+
+    def records(self, prefix=None):
+        """Return the publishers of every topic at or below prefix, or
+        all publishers if prefix is None."""
+        if prefix is None:
+            return list(self._records.values())
+        return [y for x in self.topics(prefix) for y in self.by_topic(x)]
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Spread the reading of many topics across worker processes.
+
+A :class:`ShardPool` keeps the :class:`pygazebo.Manager` and its
+connection to the Gazebo master in the calling process.  Each topic
+subscribed through the pool is assigned to one worker process.  When
+the master announces a publisher for the topic, the worker opens the
+connection to it, reads and optionally decodes every message, and
+passes the results back over a shared queue, all those of one event
+loop iteration as a single batch.  The results are then delivered to
+the topic's subscribers on the original event loop, in the order each
+worker received them.
+
+Only decoding is taken off the calling process.  Every result is
+still unpickled and delivered there, which without a decoder costs
+about as much as reading the raw message from the socket would.  So
+sharding only speeds things up when a decoder does the expensive work.
+
+A worker which loses its connection to a publisher reports it, and
+the pool assigns the publisher to it again once it is still
+advertised, with the same backoff as :class:`pygazebo.Subscriber`.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import logging
+import multiprocessing
+import os
+import threading
+
+from . import pygazebo
+from .msg import publish_pb2
+
+logger = logging.getLogger(__name__)
+
+# The kinds of entry a worker puts on the results queue.
+_DATA = 'data'
+_LOST = 'lost'
+
+
+def _worker_main(commands, results, decoder, local_host, local_port,
+                 inherited):
+    # The forked worker must not hold the manager's sockets open, or
+    # its peers would never see them closed.
+    for fd in inherited:
+        try:
+            os.close(fd)
+        except OSError:
+            pass
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    subscribers = {}
+    pending = []
+
+    def flush():
+        batch = pending[:]
+        del pending[:]
+        results.put((_DATA, batch))
+
+    def connect(topic, msg_type, pub_data, delay):
+        subscriber = subscribers.get(topic)
+        if subscriber is None:
+            subscriber = pygazebo.Subscriber(local_host, local_port)
+            subscriber.topic = topic
+            subscriber.msg_type = msg_type
+
+            def callback(data, topic=topic):
+                if decoder is not None:
+                    data = decoder(data)
+                if not pending:
+                    loop.call_soon(flush)
+                pending.append((topic, data))
+            subscriber.callback = callback
+            subscriber._report_lost = (
+                lambda address, delay, topic=topic: results.put(
+                    (_LOST, topic, tuple(address), delay)))
+            subscribers[topic] = subscriber
+
+        subscriber._connect(publish_pb2.Publish.FromString(pub_data), delay)
+
+    def read_commands():
+        while True:
+            command = commands.get()
+            if command is None:
+                loop.call_soon_threadsafe(loop.stop)
+                return
+            loop.call_soon_threadsafe(connect, *command)
+
+    thread = threading.Thread(target=read_commands)
+    thread.daemon = True
+    thread.start()
+    loop.run_forever()
+
+
+def _manager_fds(manager):
+    # Only a forked worker inherits the descriptors.
+    get_start_method = getattr(multiprocessing, 'get_start_method', None)
+    if get_start_method is not None and get_start_method() != 'fork':
+        return []
+
+    connections = [manager._master, manager._server]
+    connections.extend(manager._server_connections)
+    for subscriber in manager._subscribers.values():
+        connections.extend(subscriber._connections)
+    return [x.socket.fileno() for x in connections if x.socket is not None]
+
+
+class ShardPool(object):
+    """Reads subscribed topics in a pool of worker processes.
+
+    This only pays off with a decoder, see :mod:`pygazebo.sharding`.
+
+    :ivar decoder: (function) If set, run on every message in the
+      worker before it is passed back.  It and its results must be
+      picklable.
+    """
+    def __init__(self, manager, processes=None, decoder=None):
+        """Start the worker processes.
+
+        :param manager: the connected manager whose topics will be
+          sharded
+        :type manager: :class:`pygazebo.Manager`
+        :param processes: the number of worker processes, by default
+          the number of CPUs
+        :param decoder: a picklable function applied to the raw data
+          of each message inside the workers
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+
+        self.decoder = decoder
+        self._manager = manager
+        self._loop = asyncio.get_event_loop()
+        self._subscribers = {}
+        self._topic_workers = {}
+        self._next_worker = 0
+        self._closed = False
+
+        self._results = multiprocessing.Queue()
+        self._commands = []
+        self._workers = []
+        inherited = _manager_fds(manager)
+        for i in range(processes):
+            commands = multiprocessing.Queue()
+            worker = multiprocessing.Process(
+                target=_worker_main,
+                args=(commands, self._results, decoder,
+                      manager._server.local_host,
+                      manager._server.local_port, inherited))
+            worker.daemon = True
+            worker.start()
+            self._commands.append(commands)
+            self._workers.append(worker)
+
+        self._reader = threading.Thread(target=self._read_results)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def subscribe(self, topic_name, msg_type, callback=None, **kwargs):
+        """Subscribe to a topic which is read by one of the workers.
+
+        Takes the same arguments as :func:`pygazebo.Manager.subscribe`.
+
+        :rtype: :class:`pygazebo.Subscriber`
+        """
+        result = self._manager.subscribe(topic_name, msg_type, callback,
+                                         **kwargs)
+        primary = result._primary
+        if primary._remote_connect is None:
+            worker = self._next_worker
+            self._next_worker = (worker + 1) % len(self._workers)
+            primary._remote_connect = (
+                lambda pub, worker=worker: self._assign(worker, pub))
+            self._subscribers[topic_name] = primary
+            self._topic_workers[topic_name] = worker
+        return result
+
+    def close(self):
+        """Stop all worker processes."""
+        self._closed = True
+        for commands in self._commands:
+            commands.put(None)
+        for worker in self._workers:
+            worker.join()
+        self._results.put(None)
+        self._reader.join()
+
+    def _assign(self, worker, pub, delay=None):
+        self._commands[worker].put(
+            (pub.topic, pub.msg_type, pub.SerializeToString(), delay))
+
+    def _read_results(self):
+        while True:
+            result = self._results.get()
+            if result is None:
+                return
+            if result[0] == _LOST:
+                self._loop.call_soon_threadsafe(
+                    self._handle_lost, *result[1:])
+            else:
+                self._loop.call_soon_threadsafe(self._deliver, result[1])
+
+    def _handle_lost(self, topic, address, delay):
+        if delay is None:
+            delay = pygazebo.RECONNECT_MIN_DELAY
+        else:
+            delay = min(delay * 2, pygazebo.RECONNECT_MAX_DELAY)
+        self._loop.call_later(delay, self._reconnect, topic, address, delay)
+
+    def _reconnect(self, topic, address, delay):
+        if self._closed:
+            return
+        record = self._manager._registry.get(topic, address[0], address[1])
+        if record is None:
+            # The publisher has gone away.  The master will announce
+            # it again if it comes back.
+            return
+        pub = publish_pb2.Publish(topic=record.topic,
+                                  msg_type=record.msg_type,
+                                  host=record.host, port=record.port)
+        self._assign(self._topic_workers[topic], pub, delay)
+
+    def _deliver(self, batch):
+        for topic, data in batch:
+            subscriber = self._subscribers.get(topic)
+            if subscriber is None:
+                logger.warn('ShardPool result for unknown topic: ' + topic)
+                continue
+
+            if self.decoder is None:
+                subscriber._receive(data)
+            else:
+                for member in subscriber._group:
+                    member._dispatch(data)
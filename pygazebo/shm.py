@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Shared-memory ring buffers for publishers and subscribers on the
+same host.
+
+A publisher which is asked for shared memory by a pygazebo subscriber
+creates a :class:`RingWriter` and sends its offer over the existing
+TCP connection.  Once the subscriber has mapped the ring with a
+:class:`RingReader` and accepted, message payloads are written into
+the ring and only a small handle frame crosses the socket.
+
+Control frames sent by the publisher start with a zero byte, which can
+never begin a serialized protobuf message, so they can share the
+connection with ordinary data frames.
+
+The reader reports how far it has consumed by storing a counter in
+the header of the ring.  When the ring is too full for a message, the
+writer declines and the message is sent over TCP instead.
+"""
+
+import errno
+import mmap
+import os
+import struct
+import tempfile
+
+CONTROL_PREFIX = b'\x00'
+OFFER_PREFIX = b'\x00O'
+HANDLE_PREFIX = b'\x00H'
+
+_OFFER = struct.Struct('<Q')
+_HANDLE = struct.Struct('<QI')
+_COUNTER = struct.Struct('<Q')
+
+# The consumed counter lives at the start of the header, and message
+# data follows it.
+HEADER_SIZE = 64
+
+
+# Every ring file is created with this prefix, and a reader maps
+# nothing else.
+FILE_PREFIX = 'pygazebo-'
+
+
+def _default_directory():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def _reserve(fd, size):
+    # Allocating every page up front makes a full file system fail
+    # here, rather than with SIGBUS once the mapping is written to.
+    # Where that is not possible the file is left sparse.
+    fallocate = getattr(os, 'posix_fallocate', None)
+    if fallocate is not None:
+        try:
+            fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in (errno.EINVAL, errno.EOPNOTSUPP):
+                raise
+    os.ftruncate(fd, size)
+
+
+class RingWriter(object):
+    """The publisher's end of a shared-memory ring.
+
+    :ivar path: (str) the file backing the ring
+    :ivar size: (int) the number of bytes available for messages
+    """
+    def __init__(self, size, directory=None):
+        """Create and map the file backing a ring.
+
+        :raises: EnvironmentError if it cannot be created, for instance
+          because the file system is full
+        """
+        if directory is None:
+            directory = _default_directory()
+        fd, self.path = tempfile.mkstemp(prefix=FILE_PREFIX, dir=directory)
+        try:
+            _reserve(fd, HEADER_SIZE + size)
+            self._map = mmap.mmap(fd, HEADER_SIZE + size)
+        except Exception:
+            os.unlink(self.path)
+            raise
+        finally:
+            os.close(fd)
+        self.size = size
+        self._head = 0
+
+    def offer(self):
+        """Return the control frame which offers this ring."""
+        return OFFER_PREFIX + _OFFER.pack(self.size) + self.path.encode(
+            'utf-8')
+
+    def write(self, data):
+        """Copy data into the ring.
+
+        :returns: the handle frame to send in place of data, or None if
+          there is currently no room for it
+        """
+        length = len(data)
+        if length > self.size:
+            return None
+
+        # Messages never wrap around the end of the ring, skip the
+        # rest of it instead.
+        start = self._head
+        offset = start % self.size
+        if offset + length > self.size:
+            start += self.size - offset
+            offset = 0
+
+        consumed = _COUNTER.unpack_from(self._map, 0)[0]
+        if start + length - consumed > self.size:
+            return None
+
+        begin = HEADER_SIZE + offset
+        self._map[begin:begin + length] = data
+        self._head = start + length
+        return HANDLE_PREFIX + _HANDLE.pack(start, length)
+
+    def close(self):
+        self._map.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            # The reader normally removes it once it is mapped.
+            pass
+
+
+class RingReader(object):
+    """The subscriber's end of a shared-memory ring."""
+    def __init__(self, offer, directory=None):
+        """Map the ring described by an offer control frame.
+
+        Only files created by a :class:`RingWriter` in directory are
+        ever opened.
+
+        :raises: EnvironmentError if the ring cannot be mapped, for
+          instance because the publisher is on another host
+        :raises: ValueError if the offer is malformed or names any
+          other file
+        """
+        if directory is None:
+            directory = _default_directory()
+
+        prefix_size = len(OFFER_PREFIX)
+        try:
+            self.size = _OFFER.unpack_from(offer, prefix_size)[0]
+        except struct.error:
+            raise ValueError('malformed shared memory offer')
+        self.path = offer[prefix_size + _OFFER.size:].decode('utf-8')
+        if (os.path.dirname(self.path) != directory or
+                not os.path.basename(self.path).startswith(FILE_PREFIX)):
+            raise ValueError('not a shared memory ring: ' + self.path)
+
+        fd = os.open(self.path, os.O_RDWR | getattr(os, 'O_NOFOLLOW', 0))
+        try:
+            # mmap raises ValueError if the file is smaller than the
+            # offered size.
+            self._map = mmap.mmap(fd, HEADER_SIZE + self.size)
+        finally:
+            os.close(fd)
+
+        # Both ends now hold the mapping, so the name is no longer
+        # needed and nothing is left behind if either end dies.
+        os.unlink(self.path)
+
+    def read(self, handle):
+        """Return a copy of the message referred to by a handle frame,
+        and release its space in the ring."""
+        start, length = _HANDLE.unpack_from(handle, len(HANDLE_PREFIX))
+        begin = HEADER_SIZE + start % self.size
+        result = self._map[begin:begin + length]
+        _COUNTER.pack_into(self._map, 0, start + length)
+        return result
+
+    def close(self):
+        self._map.close()
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Helpers for working directly with the protobuf wire format.
+
+These allow parts of a serialized message to be located, copied or
+skipped without decoding the whole message into python objects.
+"""
+
+import sys
+
+from .pygazebo import ParseError
+
+if sys.version_info[0] < 3:
+    def byte_value(x):
+        # Items of a bytearray are already integers.
+        if isinstance(x, int):
+            return x
+        return ord(x)
+else:
+    def byte_value(x):
+        return x
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LENGTH = 2
+WIRE_FIXED32 = 5
+
+
+def read_varint(data, pos):
+    """Decode the varint starting at pos.
+
+    :returns: (value, next_pos)
+    """
+    result = 0
+    shift = 0
+    while True:
+        if pos >= len(data):
+            raise ParseError('truncated varint')
+        value = byte_value(data[pos])
+        pos += 1
+        result |= (value & 0x7f) << shift
+        if not value & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_varint(value):
+    """Return the varint encoding of value as bytes."""
+    result = bytearray()
+    while True:
+        if value < 0x80:
+            result.append(value)
+            return bytes(result)
+        result.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+
+def read_field(data, pos, end):
+    """Read one field starting at pos.
+
+    :returns: (field_number, wire_type, start, stop, next_pos) where
+      start and stop delimit the value.  For varint fields the value
+      is already decoded and is returned in place of start.
+    """
+    tag, pos = read_varint(data, pos)
+    number = tag >> 3
+    wire_type = tag & 7
+    if wire_type == WIRE_VARINT:
+        value, next_pos = read_varint(data, pos)
+        return number, wire_type, value, next_pos, next_pos
+    elif wire_type == WIRE_FIXED64:
+        next_pos = pos + 8
+    elif wire_type == WIRE_LENGTH:
+        length, pos = read_varint(data, pos)
+        next_pos = pos + length
+    elif wire_type == WIRE_FIXED32:
+        next_pos = pos + 4
+    else:
+        raise ParseError('unsupported wire type: %d' % wire_type)
+
+    if next_pos > end:
+        raise ParseError('truncated field %d' % number)
+    return number, wire_type, pos, next_pos, next_pos
+
+
+# For each message type supporting entity selection, the number of the
+# repeated field holding one sub-message per entity, and the numbers
+# of the string fields within it which name the entity.
+ENTITY_FIELDS = {
+    'gazebo.msgs.Pose_V': (1, (1,)),
+    'gazebo.msgs.Contacts': (1, (1, 2)),
+    }
+
+
+def _name_matches(name, names):
+    # Scoped names like 'model::link::collision' also match any of
+    # their parents.
+    if name in names:
+        return True
+    scope = name
+    while '::' in scope:
+        scope = scope.rsplit('::', 1)[0]
+        if scope in names:
+            return True
+    return False
+
+
+def _entity_matches(data, pos, end, name_fields, names):
+    while pos < end:
+        number, wire_type, start, stop, pos = read_field(data, pos, end)
+        if number in name_fields and wire_type == WIRE_LENGTH:
+            if _name_matches(data[start:stop].decode('utf-8'), names):
+                return True
+    return False
+
+
+def filter_entities(data, msg_type, names):
+    """Remove the entities not named in names from a serialized
+    message.
+
+    Entities which are not selected are skipped using their length
+    prefix and are never decoded.  All other fields are kept as is, so
+    the result is a valid serialized message of the same type.
+
+    :param data: the serialized message
+    :param msg_type: a Gazebo message type from :data:`ENTITY_FIELDS`
+    :param names: the entity names to keep
+    :type names: set of strings
+    :returns: the serialized message holding only the selected entities
+    """
+    entity_field, name_fields = ENTITY_FIELDS[msg_type]
+    pieces = []
+    kept_all = True
+    pos = 0
+    end = len(data)
+    while pos < end:
+        field_pos = pos
+        number, wire_type, start, stop, pos = read_field(data, pos, end)
+        if (number == entity_field and wire_type == WIRE_LENGTH and
+                not _entity_matches(data, start, stop, name_fields, names)):
+            kept_all = False
+            continue
+        pieces.append(data[field_pos:pos])
+
+    if kept_all:
+        return data
+    # Joined with an empty slice of data, so that a bytearray gives a
+    # bytearray.
+    return data[:0].join(pieces)
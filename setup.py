@@ -67,6 +67,7 @@ setup(
     tests_require=['pytest', 'mock'],
     extras_require={
         'testing': ['pytest', 'mock'],
+        'numpy': ['numpy'],
         },
     cmdclass={'test': PyTest},
     test_suite='tests',
@@ -0,0 +1,55 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""Fixtures shared by the tests which run against a real master."""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import pytest
+
+from pygazebo import pygazebo
+
+from . import fake_master
+
+
+def wait_until(condition):
+    """Run the event loop until condition() is true."""
+    fake_master.wait_until(condition, timeout=5.0)
+
+
+@pytest.fixture
+def master(request):
+    """A started :class:`tests.fake_master.FakeMaster`."""
+    result = fake_master.FakeMaster()
+    result.start()
+    request.addfinalizer(result.close)
+    return result
+
+
+@pytest.fixture
+def connect(request, master):
+    """Return a function which connects a new manager to master.
+
+    It takes the same options as :func:`pygazebo.connect`, and every
+    manager it creates is closed after the test.
+    """
+    loop = asyncio.get_event_loop()
+    managers = []
+
+    def close():
+        for manager in managers:
+            manager.close()
+        # Let anything the closed connections scheduled run now,
+        # rather than during the next test.
+        loop.run_until_complete(asyncio.sleep(0.01))
+    request.addfinalizer(close)
+
+    def connect(**kwargs):
+        manager = loop.run_until_complete(
+            pygazebo.connect(master.address, **kwargs))
+        managers.append(manager)
+        return manager
+    return connect
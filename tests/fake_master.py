@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""A minimal Gazebo master for the tests and benchmarks."""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import time
+
+from pygazebo import pygazebo
+from pygazebo.msg import gz_string_pb2
+from pygazebo.msg import gz_string_v_pb2
+from pygazebo.msg import publish_pb2
+from pygazebo.msg import publishers_pb2
+from pygazebo.msg import subscribe_pb2
+
+
+class FakeMaster(object):
+    """A minimal stand-in for the Gazebo master.
+
+    It sends the initialization packets, announces every new
+    publisher to all clients, and introduces publishers and
+    subscribers of the same topic to each other.  Nothing is ever
+    removed.
+
+    :ivar address: the (host, port) it listens on, once started
+    """
+    def __init__(self):
+        self.address = None
+        self._server = pygazebo._Connection()
+        self._connections = []
+        self._publishers = []
+        self._subscribers = {}
+
+    def start(self):
+        """Start listening.
+
+        :returns: the address to connect to, also kept in
+          :attr:`address`
+        """
+        self._server.serve(self._handle_connection)
+        self.address = ('127.0.0.1', self._server.local_port)
+        return self.address
+
+    def close(self):
+        self._server.close()
+        for connection in self._connections:
+            connection.close()
+        self._connections = []
+
+    def _handle_connection(self, sock, remote_address):
+        connection = pygazebo._Connection()
+        connection.attach(sock)
+
+        connection.write_packet(
+            'version_init', gz_string_pb2.GzString(data='gazebo 2.2'))
+        connection.write_packet(
+            'topic_namepaces_init', gz_string_v_pb2.GzString_V())
+        publishers = publishers_pb2.Publishers()
+        publishers.publisher.extend(self._publishers)
+        connection.write_packet('publishers_init', publishers)
+        self._connections.append(connection)
+
+        self._read(connection, remote_address[0])
+
+    def _read(self, connection, remote_host):
+        future = connection.read()
+        future.add_done_callback(
+            lambda future: self._handle_read(future, connection, remote_host))
+
+    def _handle_read(self, future, connection, remote_host):
+        try:
+            packet = future.result()
+        except pygazebo.DisconnectError:
+            packet = None
+        if packet is None:
+            return
+
+        if packet.type == 'advertise':
+            pub = publish_pb2.Publish.FromString(packet.serialized_data)
+            if pub.host in ('', '0.0.0.0'):
+                # Managers listen on every interface and advertise
+                # that, so tell everyone where they can be reached.
+                pub.host = remote_host
+            self._publishers.append(pub)
+            for other in self._connections:
+                other.write_packet('publisher_add', pub)
+            for subscriber in self._subscribers.get(pub.topic, []):
+                subscriber.write_packet('publisher_advertise', pub)
+        elif packet.type == 'subscribe':
+            sub = subscribe_pb2.Subscribe.FromString(packet.serialized_data)
+            self._subscribers.setdefault(sub.topic, []).append(connection)
+            for pub in self._publishers:
+                if pub.topic == sub.topic:
+                    connection.write_packet('publisher_subscribe', pub)
+
+        self._read(connection, remote_host)
+
+
+def wait_until(condition, timeout=10.0, loop=None):
+    """Run the event loop until condition() is true.
+
+    :raises: RuntimeError if that takes longer than timeout seconds
+    """
+    if loop is None:
+        loop = asyncio.get_event_loop()
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise RuntimeError('timed out waiting')
+        loop.run_until_complete(asyncio.sleep(0.01))
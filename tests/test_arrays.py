@@ -0,0 +1,277 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_arrays
+----------------------------------
+
+Tests for `pygazebo.arrays` module.
+"""
+
+import math
+
+import pytest
+
+numpy = pytest.importorskip('numpy')
+
+from pygazebo import arrays
+from pygazebo import pygazebo
+from pygazebo.msg import image_pb2
+from pygazebo.msg import images_stamped_pb2
+from pygazebo.msg import laserscan_pb2
+from pygazebo.msg import laserscan_stamped_pb2
+from pygazebo.msg import pointcloud_pb2
+from pygazebo.msg import pose_v_pb2
+from pygazebo.msg import quaternion_pb2
+from pygazebo.msg import vector3d_pb2
+
+
+def make_scan(count, vertical_count=1):
+    scan = laserscan_pb2.LaserScan()
+    scan.frame = 'lidar'
+    scan.world_pose.position.x = 0.0
+    scan.world_pose.position.y = 0.0
+    scan.world_pose.position.z = 0.0
+    scan.world_pose.orientation.x = 0.0
+    scan.world_pose.orientation.y = 0.0
+    scan.world_pose.orientation.z = 0.0
+    scan.world_pose.orientation.w = 1.0
+    scan.angle_min = -math.pi / 2
+    scan.angle_max = math.pi / 2
+    scan.angle_step = math.pi / (count - 1)
+    scan.range_min = 0.1
+    scan.range_max = 10.0
+    scan.count = count
+    if vertical_count > 1:
+        scan.vertical_angle_min = -0.1
+        scan.vertical_angle_max = 0.1
+        scan.vertical_angle_step = 0.2 / (vertical_count - 1)
+        scan.vertical_count = vertical_count
+    for i in range(count * vertical_count):
+        scan.ranges.append(1.0 + i * 0.5)
+        scan.intensities.append(float(i % 7))
+    return scan
+
+
+class TestLaserScan(object):
+    def test_decode(self):
+        scan = make_scan(181)
+        result = arrays.decode_laserscan(scan.SerializeToString())
+
+        assert result.frame == 'lidar'
+        assert result.count == 181
+        assert result.angle_step == scan.angle_step
+        assert result.ranges.shape == (1, 181)
+        assert list(result.ranges.ravel()) == list(scan.ranges)
+        assert list(result.intensities.ravel()) == list(scan.intensities)
+
+    def test_angles_cached(self):
+        scan = make_scan(11)
+        first = arrays.decode_laserscan(scan.SerializeToString())
+        second = arrays.decode_laserscan(scan.SerializeToString())
+        assert first.angles() is second.angles()
+        numpy.testing.assert_allclose(
+            first.angles(), numpy.linspace(-math.pi / 2, math.pi / 2, 11))
+
+    def test_points(self):
+        scan = make_scan(3, vertical_count=2)
+        result = arrays.decode_laserscan(scan.SerializeToString())
+        points = result.points()
+        assert points.shape == (6, 3)
+
+        i = 5
+        yaw = scan.angle_min + (i % 3) * scan.angle_step
+        pitch = scan.vertical_angle_min + (i // 3) * scan.vertical_angle_step
+        expected = scan.ranges[i] * numpy.array([
+            math.cos(pitch) * math.cos(yaw),
+            math.cos(pitch) * math.sin(yaw),
+            math.sin(pitch)])
+        numpy.testing.assert_allclose(points[i], expected)
+
+    def test_stamped(self):
+        stamped = laserscan_stamped_pb2.LaserScanStamped()
+        stamped.time.sec = 12
+        stamped.time.nsec = 34
+        stamped.scan.CopyFrom(make_scan(5))
+
+        data = stamped.SerializeToString()
+        result = arrays.decode_laserscan_stamped(
+            pygazebo.LazyMessage(data, type(stamped)))
+        assert result.time == (12, 34)
+        assert list(result.ranges.ravel()) == list(stamped.scan.ranges)
+
+    def test_count_mismatch(self):
+        scan = make_scan(5)
+        scan.count = 6
+        with pytest.raises(pygazebo.ParseError):
+            arrays.decode_laserscan(scan.SerializeToString())
+
+
+def make_image(width, height, pixel_format, pixel_bytes, padding=0):
+    image = image_pb2.Image()
+    image.width = width
+    image.height = height
+    image.pixel_format = pixel_format
+    image.step = width * pixel_bytes + padding
+    image.data = bytes(bytearray(
+        i % 251 for i in range(image.step * height)))
+    return image
+
+
+class TestImage(object):
+    def test_rgb(self):
+        image = make_image(4, 3, 3, 3, padding=2)
+        result = arrays.decode_image(image.SerializeToString())
+
+        assert result.shape == (3, 4, 3)
+        assert result.dtype == numpy.uint8
+        assert not result.flags.writeable
+        expected = numpy.frombuffer(image.data, numpy.uint8).reshape(
+            3, 14)[:, :12].reshape(3, 4, 3)
+        assert (result == expected).all()
+
+    def test_bytearray(self):
+        image = make_image(4, 3, 3, 3)
+        data = bytearray(image.SerializeToString())
+        result = arrays.decode_image(data)
+        assert not result.flags.writeable
+        assert numpy.may_share_memory(result, numpy.frombuffer(
+            data, numpy.uint8))
+
+    def test_depth(self):
+        image = image_pb2.Image()
+        image.width = 2
+        image.height = 2
+        image.pixel_format = 13
+        image.step = 8
+        depth = numpy.array([[1.0, 2.0], [3.0, 4.5]], dtype='<f4')
+        image.data = depth.tostring()
+
+        result = arrays.decode_image(image.SerializeToString())
+        assert result.shape == (2, 2)
+        assert (result == depth).all()
+
+    def test_short_data(self):
+        image = make_image(4, 3, 3, 3)
+        image.height = 4
+        with pytest.raises(pygazebo.ParseError):
+            arrays.decode_image(image.SerializeToString())
+
+    def test_images_stamped(self):
+        stamped = images_stamped_pb2.ImagesStamped()
+        stamped.time.sec = 1
+        stamped.time.nsec = 2
+        stamped.image.add().CopyFrom(make_image(4, 3, 1, 1))
+        stamped.image.add().CopyFrom(make_image(2, 2, 3, 3))
+
+        time, images = arrays.decode_images_stamped(
+            stamped.SerializeToString())
+        assert time == (1, 2)
+        assert [x.shape for x in images] == [(3, 4), (2, 2, 3)]
+        assert images[0].tostring() == stamped.image[0].data
+
+
+class TestPointCloud(object):
+    def test_decode(self):
+        cloud = pointcloud_pb2.PointCloud()
+        for i in range(1000):
+            point = cloud.points.add()
+            point.x = i
+            point.y = -i * 0.5
+            point.z = i * 2.0
+
+        result = arrays.decode_pointcloud(cloud.SerializeToString())
+        assert result.shape == (1000, 3)
+        assert result.flags.c_contiguous
+        assert list(result[10]) == [10.0, -5.0, 20.0]
+        assert list(result[-1]) == [999.0, -499.5, 1998.0]
+
+    def test_unusual_encoding(self):
+        cloud = pointcloud_pb2.PointCloud()
+        for i in range(3):
+            point = cloud.points.add()
+            point.x = point.y = point.z = i
+        data = cloud.SerializeToString()
+
+        # Re-encode the second point with z before x and y, which
+        # cannot take the fast path.
+        second = vector3d_pb2.Vector3d(x=1, y=1, z=1).SerializeToString()
+        reordered = second[18:] + second[:18]
+        data = data[:29] + b'\x0a\x1b' + reordered + data[58:]
+
+        result = arrays.decode_pointcloud(data)
+        assert result.tolist() == [[0, 0, 0], [1, 1, 1], [2, 2, 2]]
+
+    def test_empty(self):
+        result = arrays.decode_pointcloud(b'')
+        assert result.shape == (0, 3)
+
+
+def make_pose_v(count, offset=0.0):
+    poses = pose_v_pb2.Pose_V()
+    for i in range(count):
+        pose = poses.pose.add()
+        pose.name = 'model%d' % i
+        pose.id = i
+        pose.position.x = i + offset
+        pose.position.y = 2 * i
+        pose.position.z = 3 * i
+        pose.orientation.x = 0.0
+        pose.orientation.y = 0.0
+        pose.orientation.z = offset
+        pose.orientation.w = 1.0
+    return poses
+
+
+class TestPoseV(object):
+    def test_decode(self):
+        poses = make_pose_v(50)
+        result = arrays.decode_pose_v(poses.SerializeToString())
+
+        assert result.names == ['model%d' % i for i in range(50)]
+        assert result.index['model7'] == 7
+        assert result.position.shape == (50, 3)
+        assert result.position[7].tolist() == [7.0, 14.0, 21.0]
+        assert result.orientation[7].tolist() == [0.0, 0.0, 0.0, 1.0]
+
+    def test_stream(self):
+        decoder = arrays.PoseVDecoder()
+        first = decoder.decode(make_pose_v(10).SerializeToString())
+        second = decoder.decode(make_pose_v(10, 0.5).SerializeToString())
+
+        assert second.names is first.names
+        assert second.index is first.index
+        assert second.position[3].tolist() == [3.5, 6.0, 9.0]
+        assert second.orientation[3].tolist() == [0.0, 0.0, 0.5, 1.0]
+
+        third = decoder.decode(make_pose_v(11).SerializeToString())
+        assert third.names is not first.names
+        assert third.index['model10'] == 10
+
+    def test_renamed(self):
+        decoder = arrays.PoseVDecoder()
+        decoder.decode(make_pose_v(3).SerializeToString())
+        poses = make_pose_v(3)
+        poses.pose[1].name = 'modelX'
+        result = decoder.decode(poses.SerializeToString())
+        assert result.names == ['model0', 'modelX', 'model2']
+
+    def test_unusual_encoding(self):
+        # A position with z encoded first cannot use the fast path.
+        vector = vector3d_pb2.Vector3d(x=1, y=2, z=3).SerializeToString()
+        quaternion = quaternion_pb2.Quaternion(
+            x=0, y=0, z=0, w=1).SerializeToString()
+        pose = (b'\x0a\x02ab' +
+                b'\x1a\x1b' + vector[18:] + vector[:18] +
+                b'\x22\x24' + quaternion)
+        data = b'\x0a' + bytes(bytearray([len(pose)])) + pose
+
+        result = arrays.decode_pose_v(data)
+        assert result.names == ['ab']
+        assert result.position.tolist() == [[1.0, 2.0, 3.0]]
+        assert result.orientation.tolist() == [[0.0, 0.0, 0.0, 1.0]]
+
+    def test_empty(self):
+        result = arrays.decode_pose_v(b'')
+        assert result.position.shape == (0, 3)
+        assert result.orientation.shape == (0, 4)
@@ -0,0 +1,38 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_bench
+----------------------------------
+
+Tests for `benchmarks/bench_loopback.py`.
+"""
+
+import json
+
+from benchmarks import bench_loopback as bench
+
+
+class TestBench(object):
+    def test_read_stamp(self):
+        for kind in bench._kinds().values():
+            data = kind.stamp(1234) + kind.body
+            assert bench._read_stamp(data, kind.depth) == 1234
+
+    def test_run(self):
+        result = bench.run('pose', publishers=2, subscribers=2, count=20)
+        assert result['messages'] == 80
+        assert result['msgs_per_sec'] > 0
+        assert result['latency_p50_ms'] <= result['latency_p99_ms']
+        json.dumps(result)
+
+    def test_run_large(self):
+        result = bench.run('image', count=3, shared_memory=True)
+        assert result['messages'] == 3
+        assert result['mb_per_sec'] > 0
+
+    def test_run_topics(self):
+        result = bench.run_topics(topics=5, count=3)
+        assert result['sockets'] == 1
+        result = bench.run_topics(topics=5, count=3, multiplex=False)
+        assert result['sockets'] == 5
@@ -0,0 +1,119 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_discovery
+----------------------------------
+
+Tests for `pygazebo.discovery` module.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from pygazebo import discovery
+from pygazebo import pygazebo
+from pygazebo.msg import gz_string_pb2
+from pygazebo.msg import publish_pb2
+
+from .conftest import wait_until
+
+
+class TestPattern(object):
+    def test_compile(self):
+        regex = discovery.compile_pattern('/gazebo/default/*/laser/scan')
+        assert regex.match('/gazebo/default/robot1/laser/scan')
+        assert not regex.match('/gazebo/default/a/b/laser/scan')
+        assert not regex.match('/gazebo/default/robot1/laser/scan/x')
+
+        regex = discovery.compile_pattern('/gazebo/**/scan')
+        assert regex.match('/gazebo/default/a/b/scan')
+        assert not regex.match('/gazebo/default/a/b/scan2')
+
+        regex = discovery.compile_pattern('/robot?.pose')
+        assert regex.match('/robot1.pose')
+        assert not regex.match('/robot1xpose')
+
+    def test_literal_prefix(self):
+        assert discovery.literal_prefix(
+            '/gazebo/default/*/laser') == '/gazebo/default/'
+        assert discovery.literal_prefix('/gazebo/def*') == '/gazebo/'
+        assert discovery.literal_prefix('/a/b') == '/a/b'
+        assert discovery.literal_prefix('**') == ''
+
+
+class TestEventStream(object):
+    def test_queued(self):
+        stream = discovery.EventStream()
+        stream._emit('a')
+        future = stream.next_event()
+        assert future.result() == 'a'
+
+        future = stream.next_event()
+        assert not future.done()
+        stream._emit('b')
+        assert future.result() == 'b'
+
+
+def _publish(topic, msg_type='gazebo.msgs.GzString'):
+    return publish_pb2.Publish(topic=topic, msg_type=msg_type,
+                               host='10.0.0.1', port=1234)
+
+
+class TestManagerDiscovery(object):
+    def test_events(self):
+        manager = pygazebo.Manager(('127.0.0.1', 11345))
+        events = []
+        manager.watch(events.append)
+        closed = manager.watch()
+        closed.close()
+
+        manager._handle_publisher_add(_publish('/a'))
+        manager._handle_publisher_add(_publish('/a'))
+        manager._handle_namespace_add(gz_string_pb2.GzString(data='ns'))
+        manager._handle_publisher_del(_publish('/a'))
+        manager._handle_publisher_del(_publish('/a'))
+
+        assert [x.kind for x in events] == [
+            discovery.PUBLISHER_ADD, discovery.NAMESPACE_ADD,
+            discovery.PUBLISHER_DEL]
+        assert events[0].record.topic == '/a'
+        assert events[1].namespace == 'ns'
+        assert not closed._events
+
+
+class TestSubscribePattern(object):
+    def test_attach(self, connect):
+        loop = asyncio.get_event_loop()
+        subscriber_manager = connect()
+        publisher_manager = connect()
+
+        early = loop.run_until_complete(publisher_manager.advertise(
+            '/gazebo/default/early/scan', 'gazebo.msgs.GzString'))
+        wait_until(lambda: subscriber_manager.publications())
+
+        received = []
+        subscription = subscriber_manager.subscribe_pattern(
+            '/gazebo/default/*/scan',
+            lambda topic, data: received.append(
+                (topic, gz_string_pb2.GzString.FromString(data).data)),
+            msg_type='gazebo.msgs.GzString')
+        assert list(subscription.subscribers) == [
+            '/gazebo/default/early/scan']
+
+        late = loop.run_until_complete(publisher_manager.advertise(
+            '/gazebo/default/late/scan', 'gazebo.msgs.GzString'))
+        other = loop.run_until_complete(publisher_manager.advertise(
+            '/gazebo/default/late/other', 'gazebo.msgs.GzString'))
+        wait_until(lambda: early._listeners and late._listeners)
+        assert sorted(subscription.subscribers) == [
+            '/gazebo/default/early/scan', '/gazebo/default/late/scan']
+
+        for publisher, data in [(early, 'e'), (late, 'l'), (other, 'o')]:
+            loop.run_until_complete(
+                publisher.publish(gz_string_pb2.GzString(data=data)))
+        wait_until(lambda: len(received) == 2)
+        assert sorted(received) == [('/gazebo/default/early/scan', 'e'),
+                                    ('/gazebo/default/late/scan', 'l')]
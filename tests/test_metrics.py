@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_metrics
+----------------------------------
+
+Tests for `pygazebo.metrics` module.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+from pygazebo import metrics
+from pygazebo.msg import gz_string_pb2
+
+from .conftest import wait_until
+
+
+class TestHistogram(object):
+    def test_observe(self):
+        histogram = metrics.Histogram(buckets=(1.0, 2.0))
+        for value in [0.5, 1.0, 1.5, 3.0]:
+            histogram.observe(value)
+        result = histogram.as_dict()
+        assert result['buckets'] == [[1.0, 2], [2.0, 3]]
+        assert result['count'] == 4
+        assert result['sum'] == 6.0
+
+    def test_merge(self):
+        first = metrics.Histogram(buckets=(1.0,))
+        second = metrics.Histogram(buckets=(1.0,))
+        first.observe(0.5)
+        second.observe(2.0)
+        first.merge(second)
+        assert first.as_dict()['buckets'] == [[1.0, 1]]
+        assert first.count == 2
+
+
+class TestFormat(object):
+    def test_prometheus(self):
+        histogram = metrics.Histogram(buckets=(1.0,))
+        histogram.observe(0.5)
+        stats = {
+            'publishers': {'/foo': {'msg_type': 'gazebo.msgs.GzString',
+                                    'messages': 3, 'queue_depth': 1}},
+            'subscribers': {},
+            'connections': [{'role': 'master', 'topic': None,
+                             'peer': '127.0.0.1:11345',
+                             'write_latency': histogram.as_dict()}],
+            }
+        text = metrics.format_prometheus(stats)
+        assert '# TYPE pygazebo_publisher_messages_total counter' in text
+        assert ('pygazebo_publisher_messages_total{topic="/foo",'
+                'msg_type="gazebo.msgs.GzString"} 3') in text
+        assert '# TYPE pygazebo_publisher_queue_depth gauge' in text
+        assert ('pygazebo_connection_write_latency_bucket{role="master",'
+                'peer="127.0.0.1:11345",le="1.0"} 1') in text
+        assert ('pygazebo_connection_write_latency_count{role="master",'
+                'peer="127.0.0.1:11345"} 1') in text
+
+
+class TestManagerStats(object):
+    def _exchange(self, connect, stats):
+        loop = asyncio.get_event_loop()
+        received = []
+        subscriber_manager = connect(stats=stats)
+        subscriber = subscriber_manager.subscribe(
+            '/foo', 'gazebo.msgs.GzString', received.append)
+        publisher_manager = connect(stats=stats)
+        publisher = loop.run_until_complete(publisher_manager.advertise(
+            '/foo', 'gazebo.msgs.GzString'))
+        wait_until(lambda: publisher._listeners and subscriber._connections)
+
+        for i in range(3):
+            loop.run_until_complete(
+                publisher.publish(gz_string_pb2.GzString(data='hello')))
+        wait_until(lambda: len(received) == 3)
+        return publisher_manager.stats(), subscriber_manager.stats()
+
+    def test_enabled(self, connect):
+        publisher_stats, subscriber_stats = self._exchange(connect, True)
+
+        publisher = publisher_stats['publishers']['/foo']
+        assert publisher['messages'] == 3
+        assert publisher['bytes'] == 21
+        assert publisher['listeners'] == 1
+        assert publisher['queue_depth'] == 0
+
+        subscriber = subscriber_stats['subscribers']['/foo']
+        assert subscriber['messages'] == 3
+        assert subscriber['bytes'] == 21
+        assert subscriber['connects'] == 1
+        assert subscriber['callback_time']['count'] == 3
+
+        listener, = [x for x in publisher_stats['connections']
+                     if x['role'] == 'publisher']
+        assert listener['frames_out'] == 3
+        assert listener['write_latency']['count'] == 3
+        connection, = [x for x in subscriber_stats['connections']
+                       if x['role'] == 'subscriber']
+        assert connection['frames_in'] == 3
+
+        assert 'pygazebo_subscriber_messages_total' in (
+            metrics.format_prometheus(subscriber_stats))
+        assert 'sub /foo msgs=3' in metrics.summarize(subscriber_stats)
+
+    def test_disabled(self, connect):
+        publisher_stats, subscriber_stats = self._exchange(connect, False)
+
+        publisher = publisher_stats['publishers']['/foo']
+        assert publisher['listeners'] == 1
+        assert 'messages' not in publisher
+        subscriber = subscriber_stats['subscribers']['/foo']
+        assert subscriber['connections'] == 1
+        assert 'callback_time' not in subscriber
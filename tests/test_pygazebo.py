@@ -22,8 +22,12 @@ except ImportError:
 import mock
 import pytest
 import socket
+import threading
+import time
 
+from pygazebo import mux
 from pygazebo import pygazebo
+from pygazebo import shm
 from pygazebo.msg import gz_string_pb2
 from pygazebo.msg import gz_string_v_pb2
 from pygazebo.msg import packet_pb2
@@ -31,6 +35,8 @@ from pygazebo.msg import publishers_pb2
 from pygazebo.msg import publish_pb2
 from pygazebo.msg import subscribe_pb2
 
+from .conftest import wait_until
+
 
 class PipeChannel(object):
     """One half of a simulated pipe, implemented using asyncio and
@@ -80,22 +86,33 @@ class PipeChannel(object):
         self.write_frame(packet.SerializeToString(), callback)
 
     def recv(self, length, callback):
-        assert length <= 16384
+        assert length <= 65536
         self.recv_handler('', '', length, callback)
 
-    def recv_handler(self, new_data, old_data, total_size, callback):
+    def recv_exactly(self, length, callback):
+        assert length <= 16384
+        self.recv_handler('', '', length, callback, exact=True)
+
+    def recv_handler(self, new_data, old_data, total_size, callback,
+                     exact=False):
         data = old_data + new_data
-        if len(data) == total_size:
+        # Like a real socket, return whatever is available once at
+        # least one byte has arrived, unless an exact amount was asked
+        # for.
+        while (len(data) < total_size and not self.queue.empty() and
+               not exact):
+            data += self.queue.get_nowait()
+        if len(data) == total_size or (data and not exact):
             callback(data)
             return
 
         future = asyncio.async(self.queue.get())
         future.add_done_callback(
             lambda future: self.recv_handler(
-                future.result(), data, total_size, callback))
+                future.result(), data, total_size, callback, exact))
 
     def read_frame(self, callback):
-        self.recv(
+        self.recv_exactly(
             8, lambda data: self._read_frame_header(data, callback))
 
     def _read_frame_header(self, header, callback):
@@ -118,7 +135,7 @@ class PipeChannel(object):
             return
 
         this_size = min(total_size - len(data), 1000)
-        self.recv(
+        self.recv_exactly(
             this_size,
             lambda new_data: self._read_frame_data(
                 new_data, data, total_size, callback))
@@ -255,6 +272,9 @@ class ManagerFixture(object):
         return result
 
     def sendall(self, sock, data):
+        # Like a real socket, accept any object supporting the buffer
+        # interface.
+        data = bytes(bytearray(data))
         result = asyncio.Future()
         sock.write(data, lambda: result.set_result(None))
         return result
@@ -279,6 +299,504 @@ def manager():
     return ManagerFixture()
 
 
+class TestFrameBuffer(object):
+    def test_multiple_frames(self):
+        buf = pygazebo._FrameBuffer()
+        buf.feed(b'00000003abc00000002de0000')
+        assert buf.next_frame() == b'abc'
+        assert buf.next_frame() == b'de'
+        assert buf.next_frame() is None
+        assert buf.pending() == 4
+
+        buf.feed(b'0001f')
+        assert buf.next_frame() == b'f'
+        assert buf.next_frame() is None
+        assert buf.pending() == 0
+
+    def test_partial_payload(self):
+        buf = pygazebo._FrameBuffer()
+        buf.feed(b'0000000Ahello')
+        assert buf.next_frame() is None
+        assert buf._frame is None
+        buf.feed(b'world')
+
+        # Frames are bytes however they were split.
+        frame = buf.next_frame()
+        assert type(frame) is bytes
+        assert frame == b'helloworld'
+
+    def test_large_frame(self):
+        buf = pygazebo._FrameBuffer()
+        payload = bytes(bytearray(range(256))) * 400
+        data = b'%08X' % len(payload) + payload + b'00000002hi'
+        buf.feed(data[:1000])
+        assert buf.next_frame() is None
+        for i in range(1000, len(data), 4096):
+            assert buf.next_frame() is None
+            buf.feed(data[i:i + 4096])
+        frame = buf.next_frame()
+        assert type(frame) is bytes
+        assert frame == payload
+        assert buf.next_frame() == b'hi'
+        assert buf.pending() == 0
+
+    def test_too_large(self):
+        buf = pygazebo._FrameBuffer()
+        buf.feed(b'FFFFFFFFdata')
+        with pytest.raises(pygazebo.ParseError):
+            buf.next_frame()
+        assert buf._frame is None
+
+    def test_invalid_header(self):
+        buf = pygazebo._FrameBuffer()
+        buf.feed(b'notahex!data')
+        with pytest.raises(pygazebo.ParseError):
+            buf.next_frame()
+
+
+class TestConnectionQueue(object):
+    def make_connection(self, limit, policy):
+        connection = pygazebo._Connection()
+        connection._socket_ready.set()
+        connection.queue_limit = limit
+        connection.queue_policy = policy
+
+        self.sends = []
+
+        def send_pieces(pieces):
+            future = asyncio.Future()
+            self.sends.append((b''.join(bytes(x) for x in pieces), future))
+            return future
+
+        connection.send_pieces = send_pieces
+        return connection
+
+    def write_all(self, connection, payloads):
+        futures = [connection.write_raw(x) for x in payloads]
+        loop = asyncio.get_event_loop()
+        loop.run_until_complete(asyncio.sleep(0))
+        return futures
+
+    def finish_send(self):
+        _, future = self.sends[-1]
+        future.set_result(None)
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+
+    def test_coalesce(self):
+        connection = self.make_connection(None, pygazebo.QUEUE_BLOCK)
+        futures = self.write_all(connection, [b'a', b'b', b'c'])
+        assert len(self.sends) == 1
+        assert self.sends[0][0] == b'00000001a'
+        assert connection.queue_depth == 3
+
+        self.finish_send()
+        assert len(self.sends) == 2
+        assert self.sends[1][0] == b'00000001b00000001c'
+        assert futures[0].done()
+        assert not futures[1].done()
+
+        self.finish_send()
+        assert all(x.done() for x in futures)
+        assert connection.queue_depth == 0
+
+    def test_block(self):
+        connection = self.make_connection(1, pygazebo.QUEUE_BLOCK)
+        self.write_all(connection, [b'a', b'b', b'c'])
+        assert connection.queue_depth == 3
+
+        self.finish_send()
+        self.finish_send()
+        assert [x[0] for x in self.sends] == [
+            b'00000001a', b'00000001b', b'00000001c']
+        assert connection.dropped == 0
+
+    def test_drop_oldest(self):
+        connection = self.make_connection(2, pygazebo.QUEUE_DROP_OLDEST)
+        futures = self.write_all(connection, [b'a', b'b', b'c', b'd'])
+        assert connection.dropped == 1
+        assert futures[1].done()
+
+        self.finish_send()
+        assert self.sends[1][0] == b'00000001c00000001d'
+
+    def test_latest(self):
+        connection = self.make_connection(2, pygazebo.QUEUE_LATEST)
+        self.write_all(connection, [b'a', b'b', b'c', b'd'])
+        assert connection.dropped == 2
+
+        self.finish_send()
+        assert self.sends[1][0] == b'00000001d'
+
+    def test_channels(self):
+        connection = self.make_connection(1, pygazebo.QUEUE_LATEST)
+        connection.set_channel_queue(1, None, pygazebo.QUEUE_BLOCK)
+        connection.set_channel_queue(2, 1, pygazebo.QUEUE_DROP_OLDEST)
+
+        futures = [connection.write_raw(b'a'),
+                   connection.write_frame(pygazebo._make_frame(b'1'), 1),
+                   connection.write_frame(pygazebo._make_frame(b'x'), 2),
+                   connection.write_raw(b'b'),
+                   connection.write_frame(pygazebo._make_frame(b'2'), 1),
+                   connection.write_control(b'\x00X'),
+                   connection.write_frame(pygazebo._make_frame(b'y'), 2),
+                   connection.write_raw(b'c')]
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+
+        # Each channel only drops its own frames, and control frames
+        # are never dropped.
+        assert connection.dropped == 2
+        assert connection.lane_dropped() == 1
+        assert connection.lane_dropped(2) == 1
+        assert connection.lane_depth(1) == 2
+        assert futures[2].done()
+        self.finish_send()
+        assert self.sends[1][0] == (
+            b'000000011000000012' b'00000002\x00X' b'00000001y00000001c')
+        self.finish_send()
+        assert connection.lane_depth(1) == 0
+
+    def test_ring_order(self):
+        connection = self.make_connection(None, pygazebo.QUEUE_BLOCK)
+        connection.set_channel_queue(1, 1, pygazebo.QUEUE_BLOCK)
+        writer = shm.RingWriter(1000)
+        reader = shm.RingReader(writer.offer())
+        connection._shm_writer = writer
+
+        # The last frame of channel 1 is held back until after the
+        # frame of channel 2, which was written later.
+        payloads = [(1, b'a0'), (1, b'a1'), (1, b'a2'), (2, b'b0')]
+        for channel, payload in payloads:
+            connection.write_frame(
+                pygazebo._make_frame(payload, mux.data_prefix(channel)),
+                channel, (payload, mux.data_prefix(channel)))
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+        self.finish_send()
+        self.finish_send()
+
+        buf = pygazebo._FrameBuffer()
+        buf.feed(b''.join(x[0] for x in self.sends))
+        starts = []
+        received = []
+        while True:
+            frame = buf.next_frame()
+            if frame is None:
+                break
+            channel, handle = mux.parse_data(frame)
+            starts.append(shm._HANDLE.unpack_from(
+                handle, len(shm.HANDLE_PREFIX))[0])
+            received.append((channel, reader.read(handle)))
+
+        # The ring is filled in the order the handles are sent.
+        assert received == [(1, b'a0'), (1, b'a1'), (2, b'b0'), (1, b'a2')]
+        assert starts == sorted(starts)
+        reader.close()
+        writer.close()
+
+
+class TestConflate(object):
+    def test_conflate(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.conflate = True
+
+        received = []
+        busy = []
+
+        def callback(data):
+            received.append(data)
+            busy.append(asyncio.Future())
+            return busy[-1]
+
+        subscriber.callback = callback
+
+        subscriber._deliver_latest('a')
+        for data in ['b', 'c', 'd']:
+            subscriber._deliver_latest(data)
+        assert received == ['a']
+
+        busy[-1].set_result(None)
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0))
+        assert received == ['a', 'd']
+        assert subscriber.skipped == 2
+
+    def test_coroutine(self):
+        loop = asyncio.get_event_loop()
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.conflate = True
+
+        received = []
+        gate = asyncio.Future()
+
+        @asyncio.coroutine
+        def callback(data):
+            received.append(data)
+            yield asyncio.From(gate)
+
+        subscriber.callback = callback
+        for data in ['a', 'b', 'c']:
+            subscriber._dispatch(data)
+        loop.run_until_complete(asyncio.sleep(0))
+        assert received == ['a']
+
+        gate.set_result(None)
+        wait_until(lambda: len(received) == 2)
+        assert received == ['a', 'c']
+        assert subscriber.skipped == 1
+
+    def test_coroutine_scheduled(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        received = []
+
+        @asyncio.coroutine
+        def callback(data):
+            yield asyncio.From(asyncio.sleep(0))
+            received.append(data)
+
+        subscriber.callback = callback
+        subscriber._dispatch('a')
+        subscriber._dispatch('b')
+        wait_until(lambda: len(received) == 2)
+        assert received == ['a', 'b']
+
+    def test_buffered_frames(self):
+        loop = asyncio.get_event_loop()
+        local, remote = socket.socketpair()
+        local.setblocking(False)
+        connection = pygazebo._Connection()
+        connection.attach(local)
+
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.conflate = True
+        plain = pygazebo.Subscriber('localhost', 1234)
+        plain._join(subscriber)
+        received = []
+        all_received = []
+
+        def callback(data):
+            # A slow synchronous callback, during which everything
+            # else arrives.
+            received.append(data)
+            if len(received) == 1:
+                for i in range(1, 20):
+                    remote.sendall(b''.join(
+                        pygazebo._make_frame(str(i).encode('ascii'))))
+                time.sleep(0.05)
+        subscriber.callback = callback
+        plain.callback = all_received.append
+        subscriber._connections.append(connection)
+
+        remote.sendall(b''.join(pygazebo._make_frame(b'0')))
+        done = asyncio.Future()
+        done.set_result(None)
+        subscriber._connect3(done, connection)
+        wait_until(lambda: b'19' in received)
+
+        assert received == [b'0', b'19']
+        assert subscriber.skipped == 18
+        assert all_received == [str(x).encode('ascii') for x in range(20)]
+        remote.close()
+        connection.close()
+
+
+class TestNextMessage(object):
+    def test_queued(self):
+        loop = asyncio.get_event_loop()
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+
+        subscriber._receive('a')
+        subscriber._receive('b')
+        assert loop.run_until_complete(subscriber.next_message()) == 'a'
+        assert loop.run_until_complete(subscriber.__anext__()) == 'b'
+
+        future = subscriber.next_message()
+        assert not future.done()
+        subscriber._receive('c')
+        assert loop.run_until_complete(future) == 'c'
+
+    def test_conflate(self):
+        loop = asyncio.get_event_loop()
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.conflate = True
+
+        for data in ['a', 'b', 'c']:
+            subscriber._receive(data)
+        assert loop.run_until_complete(subscriber.next_message()) == 'c'
+        assert subscriber.skipped == 2
+
+
+class TestProtocolConnection(object):
+    def make_connection(self):
+        loop = asyncio.get_event_loop()
+        local, self.remote = socket.socketpair()
+        self.remote.settimeout(5.0)
+        connection = pygazebo._ProtocolConnection()
+        loop.run_until_complete(connection.attach(local))
+        return connection
+
+    def test_read(self):
+        loop = asyncio.get_event_loop()
+        connection = self.make_connection()
+        self.remote.sendall(b'00000003abc00000002de')
+
+        assert loop.run_until_complete(connection.read_raw()) == b'abc'
+        assert loop.run_until_complete(connection.read_raw()) == b'de'
+
+        self.remote.close()
+        with pytest.raises(pygazebo.DisconnectError):
+            loop.run_until_complete(connection.read_raw())
+
+    def test_write(self):
+        loop = asyncio.get_event_loop()
+        connection = self.make_connection()
+        payload = b'x' * 100000
+
+        future = connection.write_raw(payload)
+        data = b''
+        while len(data) < len(payload) + 8:
+            loop.run_until_complete(asyncio.sleep(0.01))
+            data += self.remote.recv(len(payload))
+        assert data == b'000186A0' + payload
+        loop.run_until_complete(future)
+        connection.close()
+        self.remote.close()
+
+
+class TestTyped(object):
+    def test_message_class(self):
+        assert (pygazebo.message_class('gazebo.msgs.GzString') is
+                gz_string_pb2.GzString)
+        with pytest.raises(RuntimeError):
+            pygazebo.message_class('gazebo.msgs.NotAMessage')
+
+    def test_lazy_message(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber._message_class = gz_string_pb2.GzString
+
+        received = []
+        subscriber.callback = received.append
+
+        data = gz_string_pb2.GzString(data='hello').SerializeToString()
+        subscriber._receive(data)
+        assert received[0].serialized_data == data
+        assert received[0]._message is None
+        assert received[0].message.data == 'hello'
+        assert received[0].data == 'hello'
+
+    def test_shared_decode(self):
+        first = pygazebo.Subscriber('localhost', 1234)
+        first._message_class = gz_string_pb2.GzString
+        second = pygazebo.Subscriber('localhost', 1234)
+        second._message_class = gz_string_pb2.GzString
+        second._join(first)
+        raw = pygazebo.Subscriber('localhost', 1234)
+        raw._join(first)
+
+        received = []
+        first.callback = received.append
+        second.callback = received.append
+        raw.callback = received.append
+
+        data = gz_string_pb2.GzString(data='hello').SerializeToString()
+        first._receive(data)
+        assert len(received) == 3
+        assert received[0] is received[1]
+        assert received[2] == data
+
+
+class TestDecoder(object):
+    def test_in_order(self):
+        loop = asyncio.get_event_loop()
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        gates = {'slow': threading.Event()}
+
+        def decoder(data):
+            if data in gates:
+                gates[data].wait(5.0)
+            return data.upper()
+
+        received = []
+        done = asyncio.Future()
+
+        def callback(data):
+            received.append(data)
+            if len(received) == 2:
+                done.set_result(None)
+
+        subscriber.callback = callback
+        subscriber.decoder = decoder
+
+        subscriber._receive('slow')
+        subscriber._receive('fast')
+        loop.run_until_complete(asyncio.sleep(0.05))
+        assert received == []
+
+        gates['slow'].set()
+        loop.run_until_complete(done)
+        assert received == ['SLOW', 'FAST']
+
+    def make_gated(self, conflate=False):
+        self.gate = threading.Event()
+        self.decoded = []
+        self.received = []
+
+        def decoder(data):
+            self.gate.wait(5.0)
+            self.decoded.append(data)
+            return data.upper()
+
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.callback = self.received.append
+        subscriber.decoder = decoder
+        subscriber.conflate = conflate
+        return subscriber
+
+    def test_limit(self):
+        subscriber = self.make_gated()
+        datas = [str(x) * 2 for x in range(10)]
+        for data in datas:
+            subscriber._receive(data)
+        assert len(subscriber._decoding) == pygazebo.Subscriber.DECODE_LIMIT
+        assert subscriber._decode_full()
+
+        self.gate.set()
+        wait_until(lambda: len(self.received) == 10)
+        assert self.received == [x.upper() for x in datas]
+        assert not subscriber._decode_backlog
+
+    def test_conflate(self):
+        subscriber = self.make_gated(conflate=True)
+        for data in ['a', 'b', 'c']:
+            subscriber._receive(data)
+        assert len(subscriber._decoding) == 1
+
+        self.gate.set()
+        wait_until(lambda: len(self.received) == 2)
+        assert self.decoded == ['a', 'c']
+        assert self.received == ['A', 'C']
+        assert subscriber.skipped == 1
+
+    def test_pause_reading(self):
+        local, remote = socket.socketpair()
+        local.setblocking(False)
+        connection = pygazebo._Connection()
+        connection.attach(local)
+        subscriber = self.make_gated()
+        subscriber._connections.append(connection)
+
+        remote.sendall(b''.join(b''.join(pygazebo._make_frame(
+            str(x).encode('ascii'))) for x in range(20)))
+        done = asyncio.Future()
+        done.set_result(None)
+        subscriber._connect3(done, connection)
+        wait_until(lambda: subscriber._resume_read)
+
+        self.gate.set()
+        wait_until(lambda: len(self.received) == 20)
+        assert self.received == [str(x).encode('ascii') for x in range(20)]
+        assert subscriber._resume_read == []
+        remote.close()
+        connection.close()
+
+
 class TestPygazebo(object):
     @pytest.fixture(autouse=True)
     def cleanup(self, request, manager):
@@ -425,6 +943,330 @@ class TestPygazebo(object):
         data_frame = read_data2.result()
         assert data_frame == sample_message.SerializeToString()
 
+        # Data which is already serialized can be published as is.
+        read_data3 = asyncio.Future()
+        pipe.endpointb.read_frame(lambda data: read_data3.set_result(data))
+        publish_future = publisher.publish_raw('rawdata')
+
+        loop.run_until_complete(read_data3)
+        assert read_data3.result() == 'rawdata'
+        assert loop.run_until_complete(publish_future) is None
+
+    def test_send_shared_memory(self, manager):
+        loop = asyncio.get_event_loop()
+
+        read_future = asyncio.Future()
+        manager.server.read_packet(lambda data: read_future.set_result(data))
+        publisher = loop.run_until_complete(
+            manager.manager.advertise('mytopic3', 'msgtype'))
+
+        pipe = Pipe()
+        manager.serve_future.set_result((pipe.endpointa, None))
+        loop.run_until_complete(read_future)
+
+        subscribe = subscribe_pb2.Subscribe()
+        subscribe.topic = 'mytopic3'
+        subscribe.msg_type = 'msgtype'
+        subscribe.host = 'localhost'
+        subscribe.port = 54321
+
+        pipe.endpointb.write_packet('sub', subscribe, lambda: None)
+        loop.run_until_complete(publisher.wait_for_listener())
+
+        # Ask for shared memory, and accept the ring which is offered.
+        offer_future = asyncio.Future()
+        pipe.endpointb.read_frame(lambda data: offer_future.set_result(data))
+        pipe.endpointb.write_packet(
+            'shm_request', gz_string_pb2.GzString(data='mytopic3'),
+            lambda: None)
+        offer = loop.run_until_complete(offer_future)
+        reader = shm.RingReader(offer)
+
+        accept_future = asyncio.Future()
+        pipe.endpointb.write_packet(
+            'shm_accept', gz_string_pb2.GzString(data='mytopic3'),
+            lambda: accept_future.set_result(None))
+        loop.run_until_complete(accept_future)
+        loop.run_until_complete(asyncio.sleep(0.01))
+
+        handle_future = asyncio.Future()
+        pipe.endpointb.read_frame(lambda data: handle_future.set_result(data))
+        sample_message = gz_string_pb2.GzString(data=' ' * 20000)
+        publisher.publish(sample_message)
+
+        handle = loop.run_until_complete(handle_future)
+        assert handle.startswith(shm.HANDLE_PREFIX)
+        assert reader.read(handle) == sample_message.SerializeToString()
+        reader.close()
+
+
+class TestReconnect(object):
+    @pytest.fixture(autouse=True)
+    def setup(self, connect):
+        self._connect = connect
+
+    def connect_pair(self):
+        loop = asyncio.get_event_loop()
+        self.received = []
+        self.subscriber_manager = self._connect()
+        self.subscriber = self.subscriber_manager.subscribe(
+            '/foo', 'gazebo.msgs.GzString', self.received.append)
+        self.publisher_manager = self._connect()
+        self.publisher = loop.run_until_complete(
+            self.publisher_manager.advertise('/foo', 'gazebo.msgs.GzString'))
+        wait_until(lambda: self.publisher._listeners)
+
+    def check_delivery(self):
+        loop = asyncio.get_event_loop()
+        count = len(self.received)
+        loop.run_until_complete(self.publisher.publish(
+            gz_string_pb2.GzString(data='hello')))
+        wait_until(lambda: len(self.received) == count + 1)
+
+    def test_master(self, master):
+        self.connect_pair()
+
+        # Restart the master, forgetting everything it was told.
+        for connection in master._connections:
+            connection.close()
+        master._connections = []
+        master._publishers = []
+        master._subscribers = {}
+
+        wait_until(lambda: self.subscriber_manager._reconnects == 1 and
+                    self.publisher_manager._reconnects == 1)
+        wait_until(lambda: len(master._publishers) == 1 and
+                    '/foo' in master._subscribers)
+
+        # The replayed subscription is answered with the publisher we
+        # are already connected to, which is not connected twice.
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.05))
+        assert len(self.subscriber._connections) == 1
+        assert len(self.publisher._listeners) == 1
+        self.check_delivery()
+
+    def test_master_disabled(self, master):
+        loop = asyncio.get_event_loop()
+        manager = self._connect(reconnect=False)
+        for connection in master._connections:
+            connection.close()
+        wait_until(lambda: manager._master_lost)
+
+        with pytest.raises(pygazebo.DisconnectError):
+            loop.run_until_complete(
+                manager.advertise('/foo', 'gazebo.msgs.GzString'))
+        with pytest.raises(pygazebo.DisconnectError):
+            manager.subscribe('/foo', 'gazebo.msgs.GzString')
+        assert manager._publishers == {}
+        assert manager._subscribers == {}
+
+    def test_close(self, master):
+        loop = asyncio.get_event_loop()
+        self.connect_pair()
+        accept = self.publisher_manager._server._accept_future
+        self.subscriber_manager.close()
+        self.publisher_manager.close()
+
+        loop.run_until_complete(asyncio.sleep(0.2))
+        assert self.subscriber_manager._reconnects == 0
+        assert self.publisher_manager._reconnects == 0
+        assert self.subscriber._connections == []
+        assert accept.cancelled()
+        assert not self.publisher_manager._server_connections
+        with pytest.raises(pygazebo.DisconnectError):
+            loop.run_until_complete(self.publisher_manager.advertise(
+                '/bar', 'gazebo.msgs.GzString'))
+
+    def test_subscriber_gone(self):
+        self.connect_pair()
+        assert len(self.publisher_manager._server_connections) == 1
+        self.subscriber_manager.close()
+
+        # The publisher closes its end as well.
+        wait_until(lambda: not self.publisher_manager._server_connections)
+
+    def test_publisher(self):
+        self.connect_pair()
+
+        listener, = self.publisher._listeners
+        self.publisher._listeners.remove(listener)
+        listener.close()
+
+        wait_until(lambda: len(self.publisher._listeners) == 1)
+        self.check_delivery()
+
+    def test_publisher_gone(self, master):
+        self.connect_pair()
+        self.subscriber_manager._handle_publisher_del(master._publishers[0])
+
+        listener, = self.publisher._listeners
+        self.publisher._listeners.remove(listener)
+        listener.close()
+
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.2))
+        assert self.publisher._listeners == []
+        assert self.subscriber._connections == []
+
+
+class TestMultiplex(object):
+    TOPICS = ['/a', '/b', '/c']
+
+    @pytest.fixture(autouse=True)
+    def setup(self, connect):
+        self._connect = connect
+
+    def connect(self, multiplex=True, patch_publisher=None, options={}):
+        loop = asyncio.get_event_loop()
+        self.received = dict((x, []) for x in self.TOPICS)
+        self.subscriber_manager = self._connect(multiplex=multiplex)
+        self.subscribers = [
+            self.subscriber_manager.subscribe(
+                x, 'gazebo.msgs.GzString', self.received[x].append)
+            for x in self.TOPICS]
+        self.publisher_manager = self._connect()
+        if patch_publisher is not None:
+            patch_publisher(self.publisher_manager)
+        self.publishers = [
+            loop.run_until_complete(self.publisher_manager.advertise(
+                x, 'gazebo.msgs.GzString', **options.get(x, {})))
+            for x in self.TOPICS]
+        wait_until(lambda: all(x.wait_for_connection().done()
+                                for x in self.subscribers))
+
+    def check_delivery(self):
+        loop = asyncio.get_event_loop()
+        for publisher in self.publishers:
+            for data in ['small', 'x' * 20000]:
+                loop.run_until_complete(publisher.publish(
+                    gz_string_pb2.GzString(data=data)))
+        wait_until(lambda: all(len(x) == 2 for x in self.received.values()))
+        for topic, received in self.received.items():
+            datas = [gz_string_pb2.GzString.FromString(x).data
+                     for x in received]
+            assert datas == ['small', 'x' * 20000]
+            del received[:]
+
+    def connections(self):
+        return set(y for x in self.subscribers for y in x._connections)
+
+    def test_shared(self):
+        self.connect()
+        assert len(self.connections()) == 1
+        assert len(set(x._listeners[0] for x in self.publishers)) == 1
+        self.check_delivery()
+
+    def test_lost(self):
+        self.connect()
+        listener = self.publishers[0]._listeners[0]
+        for publisher in self.publishers:
+            publisher._listeners.remove(listener)
+        listener.close()
+
+        wait_until(lambda: all(len(x._listeners) == 1
+                                for x in self.publishers))
+        wait_until(lambda: all(x.wait_for_connection().done()
+                                for x in self.subscribers))
+        assert len(self.connections()) == 1
+        self.check_delivery()
+
+    def test_channel_queues(self):
+        loop = asyncio.get_event_loop()
+        self.connect(options={'/a': {'queue_limit': 1,
+                                     'queue_policy': pygazebo.QUEUE_LATEST}})
+        assert len(self.connections()) == 1
+
+        futures = []
+        for i in range(5):
+            for publisher in self.publishers[1:]:
+                futures.append(publisher.publish(
+                    gz_string_pb2.GzString(data=str(i))))
+        loop.run_until_complete(asyncio.wait(futures))
+        wait_until(lambda: len(self.received['/b']) == 5 and
+                    len(self.received['/c']) == 5)
+
+    def test_disabled(self):
+        self.connect(multiplex=False)
+        assert len(self.connections()) == 3
+        self.check_delivery()
+
+    def test_not_accepted(self):
+        def patch(manager):
+            # Behave like a publisher which is not pygazebo.
+            manager._handle_server_mux_request = lambda connection: None
+        self.connect(patch_publisher=patch)
+        assert len(self.connections()) == 3
+        self.check_delivery()
+
+
+class TestBatch(object):
+    TOPICS = ['/batch/%d' % x for x in range(50)]
+
+    @pytest.fixture(autouse=True)
+    def setup(self, connect):
+        self._connect = connect
+
+    def connect(self):
+        manager = self._connect()
+        sends = []
+        old_send_pieces = manager._master.send_pieces
+
+        def send_pieces(pieces, result=None):
+            sends.append(pieces)
+            return old_send_pieces(pieces, result)
+        manager._master.send_pieces = send_pieces
+        return manager, sends
+
+    def test_advertise_many(self, master):
+        loop = asyncio.get_event_loop()
+        manager, sends = self.connect()
+        publishers = loop.run_until_complete(manager.advertise_many(
+            [(x, 'gazebo.msgs.GzString') for x in self.TOPICS[:-1]] +
+            [{'topic_name': self.TOPICS[-1],
+              'msg_type': 'gazebo.msgs.GzString',
+              'queue_limit': 3}]))
+
+        assert [x.topic for x in publishers] == self.TOPICS
+        assert publishers[-1].queue_limit == 3
+        assert len(sends) == 1
+        wait_until(lambda: len(master._publishers) == len(self.TOPICS))
+        assert sorted(x.topic for x in master._publishers) == sorted(
+            self.TOPICS)
+
+    def test_subscribe_many(self, master):
+        loop = asyncio.get_event_loop()
+        received = []
+        manager, sends = self.connect()
+        subscribers = manager.subscribe_many(
+            [(x, 'gazebo.msgs.GzString', received.append)
+             for x in self.TOPICS])
+        assert [x.topic for x in subscribers] == self.TOPICS
+        wait_until(lambda: len(master._subscribers) == len(self.TOPICS))
+        assert len(sends) == 1
+
+        publisher_manager = self._connect()
+        publishers = loop.run_until_complete(publisher_manager.advertise_many(
+            [(x, 'gazebo.msgs.GzString') for x in self.TOPICS]))
+        wait_until(lambda: all(x.wait_for_connection().done()
+                                for x in subscribers))
+        for publisher in publishers:
+            loop.run_until_complete(publisher.publish(
+                gz_string_pb2.GzString(data=publisher.topic)))
+        wait_until(lambda: len(received) == len(self.TOPICS))
+        assert sorted(gz_string_pb2.GzString.FromString(x).data
+                      for x in received) == sorted(self.TOPICS)
+
+    def test_duplicate(self, master):
+        loop = asyncio.get_event_loop()
+        manager, sends = self.connect()
+        with pytest.raises(RuntimeError):
+            manager.advertise_many([('/a', 'gazebo.msgs.GzString'),
+                                    ('/a', 'gazebo.msgs.GzString')])
+
+        # The topics before the error are still advertised.
+        assert list(manager._publishers.keys()) == ['/a']
+        wait_until(lambda: len(master._publishers) == 1)
+        assert manager._batch is None
+
 import logging
 import sys
 logging.basicConfig(level=logging.DEBUG, stream=sys.stdout)
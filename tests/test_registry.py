@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_registry
+----------------------------------
+
+Tests for `pygazebo.registry` module.
+"""
+
+from pygazebo import pygazebo
+from pygazebo import registry
+from pygazebo.msg import publish_pb2
+
+
+def _record(topic, msg_type='gazebo.msgs.Pose', host='10.0.0.1', port=1234):
+    return registry.PublisherRecord(topic, msg_type, host, port)
+
+
+class TestPublisherRecord(object):
+    def test_equality(self):
+        assert _record('/a') == _record('/a')
+        assert _record('/a') != _record('/a', port=1)
+        assert hash(_record('/a')) == hash(_record('/a'))
+        assert len(set([_record('/a'), _record('/a')])) == 1
+
+    def test_slots(self):
+        assert not hasattr(_record('/a'), '__dict__')
+
+
+class TestTopicRegistry(object):
+    def test_add_remove(self):
+        topics = registry.TopicRegistry()
+        assert topics.add(_record('/a'))
+        assert not topics.add(_record('/a'))
+        assert topics.add(_record('/a', port=1))
+        assert len(topics) == 2
+
+        assert topics.remove('/a', '10.0.0.1', 1234) == _record('/a')
+        assert topics.remove('/a', '10.0.0.1', 1234) is None
+        assert topics.by_topic('/a') == [_record('/a', port=1)]
+
+        topics.remove('/a', '10.0.0.1', 1)
+        assert len(topics) == 0
+        assert topics.topics() == []
+        assert topics.by_type('gazebo.msgs.Pose') == []
+
+    def test_replace(self):
+        topics = registry.TopicRegistry()
+        topics.add(_record('/a'))
+        assert topics.add(_record('/a', msg_type='gazebo.msgs.Image'))
+        assert len(topics) == 1
+        assert topics.by_type('gazebo.msgs.Pose') == []
+        assert len(topics.by_type('gazebo.msgs.Image')) == 1
+
+    def test_indexes(self):
+        topics = registry.TopicRegistry()
+        topics.add(_record('/gazebo/default/box/pose'))
+        topics.add(_record('/gazebo/default/sphere/pose', port=1))
+        topics.add(_record('/gazebo/other/box/pose',
+                           msg_type='gazebo.msgs.Image'))
+
+        assert sorted(topics.topics('/gazebo/default')) == [
+            '/gazebo/default/box/pose', '/gazebo/default/sphere/pose']
+        assert sorted(topics.topics('/gazebo/default/')) == [
+            '/gazebo/default/box/pose', '/gazebo/default/sphere/pose']
+        assert len(topics.topics('/gazebo')) == 3
+        assert len(topics.topics('/')) == 3
+        assert topics.topics('/gazebo/def') == []
+        assert topics.topics('/gazebo/other/box/pose') == [
+            '/gazebo/other/box/pose']
+        assert len(topics.records('/gazebo/other')) == 1
+
+        assert len(topics.by_type('gazebo.msgs.Pose')) == 2
+        assert len(topics.by_address('10.0.0.1', 1234)) == 2
+
+        removed = topics.remove_address('10.0.0.1', 1234)
+        assert len(removed) == 2
+        assert topics.topics() == ['/gazebo/default/sphere/pose']
+        assert topics.topics('/gazebo/other') == []
+
+
+class TestManagerRegistry(object):
+    def test_publisher_del(self):
+        manager = pygazebo.Manager(('127.0.0.1', 11345))
+        msg = publish_pb2.Publish(topic='/gazebo/default/a',
+                                  msg_type='gazebo.msgs.Pose',
+                                  host='10.0.0.1', port=1234)
+        manager._handle_publisher_add(msg)
+        assert manager.publications() == [
+            ('/gazebo/default/a', 'gazebo.msgs.Pose')]
+        assert manager.publications('/gazebo/other') == []
+
+        manager._handle_publisher_del(msg)
+        assert manager.publications() == []
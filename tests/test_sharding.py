@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_sharding
+----------------------------------
+
+Tests for `pygazebo.sharding` module.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import socket
+import threading
+
+from pygazebo import pygazebo
+from pygazebo import registry
+from pygazebo import sharding
+from pygazebo.msg import publish_pb2
+
+
+def _frame(data):
+    return ('%08X' % len(data)).encode('ascii') + data
+
+
+class FakeServer(object):
+    local_host = '127.0.0.1'
+    local_port = 12345
+    socket = None
+
+
+class FakeManager(object):
+    def __init__(self):
+        self._master = FakeServer()
+        self._server = FakeServer()
+        self._server_connections = set()
+        self._subscribers = {}
+        self._registry = registry.TopicRegistry()
+
+    def subscribe(self, topic_name, msg_type, callback=None):
+        result = pygazebo.Subscriber(self._server.local_host,
+                                     self._server.local_port)
+        result.topic = topic_name
+        result.msg_type = msg_type
+        result.callback = callback
+        return result
+
+
+class FakePublisher(object):
+    """Accepts subscribers on loopback and sends each the next list of
+    frames, then disconnects it."""
+    def __init__(self, *connections):
+        self.socket = socket.socket()
+        self.socket.bind(('127.0.0.1', 0))
+        self.socket.listen(1)
+        self.port = self.socket.getsockname()[1]
+        self.connections = connections
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _run(self):
+        for messages in self.connections:
+            client, _ = self.socket.accept()
+            header = client.recv(8)
+            size = int(header, 16)
+            while size:
+                size -= len(client.recv(size))
+            for data in messages:
+                client.sendall(_frame(data))
+            client.close()
+        self.socket.close()
+
+
+def _decode(data):
+    return data.upper()
+
+
+class TestShardPool(object):
+    def _run(self, decoder, connections=([b'a', b'b', b'c'],)):
+        loop = asyncio.get_event_loop()
+        publisher = FakePublisher(*connections)
+        manager = FakeManager()
+        manager._registry.add(registry.PublisherRecord(
+            '/foo', 'msgs.Pose', '127.0.0.1', publisher.port))
+        pool = sharding.ShardPool(manager, processes=2, decoder=decoder)
+        received = []
+        done = asyncio.Future()
+
+        def callback(data):
+            received.append(data)
+            if len(received) == 3:
+                done.set_result(None)
+
+        try:
+            subscriber = pool.subscribe('/foo', 'msgs.Pose', callback)
+            pub = publish_pb2.Publish(topic='/foo', msg_type='msgs.Pose',
+                                      host='127.0.0.1', port=publisher.port)
+            subscriber._start_connect(pub)
+            loop.run_until_complete(asyncio.wait_for(done, 10))
+        finally:
+            pool.close()
+        return received
+
+    def test_raw(self):
+        assert self._run(None) == [b'a', b'b', b'c']
+
+    def test_decoder(self):
+        assert self._run(_decode) == [b'A', b'B', b'C']
+
+    def test_reconnect(self):
+        # The worker reports the lost connection, and the pool has it
+        # connect again while the publisher is still advertised.
+        assert self._run(None, ([b'a'], [b'b', b'c'])) == [b'a', b'b', b'c']
+
+    def test_batch(self):
+        messages = [str(x).encode('ascii') for x in range(100)]
+        loop = asyncio.get_event_loop()
+        publisher = FakePublisher(messages)
+        manager = FakeManager()
+        pool = sharding.ShardPool(manager, processes=1)
+        received = []
+        batches = []
+        done = asyncio.Future()
+
+        def callback(data):
+            received.append(data)
+            if len(received) == len(messages):
+                done.set_result(None)
+
+        deliver = pool._deliver
+
+        def record(batch):
+            batches.append(len(batch))
+            deliver(batch)
+
+        pool._deliver = record
+        try:
+            subscriber = pool.subscribe('/foo', 'msgs.Pose', callback)
+            pub = publish_pb2.Publish(topic='/foo', msg_type='msgs.Pose',
+                                      host='127.0.0.1', port=publisher.port)
+            subscriber._start_connect(pub)
+            loop.run_until_complete(asyncio.wait_for(done, 10))
+        finally:
+            pool.close()
+        assert received == messages
+        assert len(batches) < len(messages)
+
+    def test_inherited(self):
+        # The workers do not keep the manager's connections open.
+        manager = FakeManager()
+        local, remote = socket.socketpair()
+        manager._master.socket = local
+        pool = sharding.ShardPool(manager, processes=1)
+        try:
+            local.close()
+            remote.settimeout(5)
+            assert remote.recv(1) == b''
+        finally:
+            remote.close()
+            pool.close()
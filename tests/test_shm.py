@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_shm
+----------------------------------
+
+Tests for `pygazebo.shm` module.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import errno
+import os
+import socket
+
+import pytest
+
+from pygazebo import pygazebo
+from pygazebo import shm
+
+
+@pytest.fixture
+def ring(request):
+    writer = shm.RingWriter(100)
+    reader = shm.RingReader(writer.offer())
+
+    def close():
+        writer.close()
+        reader.close()
+    request.addfinalizer(close)
+    return writer, reader
+
+
+class TestRing(object):
+    def test_round_trip(self, ring):
+        writer, reader = ring
+        handle = writer.write(b'hello')
+        assert handle.startswith(shm.HANDLE_PREFIX)
+        assert reader.read(handle) == b'hello'
+
+    def test_unlinked_once_mapped(self, ring):
+        writer, reader = ring
+        assert not os.path.exists(writer.path)
+
+    def test_full(self, ring):
+        writer, reader = ring
+        first = writer.write(b'a' * 60)
+        assert writer.write(b'b' * 60) is None
+        assert reader.read(first) == b'a' * 60
+
+        # Once the first is consumed, the second fits after wrapping
+        # around to the start.
+        second = writer.write(b'b' * 60)
+        assert reader.read(second) == b'b' * 60
+
+    def test_too_large(self, ring):
+        writer, reader = ring
+        assert writer.write(b'x' * 101) is None
+
+    def test_bad_offer(self):
+        directory = shm._default_directory()
+        with pytest.raises(EnvironmentError):
+            shm.RingReader(_offer(
+                16, os.path.join(directory, 'pygazebo-nonexistent')))
+
+    def test_foreign_path(self, tmpdir):
+        victim = tmpdir.join('pygazebo-victim')
+        victim.write('x' * 1000)
+        with pytest.raises(ValueError):
+            shm.RingReader(_offer(16, str(victim)))
+
+        other = os.path.join(shm._default_directory(), 'victim')
+        with pytest.raises(ValueError):
+            shm.RingReader(_offer(16, other))
+        assert victim.check()
+
+    @pytest.mark.skipif(not hasattr(os, 'posix_fallocate'),
+                        reason='requires posix_fallocate')
+    def test_reserved(self, ring):
+        writer, reader = ring
+        other = shm.RingWriter(1 << 20)
+        try:
+            assert os.stat(other.path).st_blocks * 512 >= 1 << 20
+        finally:
+            other.close()
+
+    def test_no_space(self, tmpdir, monkeypatch):
+        def reserve(fd, size):
+            raise OSError(errno.ENOSPC, 'No space left on device')
+        monkeypatch.setattr(shm, '_reserve', reserve)
+        with pytest.raises(EnvironmentError):
+            shm.RingWriter(100, directory=str(tmpdir))
+        assert tmpdir.listdir() == []
+
+    def test_offer_larger_than_file(self):
+        other = shm.RingWriter(100)
+        try:
+            with pytest.raises(ValueError):
+                shm.RingReader(_offer(1000, other.path))
+        finally:
+            other.close()
+
+
+def _offer(size, path):
+    return shm.OFFER_PREFIX + shm._OFFER.pack(size) + path.encode('utf-8')
+
+
+class FakeConnection(object):
+    _shm_reader = None
+    _shm_requested = True
+
+    def __init__(self):
+        self.packets = []
+
+    def write_packet(self, name, message):
+        self.packets.append(name)
+
+
+class FakeListener(object):
+    _shm_pending = None
+    _shm_writer = None
+
+    def __init__(self):
+        self.offers = []
+
+    def offer_shared_memory(self, size):
+        self.offers.append(size)
+        self._shm_pending = size
+
+
+class TestPublisher(object):
+    def make_publisher(self, manager, topic):
+        publisher = pygazebo.Publisher()
+        publisher.topic = topic
+        manager._publishers[topic] = publisher
+        return publisher
+
+    def test_ring_size(self):
+        publisher = pygazebo.Publisher()
+        assert publisher._shm_ring_size() == (
+            pygazebo._Connection.SHM_MIN_RING_SIZE)
+        publisher.publish_raw(b'x' * 100000)
+        assert publisher._shm_ring_size() == (
+            pygazebo._Connection.SHM_RING_MESSAGES * 100000)
+        publisher.publish_raw(b'x' * (1 << 22))
+        assert publisher._shm_ring_size() == (
+            pygazebo._Connection.SHM_MAX_RING_SIZE)
+        publisher.shm_ring_size = 5000
+        assert publisher._shm_ring_size() == 5000
+
+    def test_request(self):
+        manager = pygazebo.Manager(('127.0.0.1', 11345))
+        connection = FakeListener()
+        first = self.make_publisher(manager, '/a')
+        second = self.make_publisher(manager, '/b')
+        first._listeners.append(connection)
+        second._listeners.append(connection)
+        second.shm_ring_size = 1 << 22
+
+        # A multiplexed connection gets a ring large enough for each
+        # of its topics, and only ever one.
+        manager._handle_server_shm_request(connection)
+        manager._handle_server_shm_request(connection)
+        assert connection.offers == [1 << 22]
+
+
+class TestLocalHost(object):
+    def test_resolved_once(self, monkeypatch):
+        lookups = []
+
+        def gethostbyname(name):
+            lookups.append(name)
+            return '10.1.2.3'
+
+        monkeypatch.setattr(pygazebo, '_local_hosts', None)
+        monkeypatch.setattr(socket, 'gethostname', lambda: 'robot')
+        monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+        assert pygazebo._is_local_host('127.0.0.1')
+        assert lookups == []
+        assert pygazebo._is_local_host('robot')
+        assert pygazebo._is_local_host('10.1.2.3')
+        assert not pygazebo._is_local_host('10.1.2.4')
+        assert lookups == ['robot']
+
+    def test_unresolved(self, monkeypatch):
+        def gethostbyname(name):
+            raise socket.gaierror('no address')
+
+        monkeypatch.setattr(pygazebo, '_local_hosts', None)
+        monkeypatch.setattr(socket, 'gethostname', lambda: 'robot')
+        monkeypatch.setattr(socket, 'gethostbyname', gethostbyname)
+        assert pygazebo._is_local_host('robot')
+        assert not pygazebo._is_local_host('10.1.2.3')
+
+
+class TestSubscriber(object):
+    def test_control_frames(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        connection = FakeConnection()
+        writer = shm.RingWriter(1000)
+
+        assert subscriber._handle_control(writer.offer(), connection) is None
+        assert connection.packets == ['shm_accept']
+
+        handle = writer.write(b'payload')
+        assert subscriber._handle_control(handle, connection) == b'payload'
+
+        connection._shm_reader.close()
+        writer.close()
+
+    def test_unrequested_offer(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        connection = FakeConnection()
+        connection._shm_requested = False
+        writer = shm.RingWriter(1000)
+
+        assert subscriber._handle_control(writer.offer(), connection) is None
+        assert connection.packets == []
+        assert connection._shm_reader is None
+        assert os.path.exists(writer.path)
+        writer.close()
+
+    def test_bad_control_frames(self):
+        loop = asyncio.get_event_loop()
+        local, remote = socket.socketpair()
+        local.setblocking(False)
+        connection = pygazebo._Connection()
+        connection.attach(local)
+
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        received = []
+        subscriber.callback = received.append
+        subscriber._connections.append(connection)
+        done = asyncio.Future()
+        done.set_result(None)
+        subscriber._connect3(done, connection)
+
+        # A handle with no ring, and truncated channel and data frames,
+        # are dropped without stopping the connection.
+        for frame in [shm.HANDLE_PREFIX + b'\x00' * 12,
+                      b'\x00C\x01', b'\x00D', b'data']:
+            remote.sendall(b''.join(pygazebo._make_frame(frame)))
+        deadline = loop.time() + 5.0
+        while not received and loop.time() < deadline:
+            loop.run_until_complete(asyncio.sleep(0.01))
+        assert received == [b'data']
+        assert subscriber._connections == [connection]
+
+        remote.close()
+        connection.close()
@@ -0,0 +1,178 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+"""
+test_wire
+----------------------------------
+
+Tests for `pygazebo.wire` module.
+"""
+
+try:
+    import asyncio
+except ImportError:
+    import trollius as asyncio
+
+import pytest
+import socket
+
+from pygazebo import pygazebo
+from pygazebo import wire
+from pygazebo.msg import contacts_pb2
+from pygazebo.msg import pose_v_pb2
+
+from .conftest import wait_until
+
+
+def make_pose_v(names):
+    poses = pose_v_pb2.Pose_V()
+    for i, name in enumerate(names):
+        pose = poses.pose.add()
+        pose.name = name
+        pose.position.x = i
+        pose.position.y = pose.position.z = 0.0
+        pose.orientation.x = pose.orientation.y = 0.0
+        pose.orientation.z = 0.0
+        pose.orientation.w = 1.0
+    return poses
+
+
+class TestVarint(object):
+    def test_round_trip(self):
+        for value in [0, 1, 127, 128, 300, 2 ** 32 + 5]:
+            encoded = wire.encode_varint(value)
+            assert wire.read_varint(encoded, 0) == (value, len(encoded))
+
+    def test_truncated(self):
+        with pytest.raises(pygazebo.ParseError):
+            wire.read_varint(b'\x80', 0)
+
+
+class TestFilterEntities(object):
+    def test_pose_v(self):
+        poses = make_pose_v(['ground', 'robot1', 'robot2', 'robot1::arm'])
+        data = wire.filter_entities(
+            poses.SerializeToString(), 'gazebo.msgs.Pose_V',
+            frozenset(['robot1']))
+
+        result = pose_v_pb2.Pose_V.FromString(data)
+        assert [x.name for x in result.pose] == ['robot1', 'robot1::arm']
+        assert result.pose[0].position.x == 1.0
+
+    def test_bytearray(self):
+        # Messages may also be passed as bytearrays.
+        poses = make_pose_v(['ground', 'robot1'])
+        data = wire.filter_entities(
+            bytearray(poses.SerializeToString()), 'gazebo.msgs.Pose_V',
+            frozenset(['robot1']))
+
+        result = pose_v_pb2.Pose_V.FromString(bytes(data))
+        assert [x.name for x in result.pose] == ['robot1']
+
+    def test_keep_all(self):
+        data = make_pose_v(['a', 'b']).SerializeToString()
+        assert wire.filter_entities(
+            data, 'gazebo.msgs.Pose_V', frozenset(['a', 'b'])) is data
+
+    def test_contacts(self):
+        contacts = contacts_pb2.Contacts()
+        contacts.time.sec = 5
+        contacts.time.nsec = 0
+        for first, second in [('ground::link::collision', 'box::link::c'),
+                              ('robot::wheel::c', 'ground::link::collision')]:
+            contact = contacts.contact.add()
+            contact.collision1 = first
+            contact.collision2 = second
+            contact.time.sec = 5
+            contact.time.nsec = 0
+            contact.world = 'default'
+
+        data = wire.filter_entities(
+            contacts.SerializeToString(), 'gazebo.msgs.Contacts',
+            frozenset(['robot']))
+        result = contacts_pb2.Contacts.FromString(data)
+        assert [x.collision1 for x in result.contact] == ['robot::wheel::c']
+        assert result.time.sec == 5
+
+
+class TestSubscriberNames(object):
+    def test_filtered(self):
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber.msg_type = 'gazebo.msgs.Pose_V'
+        subscriber._message_class = pose_v_pb2.Pose_V
+        subscriber._entity_filter = lambda data: wire.filter_entities(
+            data, 'gazebo.msgs.Pose_V', frozenset(['b']))
+        other = pygazebo.Subscriber('localhost', 1234)
+        other._join(subscriber)
+
+        received = []
+        subscriber.callback = received.append
+        other.callback = received.append
+
+        data = make_pose_v(['a', 'b']).SerializeToString()
+        subscriber._receive(data)
+        assert [x.name for x in received[0].pose] == ['b']
+        assert received[1] == data
+
+    def test_malformed(self):
+        local, remote = socket.socketpair()
+        local.setblocking(False)
+        connection = pygazebo._Connection()
+        connection.attach(local)
+
+        subscriber = pygazebo.Subscriber('localhost', 1234)
+        subscriber._entity_filter = lambda data: wire.filter_entities(
+            data, 'gazebo.msgs.Pose_V', frozenset(['b']))
+        received = []
+        subscriber.callback = received.append
+        subscriber._connections.append(connection)
+
+        # The last entity is cut short.
+        data = make_pose_v(['a', 'b']).SerializeToString()
+        remote.sendall(b''.join(pygazebo._make_frame(data[:-3])))
+        done = asyncio.Future()
+        done.set_result(None)
+        subscriber._connect3(done, connection)
+        asyncio.get_event_loop().run_until_complete(asyncio.sleep(0.05))
+        assert received == []
+
+        # The connection is still read.
+        remote.sendall(b''.join(pygazebo._make_frame(data)))
+        wait_until(lambda: received)
+        assert [x.name for x in pose_v_pb2.Pose_V.FromString(
+            received[0]).pose] == ['b']
+        assert subscriber._connections == [connection]
+        connection.close()
+        remote.close()
+
+
+class TestTypedSubscription(object):
+    # These also run on python 3, where not every generated message
+    # module can be imported.
+    def test_message_class(self):
+        # Neither module is imported by anything else, and the second
+        # is not named after its message type.
+        assert pygazebo.message_class(
+            'gazebo.msgs.WorldControl').__name__ == 'WorldControl'
+        assert pygazebo.message_class(
+            'gazebo.msgs.WorldStatistics').__name__ == 'WorldStatistics'
+        with pytest.raises(RuntimeError):
+            pygazebo.message_class('gazebo.msgs.NotAMessage')
+
+    def test_receive(self, connect):
+        loop = asyncio.get_event_loop()
+        received = []
+        subscriber_manager = connect()
+        subscriber = subscriber_manager.subscribe(
+            '/control', 'gazebo.msgs.WorldControl', received.append,
+            typed=True)
+        publisher_manager = connect()
+        publisher = loop.run_until_complete(publisher_manager.advertise(
+            '/control', 'gazebo.msgs.WorldControl'))
+        wait_until(lambda: publisher._listeners and subscriber._connections)
+
+        message_class = pygazebo.message_class('gazebo.msgs.WorldControl')
+        loop.run_until_complete(publisher.publish(message_class(pause=True)))
+        wait_until(lambda: received)
+        assert isinstance(received[0], pygazebo.LazyMessage)
+        assert received[0].pause